@@ -0,0 +1,87 @@
+"""
+Compares the throughput of dynamic flattening (_flatten_dict) with flattening plans (RecordFlattener), both for
+flattening alone and for full JSON to CSV conversion. Records are copies of the iDigBio fixture records, which have a
+few shapes, and synthetic records with varied fields (see synthetic.varied_records), which rarely share one.
+
+    python benchmarks/bench_flatten.py [--records N] [--repeats N]
+"""
+
+import argparse
+import csv
+import json
+from io import StringIO
+
+import common
+import synthetic
+from conftest import resource
+from tools.convert_json_csv import (
+    RecordFlattener,
+    _flatten_dict,
+    _flattened_keys,
+    _json_to_csv,
+)
+
+
+def load_records(count: int) -> list[dict]:
+    fixtures = (
+        json.loads(resource("list_of_idigbio_records.json"))
+        + json.loads(resource("idigbio_records_search_result.json"))["items"]
+    )
+    # Round-trip through JSON so that every record is a distinct object, like parsed artifact content
+    return json.loads(json.dumps([fixtures[i % len(fixtures)] for i in range(count)]))
+
+
+def flatten_dynamic(records: list[dict]):
+    for record in records:
+        _flatten_dict(record)
+
+
+def flatten_planned(records: list[dict]):
+    flattener = RecordFlattener()
+    flattener.fieldnames(records)
+    for record in records:
+        flattener.row(record)
+
+
+def convert_dynamic(records: list[dict]) -> str:
+    """JSON to CSV conversion as it was before flattening plans."""
+    output = StringIO()
+    writer = csv.DictWriter(
+        output, fieldnames=sorted({k for r in records for k in _flattened_keys(r)})
+    )
+    writer.writeheader()
+    for record in records:
+        writer.writerow(_flatten_dict(record))
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    datasets = {
+        "fixture": load_records(args.records),
+        "varied": synthetic.varied_records(args.records),
+    }
+    print(f"{args.records} records, best of {args.repeats} runs")
+    print(f"{'records':<8} {'benchmark':<12} {'method':<8} {'records/sec':>12}")
+    for dataset, records in datasets.items():
+        assert convert_dynamic(records) == _json_to_csv(records)
+        cases = [
+            ("flatten", "dynamic", lambda: flatten_dynamic(records)),
+            ("flatten", "planned", lambda: flatten_planned(records)),
+            ("json_to_csv", "dynamic", lambda: convert_dynamic(records)),
+            ("json_to_csv", "planned", lambda: _json_to_csv(records)),
+        ]
+        baseline = {}
+        for name, method, func in cases:
+            rate = args.records / common.best_of(args.repeats, func)
+            speedup = f"  ({rate / baseline[name]:.2f}x)" if name in baseline else ""
+            baseline.setdefault(name, rate)
+            print(f"{dataset:<8} {name:<12} {method:<8} {rate:>12,.0f}{speedup}")
+
+
+if __name__ == "__main__":
+    main()
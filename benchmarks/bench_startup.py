@@ -0,0 +1,135 @@
+"""
+Measures how long it takes to import the agent, which is most of the time it takes a worker process to start serving,
+with `python -X importtime`. Exits with status 1 if any module that should only be imported lazily is imported at
+startup, if importing takes longer than --max-seconds, or if it got slower than the threshold allows since a
+--baseline written by an earlier run.
+
+    python benchmarks/bench_startup.py [--repeats N] [--top N] [--max-seconds S]
+    python benchmarks/bench_startup.py --output before.json
+    python benchmarks/bench_startup.py --baseline before.json [--threshold 0.2]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import common
+
+LAZY_MODULES = [
+    "langchain.agents",
+    "langchain_openai",
+    "openai",
+    "instructor",
+    "genson",
+    "jq",
+    "tools",
+]
+"""Modules that the agent imports on first use, or in the background once it is serving, instead of at startup."""
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> tuple[float, dict[str, float], set[str]]:
+    """
+    Imports the module in a fresh interpreter, returning how long that took, the cumulative import time of each of its
+    own imports, in seconds, and every module that was imported.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=common.ROOT / "src",
+        env=os.environ | {"PYTHONPATH": str(common.ROOT / "src")},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total, times, imported = 0.0, {}, set()
+    for match in IMPORT_TIME_LINE.finditer(completed.stderr):
+        _, cumulative, indent, name = match.groups()
+        imported.add(name)
+        # Each level of nesting is indented by two more spaces, and a module is listed after its own imports
+        if len(indent) == 1 and name == module:
+            total = int(cumulative) / 1_000_000
+        elif len(indent) == 3:
+            times[name] = int(cumulative) / 1_000_000
+    return total, times, imported
+
+
+def eager_imports(imported: set[str]) -> list[str]:
+    return sorted(
+        name
+        for name in imported
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="agent", help="The module to import")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--top", type=int, default=10, help="How many of the slowest imports to list"
+    )
+    parser.add_argument(
+        "--max-seconds", type=float, help="The longest the import may take"
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="Results of an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="The largest allowed increase over the baseline, as a fraction",
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the results")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeats)]
+    totals = [total for total, _, _ in runs]
+    median = statistics.median(totals)
+    _, times, imported = runs[totals.index(statistics.median_high(totals))]
+
+    print(f"Importing {args.module} takes {median:.3f}s (median of {args.repeats})")
+    for name, seconds in sorted(times.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"  {seconds:>7.3f}s  {name}")
+
+    failures = []
+    eager = eager_imports(imported)
+    if eager:
+        failures.append(f"Imported at startup: {', '.join(eager)}")
+    if args.max_seconds is not None and median > args.max_seconds:
+        failures.append(f"Took longer than {args.max_seconds:.3f}s")
+    if args.baseline:
+        before = json.loads(args.baseline.read_text())["median_seconds"]
+        change = median / before - 1
+        print(f"Changed by {change:+.1%} since the baseline ({before:.3f}s)")
+        if change > args.threshold:
+            failures.append(f"Got slower by more than {args.threshold:.0%}")
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(
+            json.dumps(
+                {
+                    "module": args.module,
+                    "python": sys.version.split()[0],
+                    "median_seconds": median,
+                    "imports": times,
+                },
+                indent=2,
+            )
+        )
+        print(f"Wrote {args.output}")
+
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Measures the throughput, latency and peak memory of each tool on synthetic iDigBio records, at several data sizes.
+Artifacts are served and the LLM is answered with canned queries by a local stub server, so no network access or LLM
+is needed. Each benchmark runs in its own process, so that peak memory is measured per benchmark.
+
+    python benchmarks/bench_tools.py [--sizes 1000,10000,100000] [--cases process_data,join_lists] [--repeats N]
+
+Results are printed as a table and written as JSON to benchmarks/results/<commit>.json, or --output, to be compared
+with benchmarks/compare.py. Synthetic records take about 8 KB each, so 1M records need about 8 GB of disk and
+several times that in memory for most tools.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import common
+import synthetic
+from stubs import StubServer
+
+DEFAULT_SIZES = [1_000, 10_000]
+
+# Each tool case maps to the tool to run, its arguments, and the request the user made. Artifacts are named after the
+# datasets written by synthetic.write_datasets(). The records are also served as a second artifact, to be concatenated.
+ARTIFACTS = {
+    "#0001": "search_result",
+    "#0002": "records",
+    "#0003": "extras",
+    "#0004": "records",
+}
+TOOL_CASES = {
+    "process_data": (
+        "process_data",
+        {"artifact_id": "#0001"},
+        "List the uuid, species and country of each record",
+    ),
+    "query_data": (
+        "query_data",
+        {"artifact_id": "#0002"},
+        "Count the records from each country",
+    ),
+    "aggregate": (
+        "aggregate",
+        {"artifact_id": "#0002", "field": "indexTerms.country"},
+        "Count the records from each country",
+    ),
+    "join_lists_on_key": (
+        "join_lists",
+        {"artifact_one_id": "#0002", "artifact_two_id": "#0003", "on": ["uuid"]},
+        "Join the samples to the records",
+    ),
+    "join_lists_by_index": (
+        "join_lists",
+        {"artifact_one_id": "#0002", "artifact_two_id": "#0003"},
+        "Join the two lists",
+    ),
+    "concat_lists": (
+        "concat_lists",
+        {"artifact_one_id": "#0002", "artifact_two_id": "#0004"},
+        "Concatenate the lists",
+    ),
+    "convert_json_csv": (
+        "convert_json_csv",
+        {"artifact_id": "#0002", "output_format": "csv"},
+        "Convert the records to CSV",
+    ),
+}
+CASES = [*TOOL_CASES, "extract_json_schema"]
+
+
+def _max_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+async def _tool_runner(case: str, server_url: str) -> Callable[[], Awaitable]:
+    from ichatbio.agent_response import ArtifactResponse, ResponseContext
+    from ichatbio.test_utils import InMemoryResponseChannel
+    from ichatbio.types import Artifact
+    from langchain.tools import BaseTool, tool as make_tool
+
+    from artifact_registry import ArtifactRegistry
+    from context import current_artifacts, current_context, current_request
+
+    tool_name, arguments, request = TOOL_CASES[case]
+    tool = getattr(importlib.import_module(f"tools.{tool_name}"), tool_name)
+    if not isinstance(tool, BaseTool):
+        # The agent turns plain functions into tools the same way
+        tool = make_tool(tool)
+
+    messages = []
+    current_context.set(ResponseContext(InMemoryResponseChannel(messages)))
+    current_request.set(request)
+    current_artifacts.set(
+        ArtifactRegistry(
+            [
+                Artifact(
+                    local_id=local_id,
+                    mimetype="application/json",
+                    description=f"Synthetic {name}",
+                    uris=[f"{server_url}/artifacts/{name}"],
+                    metadata={},
+                )
+                for local_id, name in ARTIFACTS.items()
+            ]
+        )
+    )
+
+    async def run():
+        messages.clear()
+        await tool.ainvoke(arguments)
+        if not any(isinstance(m, ArtifactResponse) for m in messages):
+            logs = [getattr(m, "text", "") for m in messages]
+            raise RuntimeError(f"{case} made no artifact: {logs}")
+
+    return run
+
+
+def run_child(case: str, records: int, repeats: int, server_url: str, data_dir: str):
+    """Runs one benchmark in this process and prints its result as JSON."""
+    import logging
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.update(
+        OPENAI_API_KEY="benchmark",
+        OPENAI_BASE_URL=f"{server_url}/v1",
+        LLM=os.getenv("LLM", "benchmark-model"),
+        NO_PROXY="127.0.0.1",
+    )
+
+    async def measure() -> tuple[list[float], int, int]:
+        if case == "extract_json_schema":
+            from tools.util import extract_json_schema
+
+            with open(Path(data_dir) / f"records_{records}.json") as file:
+                content = json.load(file)
+
+            async def run():
+                extract_json_schema(content)
+
+        else:
+            run = await _tool_runner(case, server_url)
+
+        baseline_rss = _max_rss_bytes()
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await run()
+            seconds.append(time.perf_counter() - start)
+        return seconds, baseline_rss, _max_rss_bytes()
+
+    seconds, baseline_rss, peak_rss = asyncio.run(measure())
+    median = statistics.median(seconds)
+    print(
+        json.dumps(
+            {
+                "case": case,
+                "records": records,
+                "runs": len(seconds),
+                "median_seconds": median,
+                "min_seconds": min(seconds),
+                "max_seconds": max(seconds),
+                "records_per_second": records / median,
+                "peak_rss_bytes": peak_rss,
+                "rss_growth_bytes": peak_rss - baseline_rss,
+            }
+        )
+    )
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=common.ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _run_case(
+    case: str, records: int, repeats: int, server_url: str, data_dir: Path
+) -> dict:
+    child = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            case,
+            str(records),
+            str(repeats),
+            server_url,
+            str(data_dir),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if child.returncode != 0:
+        error = child.stderr.strip().splitlines()[-1:] or ["no output"]
+        return {"case": case, "records": records, "error": error[0]}
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def _format_bytes(size: int) -> str:
+    return f"{size / 1024 / 1024:,.0f} MiB"
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        case, records, repeats, server_url, data_dir = sys.argv[2:]
+        run_child(case, int(records), int(repeats), server_url, data_dir)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma-separated numbers of records",
+    )
+    parser.add_argument(
+        "--cases",
+        type=lambda s: s.split(","),
+        default=CASES,
+        help=f"Comma-separated benchmarks, out of {', '.join(CASES)}",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--data-dir", type=Path, help="Where to keep the synthetic data"
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the results")
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    output = args.output or common.ROOT / "benchmarks" / "results" / f"{commit}.json"
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark-data-") as temporary_dir:
+        data_dir = args.data_dir or Path(temporary_dir)
+        print(
+            f"{'benchmark':<20} {'records':>9} {'median':>9} {'records/sec':>12} {'peak RSS':>10}"
+        )
+        for size in args.sizes:
+            datasets = synthetic.write_datasets(data_dir, size, args.seed)
+            with StubServer({name: path for name, path in datasets.items()}) as server:
+                for case in args.cases:
+                    result = _run_case(case, size, args.repeats, server.url(), data_dir)
+                    results.append(result)
+                    if "error" in result:
+                        print(f"{case:<20} {size:>9,} failed: {result['error']}")
+                        continue
+                    print(
+                        f"{case:<20} {size:>9,} {result['median_seconds']:>8.3f}s"
+                        f" {result['records_per_second']:>12,.0f}"
+                        f" {_format_bytes(result['peak_rss_bytes']):>10}"
+                    )
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "repeats": args.repeats,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
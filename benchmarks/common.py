@@ -0,0 +1,26 @@
+"""
+Shared setup for benchmark scripts. Importing this module makes the agent's modules and test resources importable the
+same way they are under pytest, so benchmarks can be run directly, e.g.
+
+    python benchmarks/bench_flatten.py
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT / "src", ROOT / "tests"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+def best_of(repeats: int, func: Callable[[], object]) -> float:
+    """Returns the fastest of several runs of func, in seconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
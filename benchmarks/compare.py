@@ -0,0 +1,64 @@
+"""
+Compares two results files written by bench_tools.py, e.g. those of a branch and of main, and exits with status 1 if
+any benchmark got slower or used more memory than the threshold allows.
+
+    python benchmarks/compare.py benchmarks/results/<before>.json benchmarks/results/<after>.json [--threshold 0.1]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+METRICS = [("median_seconds", "time"), ("peak_rss_bytes", "peak RSS")]
+
+
+def load_results(path: Path) -> dict[tuple[str, int], dict]:
+    results = json.loads(path.read_text())["results"]
+    return {(result["case"], result["records"]): result for result in results}
+
+
+def compare(before: dict, after: dict, threshold: float) -> tuple[list[str], bool]:
+    """Returns a line of comparison for each benchmark in both results, and whether any of them regressed."""
+    lines, regressed = [], False
+    for key in sorted(before.keys() & after.keys()):
+        case, records = key
+        old, new = before[key], after[key]
+        if "error" in old or "error" in new:
+            lines.append(f"{case:<20} {records:>9,} {new.get('error', 'fixed')}")
+            regressed |= "error" in new
+            continue
+        changes = []
+        for metric, label in METRICS:
+            change = new[metric] / old[metric] - 1
+            flag = ""
+            if change > threshold:
+                flag, regressed = " !", True
+            changes.append(f"{label} {change:>+7.1%}{flag}")
+        lines.append(f"{case:<20} {records:>9,} " + "   ".join(changes))
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="The largest allowed increase, as a fraction",
+    )
+    args = parser.parse_args()
+
+    lines, regressed = compare(
+        load_results(args.before), load_results(args.after), args.threshold
+    )
+    print("\n".join(lines) or "No benchmarks in common")
+    if regressed:
+        print(f"Regressions of more than {args.threshold:.0%} are marked with !")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
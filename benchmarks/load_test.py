@@ -0,0 +1,236 @@
+"""
+Load-tests the agent's web app, as built by agent.create_app(), by sending it requests from N concurrent clients. The
+LLM and artifacts are served by the stub server in stubs.py, with a configurable latency and error rate, so that the
+results show how the agent itself holds up under load.
+
+    python benchmarks/load_test.py [--concurrency 10] [--requests 100] [--latency lognormal:0.5,0.3] [--error-rate 0]
+
+Reports requests per second, latency percentiles and the outcome of each request, and optionally writes them as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+import common  # noqa: F401 (makes the agent importable)
+import synthetic
+from stubs import Latency, Script, StubServer
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def make_request(text: str, artifact_url: str) -> dict:
+    """A JSON-RPC request that sends the agent a message, as iChatBio does."""
+    artifact = {
+        "local_id": "#0001",
+        "mimetype": "application/json",
+        "description": "Synthetic iDigBio search results",
+        "uris": [artifact_url],
+        "metadata": {},
+    }
+    return {
+        "jsonrpc": "2.0",
+        "id": str(uuid.uuid4()),
+        "method": "message/send",
+        "params": {
+            "message": {
+                "role": "user",
+                "messageId": str(uuid.uuid4()),
+                "parts": [
+                    {"kind": "text", "text": text},
+                    {
+                        "kind": "data",
+                        "data": {
+                            "entrypoint": {
+                                "id": "process_data",
+                                "parameters": {"artifacts": [artifact]},
+                            }
+                        },
+                    },
+                ],
+            }
+        },
+    }
+
+
+async def send(client: httpx.AsyncClient, url: str, body: dict) -> tuple[float, str]:
+    """Sends a request and returns how long it took and how it ended: the state of its task, or an error."""
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=body)
+        outcome = f"http_{response.status_code}"
+        if response.is_success:
+            reply = response.json()
+            outcome = (
+                reply["result"]["status"]["state"]
+                if "result" in reply
+                else f"error_{reply['error']['code']}"
+            )
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    return time.perf_counter() - start, outcome
+
+
+async def run_load(
+    url: str, artifact_url: str, args
+) -> tuple[list[float], Counter, float]:
+    latencies, outcomes = [], Counter()
+    remaining = iter(range(args.requests))
+
+    async def client_loop(client: httpx.AsyncClient):
+        for _ in remaining:
+            seconds, outcome = await send(
+                client, url, make_request(args.request, artifact_url)
+            )
+            latencies.append(seconds)
+            outcomes[outcome] += 1
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(args.concurrency)))
+        return latencies, outcomes, time.perf_counter() - start
+
+
+async def serve_agent_and_run_load(
+    artifact_url: str, args
+) -> tuple[list[float], Counter, float]:
+    import agent
+
+    config = uvicorn.Config(
+        agent.create_app(), host="127.0.0.1", port=0, log_level="warning"
+    )
+    server = uvicorn.Server(config)
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()  # Raises whatever stopped the server
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    try:
+        return await run_load(f"http://127.0.0.1:{port}/", artifact_url, args)
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def report(
+    latencies: list[float], outcomes: Counter, seconds: float, stub: StubServer, args
+) -> dict:
+    return {
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "seconds": seconds,
+        "requests_per_second": len(latencies) / seconds,
+        "latency_seconds": {
+            "mean": statistics.mean(latencies),
+            **{f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+            "max": max(latencies),
+        },
+        "outcomes": dict(outcomes),
+        "llm": {
+            "latency": args.latency.distribution,
+            "latency_parameters": args.latency.parameters,
+            "error_rate": args.error_rate,
+            "completions": stub.completions,
+            "injected_errors": stub.injected_errors,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument(
+        "--records",
+        type=int,
+        default=100,
+        help="Records in the artifact each request processes",
+    )
+    parser.add_argument(
+        "--request", default="List the uuid, species and country of each record"
+    )
+    parser.add_argument(
+        "--latency",
+        type=Latency.parse,
+        default=Latency(),
+        help='LLM latency, e.g. "lognormal:0.5,0.3"',
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of LLM responses that fail",
+    )
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--agent-tool",
+        default="process_data",
+        help="The tool the stub LLM has the agent call",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Seconds to wait for each response"
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Where to write the results as JSON"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix="load-test-") as data_dir:
+        datasets = synthetic.write_datasets(Path(data_dir), args.records)
+        script = Script(agent_tool=args.agent_tool)
+        with StubServer(
+            datasets, script, args.latency, args.error_rate, args.error_status
+        ) as stub:
+            os.environ.update(
+                OPENAI_API_KEY="stub",
+                OPENAI_BASE_URL=stub.url("/v1"),
+                LLM=os.getenv("LLM", "stub-model"),
+                NO_PROXY="127.0.0.1",
+            )
+            latencies, outcomes, seconds = asyncio.run(
+                serve_agent_and_run_load(stub.url("/artifacts/search_result"), args)
+            )
+            results = report(latencies, outcomes, seconds, stub, args)
+
+    latency = results["latency_seconds"]
+    print(
+        f"{results['requests']} requests from {args.concurrency} clients in {seconds:.1f}s:"
+        f" {results['requests_per_second']:.1f} requests/sec"
+    )
+    print(
+        "latency "
+        + "  ".join(f"{name} {value:.3f}s" for name, value in latency.items())
+    )
+    print(
+        "outcomes "
+        + ", ".join(f"{outcome}: {count}" for outcome, count in outcomes.most_common())
+    )
+    print(
+        f"LLM completions: {stub.completions}, injected errors: {stub.injected_errors}"
+    )
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+A local stand-in for the services the agent talks to, so that benchmarks and load tests measure the agent rather than
+the network or an LLM. It serves files as artifacts and an OpenAI-compatible chat completions API that answers with
+scripted tool calls: the agent's first call runs a tool on the first artifact it's given, after which it finishes, and
+the tools' queries are canned jq and SQL queries. Responses can be delayed by a latency distribution, and a fraction
+of them can fail, to see how the agent behaves against a slow or flaky LLM.
+
+It can also be run on its own, e.g. to load-test an agent started separately with OPENAI_BASE_URL pointing at it:
+
+    python benchmarks/stubs.py --port 8765 --latency lognormal:0.8,0.5 --error-rate 0.02
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+CANNED_JQ_QUERY = "[.items[] | {uuid, scientificname: .indexTerms.scientificname, country: .indexTerms.country}]"
+CANNED_SQL_QUERY = 'SELECT "indexTerms.country" AS country, COUNT(*) AS records FROM records GROUP BY 1 ORDER BY 2 DESC'
+
+_LOCAL_ID = re.compile(r"local_id: (#[0-9a-f]{4})")
+
+
+@dataclass
+class Latency:
+    """
+    A distribution of response delays, in seconds, parsed from a spec like "0.5" (fixed), "uniform:0.2,1.0",
+    "lognormal:<median>,<sigma>" or "exponential:<mean>".
+    """
+
+    distribution: str = "fixed"
+    parameters: tuple[float, ...] = (0.0,)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        distribution, _, parameters = spec.rpartition(":")
+        latency = cls(
+            distribution or "fixed",
+            tuple(float(p) for p in parameters.split(",")),
+        )
+        arity = {"fixed": 1, "uniform": 2, "lognormal": 2, "exponential": 1}
+        if arity.get(latency.distribution) != len(latency.parameters):
+            raise ValueError(f"Invalid latency: {spec}")
+        return latency
+
+    def sample(self, rng: random.Random) -> float:
+        match self.distribution, self.parameters:
+            case "uniform", (low, high):
+                return rng.uniform(low, high)
+            case "lognormal", (median, sigma):
+                return median * rng.lognormvariate(0, sigma)
+            case "exponential", (mean,):
+                return rng.expovariate(1 / mean) if mean else 0.0
+            case _, (seconds,):
+                return seconds
+
+
+@dataclass
+class Script:
+    """What the stub LLM says. The agent calls agent_tool, with artifact_id set to the first artifact if it takes one."""
+
+    agent_tool: str = "process_data"
+    agent_tool_arguments: dict = field(default_factory=dict)
+    jq_query: str = CANNED_JQ_QUERY
+    sql_query: str = CANNED_SQL_QUERY
+
+
+def _tool_call(index: int, name: str, arguments: dict) -> dict:
+    return {
+        "id": f"call_{index}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+def scripted_tool_calls(
+    script: Script, messages: list[dict], tools: list[dict]
+) -> list[dict]:
+    """The tool calls that answer a chat completion request, following the script."""
+    names = [tool["function"]["name"] for tool in tools]
+
+    # Query generation, which tools ask for through a single response model
+    if "finish" not in names:
+        if "sql_query" in json.dumps(tools):
+            response = {
+                "plan": "Count records per country",
+                "sql_query": script.sql_query,
+            }
+        else:
+            response = {
+                "plan": "Select fields of each record",
+                "jq_query_string": script.jq_query,
+            }
+        response["output_description"] = "Stub output"
+        return [_tool_call(0, names[0], {"response": response})]
+
+    # The agent loop: run the tool, then finish once it has returned
+    if any(message.get("role") == "tool" for message in messages):
+        return [_tool_call(0, "finish", {"message": "Done"})]
+    arguments = dict(script.agent_tool_arguments)
+    tool = next(tool for tool in tools if tool["function"]["name"] == script.agent_tool)
+    if "artifact_id" in tool["function"].get("parameters", {}).get("properties", {}):
+        local_ids = _LOCAL_ID.findall(json.dumps(messages[0].get("content", "")))
+        arguments.setdefault("artifact_id", local_ids[0] if local_ids else "#0000")
+    return [_tool_call(0, script.agent_tool, arguments)]
+
+
+def completion(model: str, tool_calls: list[dict]) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": tool_calls,
+                },
+            }
+        ],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 50, "total_tokens": 1050},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StubServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.server.artifacts.get(self.path.removeprefix("/artifacts/"))
+        if path is None:
+            self._send(404, b'{"error": "not found"}')
+            return
+        self._send(200, path.read_bytes())
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not (self.path.endswith("/chat/completions") and body.get("tools")):
+            self._send(404, b'{"error": "not found"}')
+            return
+
+        delay, fail = self.server.draw()
+        time.sleep(delay)
+        if fail:
+            error = {"error": {"message": "Injected error", "type": "server_error"}}
+            self._send(self.server.error_status, json.dumps(error).encode())
+            return
+        tool_calls = scripted_tool_calls(
+            self.server.script, body["messages"], body["tools"]
+        )
+        self._send(200, json.dumps(completion(body["model"], tool_calls)).encode())
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Serves files as artifacts at /artifacts/<name> and an OpenAI-compatible chat completions API at /v1, from a
+    background thread, e.g.
+
+        with StubServer({"records": path}, latency=Latency.parse("lognormal:0.5,0.3")) as server:
+            os.environ["OPENAI_BASE_URL"] = server.url("/v1")
+
+    Chat completions are delayed by a sample of the latency distribution, and fail with error_status at error_rate.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        artifacts: dict[str, Path] = None,
+        script: Script = None,
+        latency: Latency = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.artifacts = dict(artifacts or {})
+        self.script = script or Script()
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.completions = 0
+        self.injected_errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def draw(self) -> tuple[float, bool]:
+        """Draws the delay of a completion and whether it fails."""
+        with self._lock:
+            self.completions += 1
+            fail = self._rng.random() < self.error_rate
+            self.injected_errors += fail
+            return self.latency.sample(self._rng), fail
+
+    def url(self, path: str = "") -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency",
+        type=Latency.parse,
+        default=Latency(),
+        help='e.g. "lognormal:0.8,0.5"',
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--agent-tool", default="process_data", help="The tool the agent calls"
+    )
+    parser.add_argument(
+        "--agent-tool-arguments",
+        type=json.loads,
+        default={},
+        help='Extra arguments of the tool, as JSON, e.g. \'{"field": "indexTerms.country"}\'',
+    )
+    parser.add_argument("--jq-query", default=CANNED_JQ_QUERY)
+    parser.add_argument("--sql-query", default=CANNED_SQL_QUERY)
+    parser.add_argument(
+        "--artifact",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="Serves the file at PATH as /artifacts/NAME",
+    )
+    args = parser.parse_args()
+
+    artifacts = dict(artifact.split("=", 1) for artifact in args.artifact)
+    server = StubServer(
+        {name: Path(path) for name, path in artifacts.items()},
+        Script(
+            args.agent_tool, args.agent_tool_arguments, args.jq_query, args.sql_query
+        ),
+        args.latency,
+        args.error_rate,
+        args.error_status,
+        args.port,
+    )
+    print(f"Serving the stub LLM at {server.url('/v1')}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Generates synthetic iDigBio records for benchmarks. Records are copies of the records in
+tests/resources/idigbio_records_search_result.json, with their identifiers, names, collectors, countries, dates and
+coordinates varied, so that they have the shape of real records but values spread like those of a real dataset.
+
+Records are written as JSON text straight from templates, so generating a million of them doesn't need them all in
+memory.
+"""
+
+import json
+import random
+import re
+import uuid
+from pathlib import Path
+from typing import IO, Iterator
+
+import common  # noqa: F401 (makes test resources importable)
+from conftest import resource
+
+COUNTRIES = [
+    ("united states", "US", 40),
+    ("brazil", "BR", 10),
+    ("mexico", "MX", 8),
+    ("canada", "CA", 8),
+    ("australia", "AU", 7),
+    ("china", "CN", 5),
+    ("south africa", "ZA", 4),
+    ("madagascar", "MG", 3),
+    ("peru", "PE", 3),
+    ("indonesia", "ID", 3),
+    ("france", "FR", 2),
+    ("japan", "JP", 2),
+    ("kenya", "KE", 2),
+    ("new zealand", "NZ", 1),
+    ("norway", "NO", 1),
+    ("chile", "CL", 1),
+]
+
+_SYLLABLES = [
+    "ar",
+    "bo",
+    "ca",
+    "de",
+    "el",
+    "fi",
+    "go",
+    "hu",
+    "is",
+    "ju",
+    "ka",
+    "lo",
+    "mi",
+    "no",
+    "pe",
+    "ra",
+    "su",
+]
+_TOKEN = re.compile(r'"@@(\w+)@@"')
+
+# Fields of the fixture records that are varied, and the value each one takes
+_VARIED_FIELDS = {
+    ("uuid",): "uuid",
+    ("indexTerms", "uuid"): "uuid",
+    ("data", "dwc:occurrenceID"): "uuid",
+    ("indexTerms", "scientificname"): "scientificname",
+    ("data", "dwc:scientificName"): "scientificname",
+    ("indexTerms", "genus"): "genus",
+    ("data", "dwc:genus"): "genus",
+    ("indexTerms", "country"): "country",
+    ("data", "dwc:country"): "country",
+    ("indexTerms", "countrycode"): "countrycode",
+    ("data", "dwc:countryCode"): "countrycode",
+    ("indexTerms", "recordedby"): "recordedby",
+    ("data", "dwc:recordedBy"): "recordedby",
+    ("indexTerms", "eventdate"): "eventdate",
+    ("data", "dwc:eventDate"): "eventdate",
+    ("indexTerms", "datecollected"): "datecollected",
+    ("indexTerms", "geopoint", "lat"): "lat",
+    ("indexTerms", "geopoint", "lon"): "lon",
+    ("data", "dwc:decimalLatitude"): "lat_text",
+    ("data", "dwc:decimalLongitude"): "lon_text",
+}
+
+
+def _word(rng: random.Random, syllables: int) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(syllables))
+
+
+def _templates() -> list[list[str]]:
+    """
+    Turns each fixture record into a template: a list that alternates between JSON text and the names of the values
+    to put between it.
+    """
+    templates = []
+    for record in json.loads(resource("idigbio_records_search_result.json"))["items"]:
+        for path, name in _VARIED_FIELDS.items():
+            parent = record
+            for key in path[:-1]:
+                parent = parent.setdefault(key, {})
+            parent[path[-1]] = f"@@{name}@@"
+        templates.append(_TOKEN.split(json.dumps(record)))
+    return templates
+
+
+class RecordGenerator:
+    """Generates the same records for the same seed."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.templates = _templates()
+        genera = [_word(self.rng, 3) for _ in range(400)]
+        self.species = [
+            (genus, f"{genus} {_word(self.rng, 3)}")
+            for genus in genera
+            for _ in range(5)
+        ]
+        self.collectors = [
+            f"{_word(self.rng, 2).title()} {_word(self.rng, 3).title()}"
+            for _ in range(1000)
+        ]
+        self.countries = [(name, code) for name, code, _ in COUNTRIES]
+        self.country_weights = [weight for _, _, weight in COUNTRIES]
+
+    def values(self) -> dict:
+        rng = self.rng
+        genus, scientificname = rng.choice(self.species)
+        country, countrycode = rng.choices(self.countries, self.country_weights)[0]
+        date = (
+            f"{rng.randint(1850, 2024)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}"
+        )
+        lat, lon = round(rng.uniform(-60, 70), 4), round(rng.uniform(-180, 180), 4)
+        return {
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "scientificname": scientificname,
+            "genus": genus,
+            "country": country,
+            "countrycode": countrycode,
+            # Most collectors collect a few records, and a few collect many
+            "recordedby": self.collectors[
+                int(rng.paretovariate(1.2)) % len(self.collectors)
+            ],
+            "eventdate": date,
+            "datecollected": f"{date}T00:00:00+00:00",
+            "lat": lat,
+            "lon": lon,
+            "lat_text": str(lat),
+            "lon_text": str(lon),
+        }
+
+    def record_text(self, values: dict) -> str:
+        template = self.templates[self.rng.randrange(len(self.templates))]
+        parts = template[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = json.dumps(values[parts[i]])
+        return "".join(parts)
+
+    def records(self, count: int) -> Iterator[tuple[dict, str]]:
+        """Yields the varied values and the JSON text of each record."""
+        for _ in range(count):
+            values = self.values()
+            yield values, self.record_text(values)
+
+
+def varied_records(count: int, seed: int = 0, missing: float = 0.2) -> list[dict]:
+    """
+    Generates records whose fields vary like those of records from many sources: each field of their "data" and
+    "indexTerms" is left out with probability `missing`, so that few records have the same set of fields.
+    """
+    generator = RecordGenerator(seed)
+    rng = random.Random(seed)
+    records = []
+    for _, text in generator.records(count):
+        record = json.loads(text)
+        for section in ("data", "indexTerms"):
+            fields = record.get(section, {})
+            for key in [key for key in fields if rng.random() < missing]:
+                del fields[key]
+        records.append(record)
+    return records
+
+
+def write_datasets(directory: Path, count: int, seed: int = 0) -> dict[str, Path]:
+    """
+    Writes the datasets used by the benchmarks, each holding `count` records:
+
+    - search_result: an iDigBio search API response, with the records under "items"
+    - records: a plain list of the same records
+    - extras: a list of small records that share the records' uuids, in a different order, for joins
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {
+        name: directory / f"{name}_{count}.json"
+        for name in ("search_result", "records", "extras")
+    }
+    extras = []
+    with (
+        open(paths["search_result"], "w") as search_result,
+        open(paths["records"], "w") as records,
+    ):
+        search_result.write(
+            f'{{"itemCount": {count}, "lastModified": "2025-03-13T17:41:08.768Z", "items": ['
+        )
+        records.write("[")
+        for i, (values, text) in enumerate(RecordGenerator(seed).records(count)):
+            separator = ", " if i else ""
+            search_result.write(separator + text)
+            records.write(separator + text)
+            extras.append({"uuid": values["uuid"], "sample": i})
+        search_result.write("]}")
+        records.write("]")
+
+    random.Random(seed).shuffle(extras)
+    with open(paths["extras"], "w") as file:
+        _write_list(file, extras)
+    return paths
+
+
+def _write_list(file: IO[str], records: list[dict]):
+    file.write("[")
+    for i, record in enumerate(records):
+        file.write((", " if i else "") + json.dumps(record))
+    file.write("]")
@@ -1,7 +1,13 @@
 import uvicorn
 
-import agent
+from scheduling import worker_count
 
 if __name__ == "__main__":
-    app = agent.create_app()
-    uvicorn.run(app, host="0.0.0.0", port=9999)
+    # Worker processes each build the app from the factory, so it's passed by name
+    uvicorn.run(
+        "agent:create_app",
+        factory=True,
+        host="0.0.0.0",
+        port=9999,
+        workers=worker_count(),
+    )
@@ -8,30 +8,53 @@ successfully fulfilled the user's request ("finish") or that it isn't able to do
 See the flowchart in README.md for a visualization of the agent.
 """
 
+import asyncio
+import importlib
+import logging
 import os
-from typing import Any, Iterable, override
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Iterable, override
 
 import dotenv
-import langchain.agents
+import httpx
 from ichatbio.agent import IChatBioAgent
 from ichatbio.agent_response import ResponseContext
 from ichatbio.server import build_agent_app
 from ichatbio.types import AgentCard, AgentEntrypoint, Artifact
-from langchain.tools import tool
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 
 from artifact_registry import ArtifactRegistry
 from context import current_artifacts, current_context, current_request
-from tools.concat_lists import concat_lists
-from tools.convert_json_csv import convert_json_csv
-from tools.join_lists import join_lists
-from tools.process_data import process_data
-from util import get_llm_client_kwargs, update_llm_credentials
+from metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    Gauge,
+    langchain_usage,
+    record_llm_usage,
+    render_metrics,
+    timed,
+)
+from resilience import LLM_UNAVAILABLE_MESSAGE, is_llm_available, llm_http_client
+from routing import record_outcome, route
+from scheduling import RUN_POOL
+from tracing import trace_request, tracing_enabled
+from util import (
+    close_shared_clients,
+    get_llm_client_kwargs,
+    tenant_key,
+    update_llm_credentials,
+)
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DESCRIPTION = """\
 Reads and processes JSON artifacts. This agent can do the following:
 - Extract a set of fields from an object
@@ -50,6 +73,11 @@ lightweight JSON processing tool.
 """
 
 
+REQUESTS_IN_FLIGHT = Gauge(
+    "agent_requests_in_flight", "Requests that the agent is working on"
+)
+
+
 class EntrypointParameters(BaseModel):
     artifacts: list[Artifact] = Field(
         description="The JSON data to process", min_length=1
@@ -88,9 +116,41 @@ class DataHandlerAgent(IChatBioAgent):
         tool execution), then executes the graph with `request` as input. The tools themselves are responsible for
         sending messages back to iChatBio via the `context` object. To give the tools access to the request context, we
         instantiate new tools each time a request is received; this allows the agent to safely handle concurrent
-        requests.
+        requests. Tool calls made in the same turn run concurrently, each in its own asyncio task with a copy of the
+        request's context variables.
+
+        Runs wait for a slot in the scheduler's run pool first, taking turns with the runs of other tenants.
         """
-        update_llm_credentials(metadata)
+        update_llm_credentials(metadata)  # Also identifies the tenant
+
+        async with trace_request(
+            "agent_run",
+            traceparent=(metadata or {}).get("traceparent"),
+            entrypoint=entrypoint,
+            tenant=tenant_key(),
+            artifacts=len(params.artifacts),
+        ):
+            # Don't queue up behind an LLM endpoint that is known to be unhealthy
+            if not is_llm_available(get_llm_client_kwargs()["base_url"]):
+                await context.reply(LLM_UNAVAILABLE_MESSAGE)
+                return
+
+            async with RUN_POOL.slot():
+                with REQUESTS_IN_FLIGHT.track():
+                    await self._run(context, request, params)
+
+    async def _run(
+        self,
+        context: ResponseContext,
+        request: str,
+        params: EntrypointParameters,
+    ):
+        # LangChain and the LLM clients are slow to import, so they are imported here rather than at startup. warm_up()
+        # imports them in the background once the server is up, so that this is normally instant.
+        import openai
+        from langchain_core.messages import AIMessage
+
+        from middleware import EscalationMiddleware
 
         artifacts = ArtifactRegistry(params.artifacts)
 
@@ -98,61 +158,121 @@ class DataHandlerAgent(IChatBioAgent):
         current_context.set(context)
         current_artifacts.set(artifacts)
 
-        # Build the agent's tools
-
-        @tool(return_direct=True)  # This tool ends the agent loop
-        async def abort(reason: str):
-            """If you can't fulfill the user's request, abort instead and explain why."""
-            await context.reply(reason)
-
-        @tool(return_direct=True)  # This tool ends the agent loop
-        async def finish(message: str):
-            """Mark the user's request as successfully completed."""
-            await context.reply(message)
-
-        tools = [
-            process_data,
-            join_lists,
-            concat_lists,
-            convert_json_csv,
-            abort,
-            finish,
-        ]
-
         # Build a LangChain agent graph
 
-        llm_kwargs = get_llm_client_kwargs()
-        llm = ChatOpenAI(
-            model=os.getenv("LLM"),
-            tool_choice="required",
-            openai_api_key=llm_kwargs["api_key"],
-            openai_api_base=llm_kwargs["base_url"],
-        )
-
-        system_message = make_system_message(params.artifacts)
-        agent = langchain.agents.create_agent(
-            model=llm,
-            tools=tools,
-            system_prompt=system_message,
+        routing = route("agent", request, artifact_count=len(params.artifacts))
+        escalation = None
+        if routing.tier == "small":
+            escalation = EscalationMiddleware(
+                routing, make_chat_model(os.getenv("LLM"))
+            )
+
+        with timed("prompt_build"):
+            system_message = make_system_message(params.artifacts)
+        agent = build_agent_graph(
+            context,
+            make_chat_model(routing.model),
+            system_message,
+            [escalation] if escalation else [],
         )
 
         # Run the graph
 
-        await agent.ainvoke(
-            {
-                "messages": [
-                    {"role": "user", "content": request},
-                ]
-            }
-        )
+        try:
+            with timed("agent_loop"):
+                result = await agent.ainvoke(
+                    {
+                        "messages": [
+                            {"role": "user", "content": request},
+                        ]
+                    }
+                )
+        except openai.APIError:
+            if is_llm_available(get_llm_client_kwargs()["base_url"]):
+                raise
+            await context.reply(LLM_UNAVAILABLE_MESSAGE)
+            return
+
+        for message in result["messages"]:
+            if isinstance(message, AIMessage):
+                record_llm_usage("agent", *langchain_usage(message))
+
+        record_outcome(escalation.routing if escalation else routing, "succeeded")
+
+
+def build_agent_graph(
+    context: ResponseContext | None,
+    model: "ChatOpenAI",
+    system_message: str,
+    middleware: list,
+):
+    """Builds a LangChain agent graph with the agent's tools. The abort and finish tools reply through `context`."""
+    import langchain.agents
+    from langchain.tools import tool
+
+    from middleware import ToolMetricsMiddleware, TracingMiddleware
+    from tools.aggregate import aggregate
+    from tools.concat_lists import concat_lists
+    from tools.convert_json_csv import convert_json_csv
+    from tools.join_lists import join_lists
+    from tools.process_data import process_data
+    from tools.query_data import query_data
+
+    @tool(return_direct=True)  # This tool ends the agent loop
+    async def abort(reason: str):
+        """If you can't fulfill the user's request, abort instead and explain why."""
+        await context.reply(reason)
+
+    @tool(return_direct=True)  # This tool ends the agent loop
+    async def finish(message: str):
+        """Mark the user's request as successfully completed."""
+        await context.reply(message)
+
+    tools = [
+        process_data,
+        query_data,
+        aggregate,
+        join_lists,
+        concat_lists,
+        convert_json_csv,
+        abort,
+        finish,
+    ]
+
+    return langchain.agents.create_agent(
+        model=model,
+        tools=tools,
+        system_prompt=system_message,
+        middleware=[
+            *([TracingMiddleware()] if tracing_enabled() else []),
+            ToolMetricsMiddleware(),
+            *middleware,
+        ],
+    )
+
+
+def make_chat_model(model: str) -> "ChatOpenAI":
+    from langchain_openai import ChatOpenAI
+
+    llm_kwargs = get_llm_client_kwargs()
+    return ChatOpenAI(
+        model=model,
+        tool_choice="required",
+        openai_api_key=llm_kwargs["api_key"],
+        openai_api_base=llm_kwargs["base_url"],
+        http_async_client=llm_http_client(),
+    )
 
 
+# The artifact listing comes last so that the rest of the system message is a stable prefix that providers can cache
 SYSTEM_MESSAGE = """
-You manipulate structured data using tools. You can access the following artifacts:
+You manipulate structured data using tools. If you are unable to fulfill the user's request using your available tools,
+abort and explain why. When the request calls for several operations that don't depend on each other, call all of their
+tools at once so that they run concurrently.
 
-{artifacts}
+You can access the following artifacts:
 
-If you are unable to fulfill the user's request using your available tools, abort and explain why.
+{artifacts}
 """
 
 
@@ -183,4 +303,131 @@ def create_app() -> Starlette:
 
     agent = DataHandlerAgent()
     app = build_agent_app(agent)
+    app.router.lifespan_context = _warm_up_after_startup(app.router.lifespan_context)
+    app.add_route("/metrics", metrics_endpoint, methods=["GET"])
+    app.add_route("/ready", ready_endpoint, methods=["GET"])
     return app
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Serves the agent's operational metrics to Prometheus."""
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+async def ready_endpoint(request: Request) -> Response:
+    """
+    Tells the load balancer whether the agent has finished warming up, and should be sent requests. If warming up
+    failed, the agent is ready all the same, and the body says why it failed.
+    """
+    ready = getattr(request.app.state, "ready", False)
+    body = {"ready": ready}
+    if error := getattr(request.app.state, "warm_up_error", None):
+        body["warm_up_error"] = error
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+WARM_UP_MODULES = [
+    "langchain.agents",
+    "langchain_openai",
+    "openai",
+    "middleware",
+    "tools.aggregate",
+    "tools.concat_lists",
+    "tools.convert_json_csv",
+    "tools.join_lists",
+    "tools.process_data",
+    "tools.query_data",
+]
+"""Modules that requests need but that are too slow to import before the server starts accepting connections."""
+
+WARM_UP_ATTEMPTS = 3
+WARM_UP_RETRY_DELAY_SECONDS = 1.0
+"""How long to wait before trying to warm up again after the first failure. The delay doubles after each failure."""
+
+
+async def warm_up():
+    """
+    Prepares the process for its first requests, which would otherwise wait for it: imports the modules they need,
+    builds an agent graph for LangChain to do its one-off setup, compiles common jq queries, and opens connections to
+    the LLM endpoints and to WARM_UP_URLS.
+    """
+    start = time.perf_counter()
+    await asyncio.to_thread(_warm_up_code)
+    await _open_connections()
+    logger.info(f"Warmed up in {time.perf_counter() - start:.2f} seconds")
+
+
+def _warm_up_code():
+    for module in WARM_UP_MODULES:
+        importlib.import_module(module)
+
+    from langchain_openai import ChatOpenAI
+
+    from tools.process_data import COMMON_JQ_QUERIES, compile_jq
+
+    # The graph is thrown away, and its model never called
+    model = ChatOpenAI(model=os.getenv("LLM"), api_key="warm-up")
+    build_agent_graph(None, model, make_system_message([]), [])
+
+    for query in COMMON_JQ_QUERIES:
+        compile_jq(query)
+
+
+async def _open_connections():
+    from tools.util import artifact_http_client
+
+    llm_urls = {os.getenv("OPENAI_BASE_URL"), os.getenv("PROXY_OPENAI_BASE_URL")}
+    artifact_urls = os.getenv("WARM_UP_URLS", "").split(",")
+    await asyncio.gather(
+        *(_open_connection(llm_http_client(), url) for url in llm_urls if url),
+        *(
+            _open_connection(artifact_http_client(), url)
+            for url in artifact_urls
+            if url
+        ),
+    )
+
+
+async def _open_connection(client: httpx.AsyncClient, url: str):
+    # Any response will do, as the client keeps the connection open for the next request to the same host
+    try:
+        await client.head(url, timeout=10, extensions={"warm_up": True})
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to connect to {url} while warming up: {e}")
+
+
+async def _warm_up_then_report_ready(app: Starlette):
+    """
+    Warms up, trying up to WARM_UP_ATTEMPTS times, then reports that the process is ready. Warming up only saves the
+    first requests some time, so the process is ready even if every attempt failed.
+    """
+    delay = WARM_UP_RETRY_DELAY_SECONDS
+    for attempt in range(1, WARM_UP_ATTEMPTS + 1):
+        try:
+            await warm_up()
+            break
+        except Exception as e:
+            logger.exception(f"Failed to warm up (attempt {attempt})")
+            if attempt == WARM_UP_ATTEMPTS:
+                app.state.warm_up_error = f"{type(e).__name__}: {e}"
+            else:
+                await asyncio.sleep(delay)
+                delay *= 2
+    app.state.ready = True
+
+
+def _warm_up_after_startup(lifespan):
+    @asynccontextmanager
+    async def warm_up_lifespan(app):
+        async with lifespan(app) as state:
+            app.state.ready = False
+            app.state.warm_up_error = None
+            # In the background, so that the server accepts connections meanwhile
+            warming_up = asyncio.create_task(_warm_up_then_report_ready(app))
+            try:
+                yield state
+            finally:
+                warming_up.cancel()
+                await close_shared_clients()
+
+    return warm_up_lifespan
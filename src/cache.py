@@ -0,0 +1,131 @@
+"""
+Caches that are shared by every worker process of the agent, so that adding workers doesn't multiply the memory they
+take or the misses of a cold cache. Each cache is a SQLite database in CACHE_DIR, which processes read and write
+concurrently, and evicts its least recently used entries once it holds more than its size limit. Caching is off
+unless CACHE_DIR is set.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_BUSY_TIMEOUT_MS = 5000
+"""How long to wait for another process that is writing to the cache."""
+
+MAX_ENTRY_FRACTION = 0.25
+"""Values larger than this fraction of a cache's size limit aren't cached, so that one can't evict everything else."""
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Lookups in the shared caches", ("cache", "outcome")
+)
+
+
+def cache_dir() -> Path | None:
+    directory = os.getenv("CACHE_DIR")
+    return Path(directory) if directory else None
+
+
+class DiskCache:
+    """A size-limited cache of byte strings, with JSON metadata, shared between processes."""
+
+    def __init__(self, name: str, max_bytes_env: str, default_max_bytes: int):
+        self.name = name
+        self.max_bytes_env = max_bytes_env
+        self.default_max_bytes = default_max_bytes
+
+    @property
+    def max_bytes(self) -> int:
+        return int(os.getenv(self.max_bytes_env, self.default_max_bytes))
+
+    @property
+    def enabled(self) -> bool:
+        return cache_dir() is not None and self.max_bytes > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = cache_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(
+            directory / f"{self.name}.sqlite3",
+            timeout=CACHE_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+        )
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries"
+            " (key TEXT PRIMARY KEY, value BLOB, metadata TEXT, size INTEGER, accessed REAL)"
+        )
+        return db
+
+    def _metadata(self, key: str) -> dict | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT metadata, size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]) | {"size": row[1]}
+
+    def _get(self, key: str) -> bytes | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ? RETURNING value",
+                (time.time(), key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: bytes, metadata: dict):
+        limit = self.max_bytes
+        if len(value) > limit * MAX_ENTRY_FRACTION:
+            return
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, json.dumps(metadata), len(value), time.time()),
+            )
+            # Evict the least recently used entries beyond the limit
+            db.execute(
+                """
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS total FROM entries
+                    ) WHERE total > ?
+                )
+                """,
+                (limit,),
+            )
+            db.execute("COMMIT")
+
+    async def metadata(self, key: str) -> dict | None:
+        """The metadata of the entry, along with the size of its value, or None if there's no such entry."""
+        try:
+            return await asyncio.to_thread(self._metadata, key)
+        except (sqlite3.Error, OSError):
+            logger.warning(f"Failed to read the {self.name} cache", exc_info=True)
+            return None
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except (sqlite3.Error, OSError):
+            logger.warning(f"Failed to read the {self.name} cache", exc_info=True)
+            return None
+
+    async def set(self, key: str, value: bytes, metadata: dict):
+        try:
+            await asyncio.to_thread(self._set, key, value, metadata)
+        except (sqlite3.Error, OSError):
+            logger.warning(f"Failed to write to the {self.name} cache", exc_info=True)
+
+
+ARTIFACT_CACHE = DiskCache("artifacts", "ARTIFACT_CACHE_MAX_BYTES", 1024**3)
+"""Artifact content, with the HTTP validators it was served with, to revalidate it instead of downloading it again."""
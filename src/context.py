@@ -1,14 +1,18 @@
 from contextvars import ContextVar
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated
 
 from ichatbio.agent_response import ResponseContext
 from pydantic import AfterValidator, Field
 
 from artifact_registry import ArtifactID, ArtifactRegistry
 
+if TYPE_CHECKING:
+    from tracing import Span
+
 current_request: ContextVar[str] = ContextVar("current_request")
 current_context: ContextVar[ResponseContext] = ContextVar("current_context")
 current_artifacts: ContextVar[ArtifactRegistry] = ContextVar("current_artifacts")
+current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
 
 
 def check_artifact_exists(local_id: str):
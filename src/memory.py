@@ -0,0 +1,246 @@
+"""
+Memory accounting and admission control, so that one large artifact can't push the agent out of memory and take down
+every request it is handling at the time.
+
+Each tool call is accounted for by account_memory(), which measures how much the process's resident memory grew while
+the call ran. A sample of calls (MEMORY_TRACE_SAMPLE_RATE) are also traced with tracemalloc, which sees the peak of
+Python allocations, at a cost in speed, so it's meant for debugging.
+
+Before an artifact is parsed, the memory it needs is estimated from its size and checked against what is left of the
+budget (MEMORY_BUDGET_BYTES) by admit(). Admitted estimates are reserved until the call that made them finishes, so
+that concurrent calls can't all be admitted against the same free memory.
+"""
+
+import logging
+import os
+import random
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from metrics import Counter, Gauge, Histogram
+from scheduling import worker_count
+
+logger = logging.getLogger(__name__)
+
+TEXT_MEMORY_FACTOR = 2
+"""Downloaded text is held as bytes and then as a string, for a while both at once."""
+
+PARSED_JSON_MEMORY_FACTOR = 6
+"""Python objects parsed from JSON take two to five times the size of its text, measured on iDigBio records, and the
+text is held alongside them while they're parsed."""
+
+BUDGET_FRACTION = 0.8
+"""Without MEMORY_BUDGET_BYTES, the budget is this fraction of the memory limit of the container or machine, shared
+evenly between worker processes."""
+
+MEMORY_BUCKETS = tuple(2**power for power in range(20, 35, 2))
+"""Upper bounds, in bytes, of the buckets of memory histograms: 1 MiB to 16 GiB, in steps of four."""
+
+_CGROUP_LIMITS = (
+    "/sys/fs/cgroup/memory.max",  # cgroup v2
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+)
+
+MEMORY_GROWTH = Histogram(
+    "tool_memory_growth_bytes",
+    "Growth of the agent's resident memory during each tool call",
+    buckets=MEMORY_BUCKETS,
+)
+MEMORY_TRACED_PEAK = Histogram(
+    "tool_memory_traced_peak_bytes",
+    "Peak Python allocations during tool calls traced with tracemalloc",
+    buckets=MEMORY_BUCKETS,
+)
+MEMORY_RESERVED = Gauge(
+    "memory_reserved_bytes", "Memory reserved by admitted tool calls in progress"
+)
+MEMORY_ADMISSIONS = Counter(
+    "memory_admissions_total",
+    "Memory admission decisions for artifacts about to be processed",
+    ("outcome",),
+)
+
+
+def rss_bytes() -> int | None:
+    """The resident memory of this process, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _memory_limit() -> int | None:
+    for path in _CGROUP_LIMITS:
+        try:
+            with open(path) as file:
+                limit = file.read().strip()
+        except OSError:
+            continue
+        # Unlimited cgroups say "max", or a huge number in v1
+        if limit.isdigit() and int(limit) < 2**60:
+            return int(limit)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (OSError, ValueError):
+        return None
+
+
+def memory_budget() -> int | None:
+    """
+    The most memory, in bytes, this worker process should use: MEMORY_BUDGET_BYTES, or its share of 80% of the
+    container's or machine's memory. None means there's no budget to enforce, e.g. because MEMORY_BUDGET_BYTES is 0.
+    """
+    budget = os.getenv("MEMORY_BUDGET_BYTES")
+    if budget is not None:
+        return int(budget) or None
+    limit = _memory_limit()
+    return int(limit * BUDGET_FRACTION / worker_count()) if limit else None
+
+
+def trace_sample_rate() -> float:
+    """The fraction of tool calls to trace with tracemalloc. Defaults to 0."""
+    return float(os.getenv("MEMORY_TRACE_SAMPLE_RATE", "0"))
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1000 or unit == "GB":
+            break
+        size /= 1000
+    return f"{size:.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+
+
+@dataclass
+class MemoryAccount:
+    """Memory used by a tool call. Fields are filled in when the call finishes, where they can be measured."""
+
+    rss_growth_bytes: int | None = None
+    traced_peak_bytes: int | None = None
+    reserved_bytes: int = 0
+    # The part of the reservations that RSS hadn't grown by yet when they were last measured, and RSS at that time
+    _pending_bytes: int = field(default=0, repr=False)
+    _pending_rss: int = field(default=0, repr=False)
+
+    def pending_bytes(self, rss: int) -> int:
+        """
+        The part of the reservations that isn't in use yet: each reservation shrinks as RSS grows past what it was
+        when the memory was reserved, since the memory it was for is then counted in RSS. Growth from concurrent calls
+        shrinks it too, so calls running together are admitted a little too readily rather than refused too early.
+        """
+        return max(self._pending_bytes - max(rss - self._pending_rss, 0), 0)
+
+    def as_data(self) -> dict:
+        data = {"rss_growth_bytes": self.rss_growth_bytes}
+        if self.traced_peak_bytes is not None:
+            data["traced_peak_bytes"] = self.traced_peak_bytes
+        if self.reserved_bytes:
+            data["reserved_bytes"] = self.reserved_bytes
+        return data
+
+
+_lock = threading.Lock()
+_reserving: dict[int, MemoryAccount] = {}  # Accounts holding reservations, by id
+_tracing = 0  # Accounts being traced, so that tracemalloc only runs while there are any
+
+_current_account: ContextVar[MemoryAccount | None] = ContextVar(
+    "memory_account", default=None
+)
+
+
+def _start_tracing() -> int:
+    global _tracing
+    with _lock:
+        _tracing += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _stop_tracing(baseline: int) -> int:
+    global _tracing
+    _, peak = tracemalloc.get_traced_memory()
+    with _lock:
+        _tracing -= 1
+        if not _tracing:
+            tracemalloc.stop()
+    return max(peak - baseline, 0)
+
+
+@contextmanager
+def account_memory() -> Iterator[MemoryAccount]:
+    """
+    Measures the memory used within the block into a MemoryAccount, and releases the memory reserved by admit() within
+    it when it finishes. RSS growth is the difference in resident memory from start to finish, which includes what
+    concurrent calls allocated meanwhile, and the traced peak spans every call that runs during the traced one.
+    """
+    account = MemoryAccount()
+    traced = random.random() < trace_sample_rate()
+    if traced:
+        traced_baseline = _start_tracing()
+    rss_before = rss_bytes()
+    token = _current_account.set(account)
+    try:
+        yield account
+    finally:
+        _current_account.reset(token)
+        rss_after = rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            account.rss_growth_bytes = rss_after - rss_before
+            MEMORY_GROWTH.observe(max(account.rss_growth_bytes, 0))
+        if traced:
+            account.traced_peak_bytes = _stop_tracing(traced_baseline)
+            MEMORY_TRACED_PEAK.observe(account.traced_peak_bytes)
+        if account.reserved_bytes:
+            with _lock:
+                _reserving.pop(id(account), None)
+            MEMORY_RESERVED.dec(account.reserved_bytes)
+
+
+def available_memory() -> int | None:
+    """
+    What is left of the budget after the memory in use and the part of the reservations of calls in progress that
+    isn't in use yet, if anything.
+    """
+    budget = memory_budget()
+    rss = rss_bytes()
+    if budget is None or rss is None:
+        return None
+    with _lock:
+        pending = sum(account.pending_bytes(rss) for account in _reserving.values())
+    return budget - rss - pending
+
+
+def admit(nbytes: int) -> bool:
+    """
+    Returns whether there is memory left for something that needs nbytes, and if so, reserves it until the enclosing
+    account_memory() block finishes. Everything is admitted when there is no budget, or no way to measure memory.
+    """
+    available = available_memory()
+    if available is not None and nbytes > available:
+        logger.warning(
+            f"Not admitting {format_bytes(nbytes)}, only {format_bytes(max(available, 0))} of memory is available"
+        )
+        MEMORY_ADMISSIONS.inc(outcome="rejected")
+        return False
+    MEMORY_ADMISSIONS.inc(outcome="admitted")
+    account = _current_account.get()
+    if account is not None:
+        rss = rss_bytes() or 0
+        with _lock:
+            account._pending_bytes = account.pending_bytes(rss) + nbytes
+            account._pending_rss = rss
+            _reserving[id(account)] = account
+        account.reserved_bytes += nbytes
+        MEMORY_RESERVED.inc(nbytes)
+    return True
+
+
+def admit_parsing(size: int) -> bool:
+    """Admits parsing JSON text of the given size into Python objects, when the text itself has already been admitted."""
+    return admit(size * (PARSED_JSON_MEMORY_FACTOR - TEXT_MEMORY_FACTOR))
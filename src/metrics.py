@@ -0,0 +1,300 @@
+"""
+In-process operational metrics. Metrics are module-level objects that are updated from wherever the measured work
+happens, e.g.
+
+    LLM_CALLS.inc(stage="jq_generation")
+
+Label values should come from small, fixed sets (stages, tool names, outcomes) so that the number of tracked series
+stays bounded.
+
+Metrics live in the memory of the process that updates them, so each worker process counts and exports its own.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    """A metric tracked separately for each combination of label values."""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labels}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[label]) for label in self.labels)
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> dict[tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, like the number of requests in progress."""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str):
+        """Counts the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> dict[tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""Upper bounds, in seconds, of the buckets of duration histograms."""
+
+
+class HistogramSample:
+    def __init__(self, buckets: int):
+        # The last bucket counts values above the largest bound
+        self.bucket_counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def copy(self) -> "HistogramSample":
+        sample = HistogramSample(len(self.bucket_counts) - 1)
+        sample.bucket_counts = list(self.bucket_counts)
+        sample.sum = self.sum
+        sample.count = self.count
+        return sample
+
+
+class Histogram(Metric):
+    """Counts observed values in buckets, and keeps their sum and count."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self._samples: dict[tuple[str, ...], HistogramSample] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = HistogramSample(len(self.buckets))
+            sample.bucket_counts[bucket] += 1
+            sample.sum += value
+            sample.count += 1
+
+    def count(self, **labels: str) -> int:
+        sample = self._samples.get(self._key(labels))
+        return sample.count if sample else 0
+
+    def samples(self) -> dict[tuple[str, ...], HistogramSample]:
+        with self._lock:
+            return {key: sample.copy() for key, sample in self._samples.items()}
+
+
+REGISTRY: list[Metric] = []
+
+
+# Exposition
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_METRIC_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+    return "{" + pairs + "}"
+
+
+def render_metrics(registry: list[Metric] = None) -> str:
+    """Renders the metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {_METRIC_TYPES[type(metric)]}")
+        samples = metric.samples()
+        if isinstance(metric, Histogram):
+            names = metric.labels + ("le",)
+            for key, sample in sorted(samples.items()):
+                cumulative = 0
+                for bound, count in zip(
+                    (*metric.buckets, float("inf")), sample.bucket_counts
+                ):
+                    cumulative += count
+                    labels = _format_labels(names, key + (_format_value(bound),))
+                    lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.labels, key)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(sample.sum)}")
+                lines.append(f"{metric.name}_count{labels} {sample.count}")
+        else:
+            # Metrics without labels have a value even before they change
+            if not metric.labels and not samples:
+                samples = {(): 0}
+            for key, value in sorted(samples.items()):
+                labels = _format_labels(metric.labels, key)
+                lines.append(f"{metric.name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# LLM usage
+
+LLM_CALLS = Counter("llm_calls_total", "Completed LLM calls", ("stage",))
+LLM_PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens_total", "Prompt tokens sent to the LLM", ("stage",)
+)
+LLM_CACHED_PROMPT_TOKENS = Counter(
+    "llm_cached_prompt_tokens_total",
+    "Prompt tokens that were served from the provider's prompt cache",
+    ("stage",),
+)
+
+
+def record_llm_usage(stage: str, prompt_tokens: int, cached_tokens: int):
+    LLM_CALLS.inc(stage=stage)
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, stage=stage)
+    LLM_CACHED_PROMPT_TOKENS.inc(cached_tokens, stage=stage)
+    logger.info(
+        f"LLM call ({stage}) used {prompt_tokens} prompt tokens, {cached_tokens} of which were cached"
+    )
+
+
+def openai_usage(completion: Any) -> tuple[int, int]:
+    """Returns (prompt tokens, cached prompt tokens) from an OpenAI chat completion."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, cached
+
+
+def langchain_usage(message: Any) -> tuple[int, int]:
+    """Returns (prompt tokens, cached prompt tokens) from a LangChain AI message."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return 0, 0
+    details = usage.get("input_token_details") or {}
+    return usage.get("input_tokens", 0), details.get("cache_read", 0)
+
+
+# Tool calls
+
+TOOL_CALLS = Counter(
+    "tool_calls_total", "Tool calls made by the agent", ("tool", "outcome")
+)
+TOOL_SECONDS = Histogram(
+    "tool_duration_seconds", "Time spent running each tool", ("tool",)
+)
+
+
+# Stage timings
+
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Time spent in each stage of handling a request",
+    ("stage",),
+)
+
+_stage_timings: ContextVar[dict[str, float] | None] = ContextVar(
+    "stage_timings", default=None
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Times a stage of handling a request into STAGE_SECONDS, and adds it to the timings being collected by the
+    enclosing collect_timings() block, if any. Stages that run more than once add up. Within a trace, the stage is also
+    a span.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + seconds
+
+
+@contextmanager
+def collect_timings() -> Iterator[dict[str, float]]:
+    """
+    Collects the time spent in each stage timed within the block, including in tasks and threads started from it,
+    which inherit the block's context.
+    """
+    timings = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
@@ -0,0 +1,97 @@
+"""
+Middleware that hooks into the LangChain agent loop. It lives apart from agent.py because LangChain is slow to import,
+and the agent only imports it when it runs.
+"""
+
+import time
+
+import openai
+from langchain.agents.middleware import AgentMiddleware, ModelRequest
+from langchain.agents.middleware.types import ToolCallRequest
+from langchain_core.messages import AIMessage
+from langchain_openai import ChatOpenAI
+
+from metrics import TOOL_CALLS, TOOL_SECONDS
+from routing import RoutingDecision, escalate
+from tracing import annotate, span
+
+
+class ToolMetricsMiddleware(AgentMiddleware):
+    """Counts and times the agent's tool calls."""
+
+    async def awrap_tool_call(self, request: ToolCallRequest, handler):
+        # Calls to tools that don't exist are counted together, to keep the number of tool labels bounded
+        tool_name = request.tool.name if request.tool else "unknown"
+        outcome = "failed"
+        start = time.perf_counter()
+        try:
+            response = await handler(request)
+            outcome = "succeeded"
+            return response
+        finally:
+            TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool_name)
+            TOOL_CALLS.inc(tool=tool_name, outcome=outcome)
+
+
+class TracingMiddleware(AgentMiddleware):
+    """Traces each iteration of the agent loop, i.e. each call to the model, and each tool call."""
+
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        self.iterations += 1
+        with span("agent_iteration", iteration=self.iterations):
+            response = await handler(request)
+            message = response.result[-1] if response.result else None
+            if isinstance(message, AIMessage):
+                annotate(
+                    tool_calls=",".join(call["name"] for call in message.tool_calls)
+                )
+            return response
+
+    async def awrap_tool_call(self, request: ToolCallRequest, handler):
+        with span(
+            "tool_call",
+            tool=request.tool.name if request.tool else "unknown",
+            tool_call_id=request.tool_call["id"],
+        ):
+            return await handler(request)
+
+
+class EscalationMiddleware(AgentMiddleware):
+    """
+    Switches the agent from the small model to the large model, for the rest of the run, as soon as the small model
+    fails to produce well-formed tool calls.
+    """
+
+    def __init__(self, routing: RoutingDecision, large_model: ChatOpenAI):
+        super().__init__()
+        self.routing = routing
+        self.large_model = large_model
+        self.escalated = False
+
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        if self.escalated:
+            return await handler(request.override(model=self.large_model))
+
+        try:
+            response = await handler(request)
+        except openai.APIError as e:
+            reason = f"small model failed with {type(e).__name__}"
+        else:
+            message = response.result[-1] if response.result else None
+            if (
+                isinstance(message, AIMessage)
+                and message.tool_calls
+                and not message.invalid_tool_calls
+            ):
+                return response
+            reason = "small model made invalid tool calls"
+
+        self.escalated = True
+        self.routing = escalate(
+            self.routing, reason
+        )  # The decision now points at the large model
+        return await handler(request.override(model=self.large_model))
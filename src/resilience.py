@@ -0,0 +1,261 @@
+"""
+Protects the agent from a slow or unhealthy LLM endpoint. Every LLM HTTP request goes through ResilientTransport, which:
+
+- Enforces a deadline on each request (LLM_TIMEOUT_SECONDS)
+- Sends a hedged duplicate of a request that is slower than the LLM_HEDGE_QUANTILE of recent requests to the same
+  endpoint and model, and takes whichever response arrives first
+- Trips a circuit breaker after CIRCUIT_BREAKER_FAILURES consecutive failures, rejecting requests immediately until
+  CIRCUIT_BREAKER_COOLDOWN_SECONDS have passed, after which a single probe request is let through
+
+Rejected requests get a 503 response that tells the OpenAI client not to retry, so callers fail fast instead of piling
+up behind a degraded upstream.
+
+Breakers and latencies are kept per worker process, so each worker trips its breakers and hedges on its own.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import httpx
+
+from metrics import Counter, timed
+from scheduling import LLM_POOL
+from tracing import add_event, annotate
+from util import shared_client
+
+logger = logging.getLogger(__name__)
+
+LLM_UNAVAILABLE_MESSAGE = (
+    "The language model service is currently unavailable, so the request was aborted. "
+    "Please try again in a minute."
+)
+
+LATENCY_WINDOW = 200
+
+LLM_HEDGED_REQUESTS = Counter(
+    "llm_hedged_requests_total", "LLM requests that were duplicated", ("outcome",)
+)
+LLM_REQUEST_FAILURES = Counter(
+    "llm_request_failures_total", "LLM requests that failed", ("reason",)
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total", "Retries of failed LLM requests by the OpenAI client"
+)
+LLM_CIRCUIT_REJECTIONS = Counter(
+    "llm_circuit_rejections_total",
+    "LLM requests rejected because the endpoint's circuit breaker was open",
+)
+
+
+def _float_env(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+class LatencyTracker:
+    """Remembers the latencies of recent successful requests."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        """Returns None until enough requests have been seen for the estimate to be meaningful."""
+        if len(self._latencies) < _float_env("LLM_HEDGE_MIN_SAMPLES", 20):
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and (
+            self._probing
+            or time.monotonic() - self.opened_at
+            < _float_env("CIRCUIT_BREAKER_COOLDOWN_SECONDS", 30)
+        )
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.is_open:
+            return False
+        # Let a single request through to check if the endpoint has recovered
+        self._probing = True
+        return True
+
+    def abandon_probe(self):
+        self._probing = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Closing circuit breaker for {self.endpoint}")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.consecutive_failures >= _float_env("CIRCUIT_BREAKER_FAILURES", 5):
+            if self.opened_at is None:
+                logger.warning(
+                    f"Opening circuit breaker for {self.endpoint} after {self.consecutive_failures} consecutive failures"
+                )
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[tuple[str, str | None], LatencyTracker] = {}
+
+
+def circuit_breaker(endpoint: str | httpx.URL) -> CircuitBreaker:
+    endpoint = str(httpx.URL(str(endpoint)).copy_with(path="/", query=None))
+    if endpoint not in _breakers:
+        _breakers[endpoint] = CircuitBreaker(endpoint)
+    return _breakers[endpoint]
+
+
+def is_llm_available(base_url: str) -> bool:
+    return not circuit_breaker(base_url).is_open
+
+
+def _request_model(request: httpx.Request) -> str | None:
+    try:
+        return json.loads(request.content).get("model")
+    except (ValueError, AttributeError):
+        return None
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # Warm-up requests only open connections, so they stay out of the breaker, the pool, the latencies and metrics
+        if request.extensions.get("warm_up"):
+            return await self._transport.handle_async_request(request)
+
+        # The OpenAI client numbers its attempts at a request
+        if request.headers.get("x-stainless-retry-count", "0") != "0":
+            LLM_RETRIES.inc()
+
+        breaker = circuit_breaker(request.url)
+        if not breaker.allow_request():
+            LLM_CIRCUIT_REJECTIONS.inc()
+            return httpx.Response(
+                503,
+                headers={"x-should-retry": "false"},
+                json={"error": {"message": LLM_UNAVAILABLE_MESSAGE}},
+                request=request,
+            )
+
+        deadline = _float_env("LLM_TIMEOUT_SECONDS", 120)
+        key = (breaker.endpoint, _request_model(request))
+        try:
+            # The deadline starts once the request leaves the queue
+            async with LLM_POOL.slot():
+                with timed("llm_call"):
+                    annotate(endpoint=breaker.endpoint, model=key[1])
+                    async with asyncio.timeout(deadline):
+                        response = await self._send_hedged(request, key)
+                    annotate(status_code=response.status_code)
+        except TimeoutError as e:
+            LLM_REQUEST_FAILURES.inc(reason="deadline")
+            breaker.record_failure()
+            raise httpx.ReadTimeout(
+                f"LLM request exceeded its {deadline:g} second deadline",
+                request=request,
+            ) from e
+        except httpx.TransportError:
+            LLM_REQUEST_FAILURES.inc(reason="transport")
+            breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            breaker.abandon_probe()
+            raise
+
+        if response.status_code >= 500:
+            LLM_REQUEST_FAILURES.inc(reason="server_error")
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def _send(
+        self, request: httpx.Request, key: tuple[str, str | None]
+    ) -> httpx.Response:
+        start = time.monotonic()
+        response = await self._transport.handle_async_request(request)
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        if response.is_success:
+            _latencies.setdefault(key, LatencyTracker()).record(
+                time.monotonic() - start
+            )
+        return response
+
+    async def _send_hedged(
+        self, request: httpx.Request, key: tuple[str, str | None]
+    ) -> httpx.Response:
+        tracker = _latencies.get(key)
+        quantile = _float_env("LLM_HEDGE_QUANTILE", 0.95)
+        hedge_after = tracker.quantile(quantile) if tracker and quantile else None
+
+        pending = set()
+        try:
+            first = asyncio.create_task(self._send(request, key))
+            pending = {first}
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            logger.info(
+                f"Hedging LLM request to {key[0]} ({key[1]}) after {hedge_after:.2f} seconds"
+            )
+            add_event("hedged", after_seconds=hedge_after)
+            pending.add(asyncio.create_task(self._send(request, key)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        LLM_HEDGED_REQUESTS.inc(
+                            outcome="original" if task is first else "hedge"
+                        )
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Whether the request succeeded, failed, timed out or was cancelled, no attempt outlives it
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def llm_http_client() -> httpx.AsyncClient:
+    """The HTTP client for LLM requests, whose connections are shared by every LLM client on the event loop."""
+    # The transport enforces the deadline, so the client's own timeout only needs to be a backstop
+    return shared_client(
+        "llm",
+        lambda: httpx.AsyncClient(
+            transport=ResilientTransport(),
+            timeout=_float_env("LLM_TIMEOUT_SECONDS", 120) + 5,
+        ),
+    )
@@ -0,0 +1,111 @@
+"""
+Routes LLM work between two tiers of models: a small, fast model set by the SMALL_LLM environment variable, and the
+larger default model set by LLM. Simple work goes to the small model first and is escalated to the large model if the
+small model fails to produce a valid response. Requests that look complex go straight to the large model. If SMALL_LLM
+isn't set, everything goes to the large model.
+
+Decisions and their outcomes are logged and counted so that the routing heuristics can be tuned.
+"""
+
+import logging
+import os
+import re
+from typing import Literal
+
+from pydantic import BaseModel
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+Tier = Literal["small", "large"]
+
+# Words that are also common in plain extraction requests, like "order" or "min", only count in aggregate phrasings,
+# and "count" mustn't match "country" or "county"
+COMPLEX_REQUEST_PATTERN = re.compile(
+    r"\b(group|grouped|per \w+|aggregat\w*|sum|total|average|mean|median|minimum|maximum|sort\w*|order by|"
+    r"rank\w*|top \d+|distinct|unique|count(s|ed|ing)?|join\w*|merge\w*|compare|comparing|unless|except|pivot|"
+    r"reshape|nest\w*)\b",
+    re.IGNORECASE,
+)
+MAX_SIMPLE_REQUEST_WORDS = 30
+
+ROUTING_DECISIONS = Counter(
+    "llm_routing_decisions_total",
+    "Models chosen for LLM work",
+    ("stage", "tier"),
+)
+ROUTING_OUTCOMES = Counter(
+    "llm_routing_outcomes_total",
+    "How LLM work went on the model it was routed to",
+    ("stage", "tier", "outcome"),
+)
+
+
+class RoutingDecision(BaseModel):
+    stage: str
+    model: str
+    tier: Tier
+    reason: str
+
+
+def classify_request(request: str, artifact_count: int = 1) -> tuple[bool, str]:
+    """
+    Guesses whether a request is too complex for the small model. Returns the verdict and the reason for it.
+    """
+    if artifact_count > 1:
+        return True, f"request involves {artifact_count} artifacts"
+    if len(request.split()) > MAX_SIMPLE_REQUEST_WORDS:
+        return True, "request is long"
+    if match := COMPLEX_REQUEST_PATTERN.search(request):
+        return True, f'request mentions "{match.group(0)}"'
+    return False, "request looks simple"
+
+
+def route(stage: str, request: str, artifact_count: int = 1) -> RoutingDecision:
+    large_model = os.getenv("LLM")
+    small_model = os.getenv("SMALL_LLM")
+
+    if not small_model or small_model == large_model:
+        decision = RoutingDecision(
+            stage=stage, model=large_model, tier="large", reason="no small model"
+        )
+    else:
+        is_complex, reason = classify_request(request, artifact_count)
+        decision = RoutingDecision(
+            stage=stage,
+            model=large_model if is_complex else small_model,
+            tier="large" if is_complex else "small",
+            reason=reason,
+        )
+
+    ROUTING_DECISIONS.inc(stage=stage, tier=decision.tier)
+    logger.info(
+        f"Routed {stage} to {decision.model} ({decision.tier}): {decision.reason}"
+    )
+    return decision
+
+
+def escalate(decision: RoutingDecision, reason: str) -> RoutingDecision | None:
+    """
+    Moves work that failed on the small model to the large model. Returns None if the work is already on the large
+    model.
+    """
+    if decision.tier == "large":
+        return None
+
+    record_outcome(decision, "escalated")
+    escalated = RoutingDecision(
+        stage=decision.stage, model=os.getenv("LLM"), tier="large", reason=reason
+    )
+    ROUTING_DECISIONS.inc(stage=escalated.stage, tier=escalated.tier)
+    logger.info(f"Escalated {decision.stage} to {escalated.model}: {reason}")
+    return escalated
+
+
+def record_outcome(
+    decision: RoutingDecision,
+    outcome: Literal["succeeded", "gave_up", "escalated", "failed"],
+):
+    ROUTING_OUTCOMES.inc(stage=decision.stage, tier=decision.tier, outcome=outcome)
+    logger.info(f"{decision.stage} on {decision.model} ({decision.tier}): {outcome}")
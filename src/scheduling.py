@@ -0,0 +1,123 @@
+"""
+Shares the agent's capacity fairly between the tenants it serves, so that a burst of large jobs from one tenant can't
+starve everyone else. Work is admitted through three pools, each with its own limit on how much of it runs at once:
+
+- run: agent runs, i.e. requests to the agent (MAX_CONCURRENT_RUNS)
+- llm: LLM requests, to stay under the endpoint's rate limits (MAX_CONCURRENT_LLM_CALLS)
+- cpu: CPU-bound data work, like loading tables and joining lists (MAX_CONCURRENT_CPU_TASKS)
+
+Limits apply to each worker process.
+
+When a pool is full, work waits in a queue per tenant, and the queues take turns getting freed slots. Tenants are told
+apart by the LLM key iChatBio sends with each request, and everything without one is a single tenant. Time spent
+waiting is timed as the "<pool>_queue" stage.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from metrics import Gauge, timed
+from util import tenant_key
+
+
+def worker_count() -> int:
+    """The number of worker processes serving the agent, from WEB_CONCURRENCY, as uvicorn and gunicorn read it."""
+    return max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+
+
+SCHEDULER_QUEUED = Gauge(
+    "scheduler_queued", "Work waiting for a slot in each pool", ("pool",)
+)
+SCHEDULER_ACTIVE = Gauge(
+    "scheduler_active", "Work holding a slot in each pool", ("pool",)
+)
+
+
+class FairLimiter:
+    """
+    Limits how many holders of a slot there are at once, to the value of the environment variable limit_env, or
+    default_limit. 0 means no limit. Waiters are served round-robin by tenant, and in order within a tenant.
+    """
+
+    def __init__(
+        self, pool: str, limit_env: str, default_limit: int | Callable[[], int]
+    ):
+        self.pool = pool
+        self.limit_env = limit_env
+        self.default_limit = default_limit
+        self.active = 0
+        self._queues: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def limit(self) -> int:
+        default = self.default_limit
+        return int(
+            os.getenv(self.limit_env, default() if callable(default) else default)
+        )
+
+    def _has_room(self) -> bool:
+        return not self.limit or self.active < self.limit
+
+    def _take(self):
+        self.active += 1
+        SCHEDULER_ACTIVE.inc(pool=self.pool)
+
+    def _dispatch(self):
+        """Hands free slots to waiters, taking turns between tenants."""
+        while self._queues and self._has_room():
+            tenant, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            if not waiter.done():  # Waiters that were cancelled are skipped
+                self._take()
+                waiter.set_result(None)
+
+    async def acquire(self, tenant: str):
+        if self._has_room() and not self._queues:
+            self._take()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append(waiter)
+        SCHEDULER_QUEUED.inc(pool=self.pool)
+        try:
+            self._dispatch()  # In case the limit was raised
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation arrived
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            SCHEDULER_QUEUED.dec(pool=self.pool)
+
+    def release(self):
+        self.active -= 1
+        SCHEDULER_ACTIVE.dec(pool=self.pool)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds a slot for the current tenant within the block, waiting for one if the pool is full."""
+        with timed(f"{self.pool}_queue"):
+            await self.acquire(tenant_key())
+        try:
+            yield
+        finally:
+            self.release()
+
+
+RUN_POOL = FairLimiter("run", "MAX_CONCURRENT_RUNS", 16)
+LLM_POOL = FairLimiter("llm", "MAX_CONCURRENT_LLM_CALLS", 16)
+# Each worker process gets its share of the CPUs
+CPU_POOL = FairLimiter(
+    "cpu",
+    "MAX_CONCURRENT_CPU_TASKS",
+    lambda: max((os.cpu_count() or 1) // worker_count(), 1),
+)
@@ -0,0 +1,235 @@
+"""
+Counting, distinct values and most common values of a field of a list of records, for the requests that are common
+enough not to need a generated query. Records are tallied in a single pass over a hash table, as they are parsed, so
+memory grows with the number of distinct values rather than with the number of records. Large JSON Lines artifacts are
+tallied in chunks by the pool of conversion processes.
+"""
+
+import asyncio
+import json
+import logging
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Literal, Optional
+
+from ichatbio.agent_response import IChatBioAgentProcess
+
+from context import ValidatedArtifactID, current_artifacts, current_context
+from metrics import timed
+from scheduling import CPU_POOL
+from tools.process_pool import conversion_pool, discard_conversion_pool
+from tools.spill import key_value
+from tools.util import (
+    JSON,
+    ProcessError,
+    context_tool,
+    create_artifact,
+    is_json_lines,
+    iter_json_lines,
+    iter_json_records,
+    log_process_usage,
+    lookup_field,
+    retrieve_text_artifact,
+)
+
+logger = logging.getLogger(__name__)
+
+Aggregate = Literal["count", "distinct", "top"]
+
+DEFAULT_TOP_LIMIT = 10
+
+AGGREGATION_CHUNK_SIZE = 8 * 1024 * 1024
+"""JSON Lines artifacts are split into chunks of about this many characters to be tallied in parallel."""
+
+
+class Tally:
+    """Counts the values of a field. Values are hashed by their key_value, which tells apart e.g. true and 1."""
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.values: dict = {}
+        self.records = 0
+
+    def add(self, value: JSON):
+        key = key_value(value)
+        self.counts[key] += 1
+        if key not in self.values:
+            self.values[key] = value
+
+    def add_records(self, records: Iterable[JSON], path: str) -> "Tally":
+        """Tallies a field of each record. Each item of a field that holds a list is tallied separately."""
+        for record in records:
+            self.records += 1
+            value = lookup_field(record, path)
+            if isinstance(value, list):
+                for item in value:
+                    self.add(item)
+            else:
+                self.add(value)
+        return self
+
+    def merge(self, other: "Tally"):
+        self.counts.update(other.counts)
+        for key, value in other.values.items():
+            self.values.setdefault(key, value)
+        self.records += other.records
+
+
+_TYPE_ORDER = {type(None): 0, bool: 1, int: 2, float: 2, str: 3, list: 4, dict: 5}
+
+
+def _value_order(value: JSON) -> tuple:
+    """Orders values like jq does: null, booleans, numbers, strings, lists and then objects."""
+    rank = _TYPE_ORDER[type(value)]
+    if rank >= 4:
+        return rank, json.dumps(value, sort_keys=True)
+    return rank, value
+
+
+def summarize(
+    tally: Tally, path: str, aggregate: Aggregate, limit: int | None = None
+) -> list:
+    """
+    Turns a tally into the aggregate's result, in an order that only depends on the values and their counts: counts
+    are ordered from most to least common, ties by value, and distinct values by value. Null isn't a distinct value.
+    """
+    if aggregate == "distinct":
+        values = sorted(
+            (value for value in tally.values.values() if value is not None),
+            key=_value_order,
+        )
+        return values[:limit]
+
+    if aggregate == "top" and limit is None:
+        limit = DEFAULT_TOP_LIMIT
+    counts = sorted(
+        tally.counts.items(),
+        key=lambda item: (-item[1], _value_order(tally.values[item[0]])),
+    )
+    return [{path: tally.values[key], "count": count} for key, count in counts[:limit]]
+
+
+def _tally_json_lines_chunk(text: str, path: str) -> Tally:
+    return Tally().add_records(iter_json_lines(text), path)
+
+
+def _json_lines_chunks(text: str) -> list[str]:
+    """Splits JSON Lines into chunks of about AGGREGATION_CHUNK_SIZE characters that end at the ends of lines."""
+    chunks, start = [], 0
+    while start < len(text):
+        end = text.find("\n", start + AGGREGATION_CHUNK_SIZE)
+        end = len(text) if end == -1 else end + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+async def tally_records(text: str, path: str, mimetype: str | None = None) -> Tally:
+    """
+    Tallies a field of the records of a JSON array or JSON Lines without blocking the event loop. Raises ValueError if
+    the content is neither.
+    """
+    if is_json_lines(text, mimetype) and len(text) > AGGREGATION_CHUNK_SIZE:
+        pool = conversion_pool()
+        if pool is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                tallies = await asyncio.gather(
+                    *(
+                        loop.run_in_executor(pool, _tally_json_lines_chunk, chunk, path)
+                        for chunk in _json_lines_chunks(text)
+                    )
+                )
+            except BrokenProcessPool:
+                logger.warning(
+                    "A conversion process died, aggregating in a thread instead",
+                    exc_info=True,
+                )
+                discard_conversion_pool()
+            else:
+                tally = Tally()
+                for chunk_tally in tallies:
+                    tally.merge(chunk_tally)
+                return tally
+
+    records = iter_json_records(text, mimetype)
+    return await asyncio.to_thread(Tally().add_records, records, path)
+
+
+@context_tool
+async def aggregate(
+    artifact_id: ValidatedArtifactID,
+    field: str,
+    aggregate: Aggregate = "count",
+    limit: Optional[int] = None,
+):
+    """
+    Counts the records of a list per value of a field, lists the distinct values of a field, or finds the most common
+    values of a field. Use this instead of process_data for requests like "count records per country", "distinct
+    collectors" or "top 10 species". Fields that hold lists are aggregated by their items.
+
+    :param artifact_id: A list artifact
+    :param field: The field to aggregate, with dots for nested fields, like "indexTerms.country"
+    :param aggregate: "count" counts the records with each value, "distinct" lists the distinct values, and "top"
+        counts the most common values
+    :param limit: The number of values to return. Defaults to 10 for "top", and to all values otherwise
+    :return: A new artifact
+    """
+
+    context = current_context.get()
+    artifacts = current_artifacts.get()
+
+    source_artifact = artifacts.get(artifact_id)
+
+    async with (
+        context.begin_process("Aggregating data") as process,
+        log_process_usage(process),
+    ):
+        process: IChatBioAgentProcess
+
+        try:
+            text = await retrieve_text_artifact(source_artifact, process)
+            async with CPU_POOL.slot():
+                with timed("aggregation"):
+                    tally = await tally_records(text, field, source_artifact.mimetype)
+        except ProcessError:
+            return
+        except ValueError as e:
+            await process.log(
+                f"Artifact {source_artifact.local_id} content is not a list of records: {e}"
+            )
+            return
+
+        with timed("aggregation"):
+            result = summarize(tally, field, aggregate, limit)
+        distinct_values = len(tally.counts) - (None in tally.counts)
+        await process.log(
+            f"Found {distinct_values} distinct values of {field} in {tally.records} records",
+            data={
+                "records": tally.records,
+                "distinct_values": distinct_values,
+                "missing_values": tally.counts.get(None, 0),
+            },
+        )
+
+        descriptions = {
+            "count": f"Number of records per value of {field}",
+            "distinct": f"Distinct values of {field}",
+            "top": f"Most common values of {field}",
+        }
+        with timed("serialization"):
+            content = json.dumps(result).encode("utf-8")
+        await create_artifact(
+            process,
+            mimetype="application/json",
+            description=f"{descriptions[aggregate]} in artifact {source_artifact.local_id}",
+            content=content,
+            metadata={
+                "source_artifact": source_artifact.local_id,
+                "aggregate": {
+                    "field": field,
+                    "aggregate": aggregate,
+                    "limit": limit,
+                },
+            },
+        )
@@ -0,0 +1,248 @@
+"""
+Conversion between JSON records and the Parquet and Arrow IPC columnar formats. Columns are typed from the JSON schema
+inferred from the records, and nested objects and lists are kept as Arrow structs and lists, so records read back
+from these formats have the same structure they were written with.
+
+The conversions require the optional pyarrow dependency (pip install ".[columnar]"), which is only imported when one
+of them is requested.
+"""
+
+import base64
+import datetime
+import decimal
+import json
+import os
+from typing import Any, Iterator, Literal
+
+from tools.util import _schema_branches, _schema_types, extract_json_schema
+
+ColumnarFormat = Literal["parquet", "arrow"]
+
+COLUMNAR_MIMETYPES: dict[str, str] = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+"""Mimetypes of the artifacts created in each format."""
+
+_MIMETYPE_FORMATS = {
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.file": "arrow",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+COMPRESSIONS: dict[str, tuple[str, ...]] = {
+    "parquet": ("zstd", "snappy", "gzip", "brotli", "lz4", "none"),
+    "arrow": ("zstd", "lz4", "none"),
+}
+
+COLUMNAR_BATCH_SIZE = 10_000
+"""Records are converted to Arrow and written this many at a time, to bound the memory used by the conversion."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ValueError(
+            'Parquet and Arrow conversion requires pyarrow, which is not installed (pip install ".[columnar]")'
+        ) from e
+    return pyarrow
+
+
+def columnar_format(mimetype: str | None) -> ColumnarFormat | None:
+    """Returns the columnar format of an artifact with the given mimetype, or None if it isn't one."""
+    return _MIMETYPE_FORMATS.get((mimetype or "").split(";")[0].strip().lower())
+
+
+def resolve_compression(format: ColumnarFormat, compression: str | None) -> str:
+    """Defaults to COLUMNAR_COMPRESSION, or zstd. Raises ValueError if the format doesn't support the compression."""
+    compression = (compression or os.getenv("COLUMNAR_COMPRESSION") or "zstd").lower()
+    if compression not in COMPRESSIONS[format]:
+        raise ValueError(
+            f"{format} output supports {', '.join(COMPRESSIONS[format])} compression, not {compression}"
+        )
+    return compression
+
+
+# Types
+
+
+_JSON_ENCODED = {b"encoding": b"json"}
+"""Metadata of string fields that hold JSON-encoded values."""
+
+
+def _arrow_field(pa, name: str, schema: dict):
+    """
+    Maps a JSON schema to an Arrow field. Values that have no single Arrow type, like fields that hold more than one
+    kind of value (other than integers mixed with other numbers) or objects without properties, are stored as JSON in
+    string fields marked with _JSON_ENCODED metadata.
+    """
+    types = set(_schema_types(schema)) - {"null"}
+    branches = _schema_branches(schema)
+
+    if not types:
+        return pa.field(name, pa.null())
+    if types == {"boolean"}:
+        return pa.field(name, pa.bool_())
+    if types == {"integer"}:
+        return pa.field(name, pa.int64())
+    if types <= {"integer", "number"}:
+        return pa.field(name, pa.float64())
+    if types == {"string"}:
+        return pa.field(name, pa.string())
+    if types == {"object"}:
+        properties = {}
+        for branch in branches:
+            properties.update(branch.get("properties", {}))
+        if properties:  # Parquet can't store structs without fields
+            return pa.field(
+                name,
+                pa.struct(
+                    [_arrow_field(pa, key, value) for key, value in properties.items()]
+                ),
+            )
+    if types == {"array"}:
+        items = [branch["items"] for branch in branches if "items" in branch]
+        return pa.field(
+            name,
+            pa.list_(
+                _arrow_field(pa, "item", items[0])
+                if items
+                else pa.field("item", pa.null())
+            ),
+        )
+    return pa.field(name, pa.string(), metadata=_JSON_ENCODED)
+
+
+def _is_json_encoded(field) -> bool:
+    return field.metadata == _JSON_ENCODED
+
+
+def _coerce(pa, value: Any, field) -> Any:
+    """Fits a JSON value to the Arrow field chosen for it by _arrow_field."""
+    if value is None:
+        return None
+    if _is_json_encoded(field):
+        return json.dumps(value)
+    if pa.types.is_floating(field.type):
+        return float(value)
+    if pa.types.is_struct(field.type):
+        return {
+            child.name: _coerce(pa, value.get(child.name), child)
+            for child in field.type
+        }
+    if pa.types.is_list(field.type):
+        return [_coerce(pa, item, field.type.value_field) for item in value]
+    return value
+
+
+def records_schema(records: list[dict]):
+    """Returns the Arrow schema for a list of JSON objects."""
+    pa = _pyarrow()
+    if not records or not all(isinstance(record, dict) for record in records):
+        raise ValueError(
+            "Only non-empty lists of JSON objects can be stored as columns"
+        )
+
+    record_field = _arrow_field(pa, "record", extract_json_schema(records)["items"])
+    if not pa.types.is_struct(record_field.type):
+        raise ValueError("The records have no fields to store as columns")
+    return pa.schema(list(record_field.type))
+
+
+def _record_batches(pa, records: list[dict], schema) -> Iterator:
+    record_field = pa.field("record", pa.struct(list(schema)))
+    for start in range(0, len(records), COLUMNAR_BATCH_SIZE):
+        yield pa.RecordBatch.from_pylist(
+            [
+                _coerce(pa, record, record_field)
+                for record in records[start : start + COLUMNAR_BATCH_SIZE]
+            ],
+            schema=schema,
+        )
+
+
+# Encoding and decoding
+
+
+def encode_columnar(
+    records: list[dict], format: ColumnarFormat, compression: str | None = None
+) -> bytes:
+    """Encodes a list of JSON objects as a Parquet file or an Arrow IPC file."""
+    pa = _pyarrow()
+    compression = resolve_compression(format, compression)
+    schema = records_schema(records)
+
+    sink = pa.BufferOutputStream()
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression=compression)
+    else:
+        writer = pa.ipc.new_file(
+            sink,
+            schema,
+            options=pa.ipc.IpcWriteOptions(
+                compression=None if compression == "none" else compression
+            ),
+        )
+    with writer:
+        for batch in _record_batches(pa, records, schema):
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _decode(pa, value: Any, field) -> Any:
+    """
+    Turns a value read from an Arrow field back into JSON. Null fields of objects are left out, since every record
+    has every column and most of them are missing from sparse records; jq treats missing fields as null anyway.
+    """
+    if value is None:
+        return None
+    if _is_json_encoded(field):
+        return json.loads(value)
+    if pa.types.is_struct(field.type):
+        return {
+            child.name: decoded
+            for child in field.type
+            if (decoded := _decode(pa, value[child.name], child)) is not None
+        }
+    if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+        return [_decode(pa, item, field.type.value_field) for item in value]
+    if pa.types.is_map(field.type):
+        return {str(k): _decode(pa, v, field.type.item_field) for k, v in value}
+    return value
+
+
+def decode_columnar(content: bytes, format: ColumnarFormat) -> list[dict]:
+    """Decodes a Parquet file, or an Arrow IPC file or stream, into a list of objects."""
+    pa = _pyarrow()
+    try:
+        if format == "parquet":
+            table = pa.parquet.read_table(pa.BufferReader(content))
+        else:
+            try:
+                table = pa.ipc.open_file(pa.BufferReader(content)).read_all()
+            except pa.ArrowInvalid:
+                table = pa.ipc.open_stream(pa.BufferReader(content)).read_all()
+    except pa.ArrowException as e:
+        raise ValueError(f"Invalid {format} content: {e}") from e
+
+    record_field = pa.field("record", pa.struct(list(table.schema)))
+    return [_decode(pa, record, record_field) for record in table.to_pylist()]
+
+
+def json_default(value: Any) -> Any:
+    """Serializes the values of Arrow types that have no JSON equivalent, like timestamps, for json.dumps()."""
+    match value:
+        case datetime.date() | datetime.time():
+            return value.isoformat()
+        case datetime.timedelta():
+            return value.total_seconds()
+        case decimal.Decimal():
+            return str(value)
+        case bytes():
+            return base64.b64encode(value).decode("ascii")
+        case _:
+            raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -3,7 +3,37 @@ import json
 from ichatbio.agent_response import IChatBioAgentProcess
 
 from context import current_artifacts, current_context, ValidatedArtifactID
-from tools.util import context_tool, ProcessError, retrieve_json_list_artifact
+from metrics import timed
+from tools.util import (
+    JSON_LINES_MIMETYPE,
+    JsonLines,
+    ProcessError,
+    context_tool,
+    create_artifact,
+    dump_json_lines,
+    log_process_usage,
+    retrieve_json_source,
+)
+
+
+def _concat_json_lines(sources: list[list | JsonLines]) -> bytes:
+    """Appends the sources' records one after another. JSON Lines text is copied as is, without being parsed."""
+    parts = []
+    for source in sources:
+        if isinstance(source, JsonLines):
+            if source.text.strip():
+                parts.append(source.text.encode("utf-8"))
+                if not source.text.endswith("\n"):
+                    parts.append(b"\n")
+        else:
+            parts.append(dump_json_lines(source))
+    return b"".join(parts)
+
+
+def _concat_json_arrays(sources: list[list]) -> bytes:
+    """Appends the sources' encoded items one after another, without building the combined list."""
+    items = [json.dumps(source)[1:-1] for source in sources if source]
+    return f"[{', '.join(items)}]".encode("utf-8")
 
 
 @context_tool
@@ -23,21 +53,37 @@ async def concat_lists(
 
     artifact_one, artifact_two = artifacts.get(artifact_one_id, artifact_two_id)
 
-    async with context.begin_process("Processing data") as process:
+    async with (
+        context.begin_process("Processing data") as process,
+        log_process_usage(process),
+    ):
         process: IChatBioAgentProcess
 
-        try:
-            list_one = await retrieve_json_list_artifact(artifact_one, process)
-            list_two = await retrieve_json_list_artifact(artifact_two, process)
-        except ProcessError:
-            return
+        sources = []
+        for artifact in (artifact_one, artifact_two):
+            try:
+                source = await retrieve_json_source(artifact, process)
+            except ProcessError:
+                return
+            if not isinstance(source, (list, JsonLines)):
+                await process.log(f"Artifact {artifact.local_id} content is not a list")
+                return
+            sources.append(source)
 
-        new_list = list_one + list_two
+        # If either list is JSON Lines, so is the result
+        with timed("serialization"):
+            if any(isinstance(source, JsonLines) for source in sources):
+                mimetype = JSON_LINES_MIMETYPE
+                content = _concat_json_lines(sources)
+            else:
+                mimetype = "application/json"
+                content = _concat_json_arrays(sources)
 
-        await process.create_artifact(
-            mimetype="application/json",
+        await create_artifact(
+            process,
+            mimetype=mimetype,
             description=f"Joined list of records from artifacts {artifact_one.local_id} and {artifact_two.local_id}",
-            content=json.dumps(new_list).encode("utf-8"),
+            content=content,
             metadata={
                 "source_artifacts": [artifact_one.local_id, artifact_two.local_id]
             },
@@ -1,7 +1,24 @@
+import asyncio
 import csv
 import json
-from io import StringIO
-from typing import Any, Dict, List, Union
+import logging
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Union,
+)
 
 from ichatbio.agent_response import IChatBioAgentProcess
 
@@ -10,7 +27,32 @@ from context import (
     current_artifacts,
     ValidatedArtifactID,
 )
-from tools.util import retrieve_text_artifact
+from memory import PARSED_JSON_MEMORY_FACTOR
+from metrics import timed
+from scheduling import CPU_POOL
+from tools.columnar import (
+    COLUMNAR_MIMETYPES,
+    columnar_format,
+    decode_columnar,
+    encode_columnar,
+    json_default,
+    resolve_compression,
+)
+from tools.process_pool import conversion_pool, discard_conversion_pool
+from tools.util import (
+    JSON_LINES_MIMETYPE,
+    contains_non_null_content,
+    create_artifact,
+    dump_json_lines,
+    is_json_lines,
+    is_json_lines_mimetype,
+    iter_json_lines,
+    log_process_usage,
+    retrieve_bytes_artifact,
+    retrieve_text_artifact,
+)
+
+logger = logging.getLogger(__name__)
 
 NONE = object()
 
@@ -37,8 +79,206 @@ def _flatten_dict(
     return dict(items)
 
 
-def _json_to_csv(data: Union[str, List[Dict], Dict]) -> str:
-    """Converts JSON data to CSV format."""
+def _flattened_keys(
+    d: Dict[str, Any], parent_key: str = "", sep: str = "."
+) -> Iterator[str]:
+    """Yields the keys that _flatten_dict would produce, without building the flattened dictionary."""
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            yield from _flattened_keys(v, new_key, sep=sep)
+        elif isinstance(v, list):
+            for i, item in enumerate(v):
+                if isinstance(item, dict):
+                    yield from _flattened_keys(item, f"{new_key}[{i}]", sep=sep)
+                else:
+                    yield f"{new_key}[{i}]"
+        else:
+            yield new_key
+
+
+# Flattening plans
+
+
+class _Irregular(Exception):
+    """A record doesn't have the shape of the plan being applied to it."""
+
+
+class _PlanNode:
+    """
+    A dict or list at one path of the records a plan was built from. Scalar values are found by key in ``leaves``,
+    which holds their columns, and nested containers that _flatten_dict recurses into are found in ``children``.
+    """
+
+    __slots__ = ("container", "name", "leaf_types", "leaves", "children")
+
+    def __init__(self, container: type, name: str):
+        self.container = container
+        self.name = name
+        # _flatten_dict recurses into lists and dicts inside dicts, but only into dicts inside lists
+        self.leaf_types = (dict, list) if container is dict else dict
+        self.leaves: dict[str | int, int] = {}
+        self.children: dict[str | int, _PlanNode] = {}
+
+    def fill(self, value: Any, row: list):
+        if not isinstance(value, self.container):
+            raise _Irregular()
+        for key, v in value.items() if self.container is dict else enumerate(value):
+            if isinstance(v, self.leaf_types):
+                self.children[key].fill(v, row)
+            else:
+                row[self.leaves[key]] = v
+
+    def bind(self, columns: list[int]) -> "_PlanNode":
+        node = _PlanNode(self.container, self.name)
+        node.leaves = {key: columns[column] for key, column in self.leaves.items()}
+        node.children = {
+            key: child.bind(columns) for key, child in self.children.items()
+        }
+        return node
+
+
+class FlattenPlan:
+    """
+    The union of the flattened keys of the records added to it, along with where to find each of their values.
+    Applying the plan to a record skips rebuilding the keys and intermediate dictionaries that _flatten_dict creates
+    for every nested level of every record, and leaves the columns of the keys the record doesn't have as they were.
+
+    The plan walks a record in the same order as _flatten_dict, so paths that flatten to the same key, like "a.b" and
+    "a" then "b", share a column and the last one wins, as in _flatten_dict.
+    """
+
+    def __init__(self, sep: str = "."):
+        self.sep = sep
+        self.keys: list[str] = []
+        self._root = _PlanNode(dict, "")
+        self._columns: dict[str, int] = {}
+
+    def add(self, record: Any) -> bool:
+        """
+        Adds the paths of the record that the plan doesn't have yet. Returns False if the plan can't fill the record,
+        because it isn't a dict, or because a container in it is a dict where an earlier record has a list, or the
+        other way around.
+        """
+        return isinstance(record, dict) and self._add(self._root, record)
+
+    def _add(self, node: _PlanNode, value: Any, /) -> bool:
+        if not isinstance(value, node.container):
+            return False
+        fits = True
+        for key, v in value.items() if node.container is dict else enumerate(value):
+            if isinstance(v, node.leaf_types):
+                child = node.children.get(key)
+                if child is None:
+                    child = node.children[key] = _PlanNode(
+                        dict if isinstance(v, dict) else list, self._key(node, key)
+                    )
+                fits = self._add(child, v) and fits
+            elif key not in node.leaves:
+                node.leaves[key] = self._column(self._key(node, key))
+        return fits
+
+    def _key(self, node: _PlanNode, key: str | int) -> str:
+        if node.container is list:
+            return f"{node.name}[{key}]"
+        return f"{node.name}{self.sep}{key}" if node.name else key
+
+    def _column(self, key: str) -> int:
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = len(self.keys)
+            self.keys.append(key)
+        return column
+
+    def fill(self, record: Any, row: list):
+        """Writes the record's values into their columns of the row. Raises _Irregular if the record doesn't fit."""
+        try:
+            self._root.fill(record, row)
+        except (KeyError, TypeError):
+            raise _Irregular()
+
+    def bind(self, index: dict[str, int]) -> "FlattenPlan | None":
+        """
+        Returns a copy of the plan that fills rows laid out with the columns of the given index, or None if some of
+        the plan's keys aren't columns.
+        """
+        if any(key not in index for key in self.keys):
+            return None
+        plan = FlattenPlan(self.sep)
+        plan.keys = list(index)
+        plan._columns = index
+        plan._root = self._root.bind([index[key] for key in self.keys])
+        return plan
+
+
+class RecordFlattener:
+    """
+    Flattens records into CSV rows with a single plan that grows to cover every record it sees, falling back to
+    _flatten_dict for records the plan can't fill.
+
+    Usage:
+        flattener = RecordFlattener()
+        fieldnames = flattener.fieldnames(records)  # Or flattener.bind(fieldnames) if they are already known
+        rows = (flattener.row(record) for record in records)
+    """
+
+    def __init__(self, sep: str = "."):
+        self.sep = sep
+        self.planned = 0
+        self.fallbacks = 0
+        self._plan = FlattenPlan(sep)  # Filling rows of the plan's own keys
+        self._bound: FlattenPlan | None = None  # Filling rows laid out with _fieldnames
+        self._fieldnames: list[str] = []
+        self._index: dict[str, int] = {}
+
+    def fieldnames(self, records: List[Dict]) -> list[str]:
+        """Returns the sorted union of the records' flattened keys, and lays out rows with them."""
+        keys = set()
+        for record in records:
+            if not self._plan.add(record):
+                keys.update(_flattened_keys(record, sep=self.sep))
+        keys.update(self._plan.keys)
+
+        self.bind(sorted(keys))
+        return self._fieldnames
+
+    def bind(self, fieldnames: list[str]):
+        """Lays out rows with the given columns, which must include every key of the records that will be flattened."""
+        self._fieldnames = fieldnames
+        self._index = {name: i for i, name in enumerate(fieldnames)}
+        self._bound = self._plan.bind(self._index)
+
+    def _fill(self, record: Any) -> list | None:
+        if self._bound is None:
+            return None
+        row = [""] * len(self._fieldnames)
+        try:
+            self._bound.fill(record, row)
+        except _Irregular:
+            return None
+        self.planned += 1
+        return row
+
+    def row(self, record: Dict[str, Any]) -> list:
+        """Returns the record's values in the order of the bound fieldnames, with "" for missing columns."""
+        row = self._fill(record)
+        if row is None:
+            # The record has paths that the plan hasn't seen, e.g. because the fieldnames were bound, not collected
+            known = len(self._plan.keys)
+            if self._plan.add(record) and len(self._plan.keys) != known:
+                self._bound = self._plan.bind(self._index)
+                row = self._fill(record)
+        if row is not None:
+            return row
+
+        self.fallbacks += 1
+        flattened = _flatten_dict(record, sep=self.sep)
+        return [flattened.get(key, "") for key in self._fieldnames]
+
+
+def _parse_records(data: Union[str, List[Dict], Dict]) -> List[Dict]:
+    if isinstance(data, str) and is_json_lines(data):
+        return list(iter_json_lines(data))
     if isinstance(data, str):
         try:
             data = json.loads(data)
@@ -46,108 +286,484 @@ def _json_to_csv(data: Union[str, List[Dict], Dict]) -> str:
             raise ValueError(f"Invalid JSON input: {e}")
 
     if isinstance(data, dict):
-        records = [data]
+        return [data]
     elif isinstance(data, list):
-        records = data
+        return data
     else:
         raise ValueError("JSON must be an object or array of objects")
 
+
+def _json_to_csv_stream(data: Union[str, List[Dict], Dict]) -> BinaryIO:
+    """
+    Converts JSON data to UTF-8 encoded CSV. The first pass over the records only collects column names; the second
+    flattens and writes one record at a time, so memory use beyond the parsed input is the CSV itself, plus a single
+    record. Records are flattened with a plan of the union of their paths (see RecordFlattener). The CSV is held in
+    memory, since artifacts are uploaded as bytes; take it with getvalue(), which doesn't copy it.
+
+    Returns the output positioned at its start.
+    """
+    records = _parse_records(data)
+    output = BytesIO()
+
     if not records:
-        return ""
+        return output
+
+    flattener = RecordFlattener()
+    fieldnames = flattener.fieldnames(records)
+
+    text = TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(fieldnames)
+    for record in records:
+        writer.writerow(flattener.row(record))
+    text.detach()  # Flushes the text layer without closing the output
+
+    output.seek(0)
+    return output
+
+
+def _json_to_csv(data: Union[str, List[Dict], Dict]) -> str:
+    """Converts JSON data to CSV format."""
+    with _json_to_csv_stream(data) as output:
+        return output.getvalue().decode("utf-8")
+
+
+# Parallel conversion
+
+
+def _int_env(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
 
-    flattened_records = [_flatten_dict(record) for record in records]
 
-    fieldnames = set()
-    for record in flattened_records:
-        fieldnames.update(record.keys())
-    fieldnames = sorted(list(fieldnames))
+def _encode_chunk(records: List[Dict], fieldnames: list[str]) -> bytes:
+    """Returns the records as UTF-8 encoded CSV rows laid out with the given columns, without a header."""
+    flattener = RecordFlattener()
+    flattener.bind(fieldnames)
+    text = StringIO()
+    writer = csv.writer(text)
+    for record in records:
+        writer.writerow(flattener.row(record))
+    return text.getvalue().encode("utf-8")
 
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(flattened_records)
 
-    return output.getvalue()
+async def _json_to_csv_chunked(
+    pool: ProcessPoolExecutor, records: List[Dict]
+) -> BinaryIO:
+    chunk_size = max(1, _int_env("CONVERSION_CHUNK_SIZE", 2000))
+    chunks = [records[i : i + chunk_size] for i in range(0, len(records), chunk_size)]
+    loop = asyncio.get_running_loop()
 
+    # Sending records to another process is about as expensive as converting them, so the columns are collected
+    # here first, which only walks the records' keys, and each chunk is then sent and encoded once
+    fieldnames = await asyncio.to_thread(RecordFlattener().fieldnames, records)
+    encoded = await asyncio.gather(
+        *(
+            loop.run_in_executor(pool, _encode_chunk, chunk, fieldnames)
+            for chunk in chunks
+        )
+    )
+    logger.info(f"Converted {len(records)} records in {len(chunks)} chunks")
 
-def _csv_to_json(csv_content: str) -> str:
+    output = BytesIO()
+    header = StringIO()
+    csv.writer(header).writerow(fieldnames)
+    output.write(header.getvalue().encode("utf-8"))
+    for rows in encoded:
+        output.write(rows)
+    output.seek(0)
+    return output
+
+
+async def json_to_csv(data: Union[str, List[Dict], Dict]) -> BinaryIO:
+    """
+    Converts JSON data to UTF-8 encoded CSV without blocking the event loop. Inputs of up to
+    CONVERSION_INLINE_MAX_RECORDS records are converted inline, since handing them off costs more than it saves. Larger
+    inputs are split into chunks of CONVERSION_CHUNK_SIZE records that are flattened and encoded by the pool of
+    CONVERSION_WORKERS processes (see tools.process_pool), with the columns collected from all of the records
+    beforehand, and the chunks are written out in order. Without workers, inputs are converted in a thread instead.
+
+    Returns the output positioned at its start.
+    """
+    records = (
+        await asyncio.to_thread(_parse_records, data)
+        if isinstance(data, str)
+        else _parse_records(data)
+    )
+
+    if len(records) <= _int_env("CONVERSION_INLINE_MAX_RECORDS", 10_000):
+        return _json_to_csv_stream(records)
+
+    pool = conversion_pool()
+    if pool is not None:
+        try:
+            return await _json_to_csv_chunked(pool, records)
+        except BrokenProcessPool:
+            logger.warning(
+                "A conversion process died, converting in a thread instead",
+                exc_info=True,
+            )
+            discard_conversion_pool()
+
+    return await asyncio.to_thread(_json_to_csv_stream, records)
+
+
+# CSV to JSON
+
+_INTEGER = re.compile(r"-?(0|[1-9][0-9]*)")
+_NUMBER = re.compile(r"-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+_BOOLEANS = {"true": True, "false": False}
+_HEADER_SEGMENT = re.compile(r"\[([0-9]+)\]|([^.\[\]]+)")
+
+
+def _infer_types(rows: Iterable[list[str]], width: int) -> list[str]:
+    """
+    Returns "boolean", "number" or "string" for each of the first ``width`` columns, whichever fits every non-empty
+    value of the column, so a column is only converted if all of its values can be. Numbers with leading zeros are
+    left as strings since they are usually identifiers, like ZIP codes, and so are numbers too large for a float, which
+    JSON can't represent.
+    """
+    booleans = [True] * width
+    numbers = [True] * width
+    empty = [True] * width
+    for row in rows:
+        for i, value in enumerate(row[:width]):
+            if not value:
+                continue
+            empty[i] = False
+            if booleans[i] and value.lower() not in _BOOLEANS:
+                booleans[i] = False
+            if numbers[i] and not (
+                _NUMBER.fullmatch(value) and math.isfinite(float(value))
+            ):
+                numbers[i] = False
+    types = []
+    for i in range(width):
+        if empty[i]:
+            types.append("string")
+        elif booleans[i]:
+            types.append("boolean")
+        elif numbers[i]:
+            types.append("number")
+        else:
+            types.append("string")
+    return types
+
+
+def _parse_value(value: str, column_type: str) -> Any:
+    """Empty values become None, which leaves them out of the record."""
+    if not value:
+        return None
+    if column_type == "number":
+        return int(value) if _INTEGER.fullmatch(value) else float(value)
+    if column_type == "boolean":
+        return _BOOLEANS[value.lower()]
+    return value
+
+
+def _parse_header(name: str) -> tuple[str | int, ...] | None:
+    """Splits a header produced by _flatten_dict, like "a.b[0].c", into ("a", "b", 0, "c")."""
+    path = []
+    position = 0
+    for match in _HEADER_SEGMENT.finditer(name):
+        start = match.start()
+        index, key = match.groups()
+        if index is not None:
+            if start != position or not path:
+                return None
+            path.append(int(index))
+        else:
+            if start != (position + 1 if path else 0) or (
+                path and name[position] != "."
+            ):
+                return None
+            path.append(key)
+        position = match.end()
+    return tuple(path) if path and position == len(name) else None
+
+
+def _nesting_template(fieldnames: list[str]) -> dict | None:
+    """
+    Returns a tree of the nested objects and lists that the headers describe, with column numbers as leaves. Objects
+    are dicts with string keys and lists are dicts with integer keys. Returns None if the headers don't describe a
+    consistent structure, e.g. because "a" and "a.b" are both columns.
+    """
+    root = {}
+    for column, name in enumerate(fieldnames):
+        path = _parse_header(name)
+        if path is None:
+            return None
+        node = root
+        for segment, following in zip(path, path[1:]):
+            child = node.setdefault(segment, {})
+            if not isinstance(child, dict) or (
+                child
+                and isinstance(next(iter(child)), int) != isinstance(following, int)
+            ):
+                return None
+            node = child
+        if path[-1] in node:
+            return None
+        node[path[-1]] = column
+    return root
+
+
+def _build_record(template: dict, row: list) -> dict | list:
+    if template and isinstance(next(iter(template)), int):
+        items = [None] * (max(template) + 1)
+        for index, child in template.items():
+            items[index] = (
+                row[child] if isinstance(child, int) else _build_record(child, row)
+            )
+        # _flatten_dict writes nothing for the missing items of shorter lists, so trailing empty items are padding
+        while items and not contains_non_null_content(items[-1]):
+            items.pop()
+        return items
+    # Empty cells are fields that the record didn't have, since _flatten_dict writes nothing for them
+    record = {}
+    for key, child in template.items():
+        value = row[child] if isinstance(child, int) else _build_record(child, row)
+        if contains_non_null_content(value):
+            record[key] = value
+    return record
+
+
+def _csv_to_json_stream(
+    csv_content: str, nest: bool = True, json_lines: bool = False
+) -> BinaryIO:
+    """
+    Converts CSV data to a compact, UTF-8 encoded JSON array of objects, or JSON Lines if ``json_lines`` is set, one
+    row at a time. Column types are inferred from all of the rows in a first pass (see _infer_types), and empty cells
+    are left out of the records. If ``nest`` is set and the headers look like those produced by _flatten_dict, e.g.
+    "a.b[0]", the nested objects and lists are rebuilt.
+
+    Records converted to CSV by _json_to_csv_stream convert back to the same records, except that nulls, empty
+    strings, objects and lists are left out, like they are in the CSV, and that strings are converted to numbers or
+    booleans if every value of their column looks like one, since CSV has no types.
+
+    Returns the output positioned at its start. Like _json_to_csv_stream's, it is held in memory.
+    """
+    output = BytesIO()
+    text = TextIOWrapper(output, encoding="utf-8", newline="")
+
+    def read_rows() -> Iterator[list[str]]:
+        rows = csv.reader(StringIO(csv_content)) if csv_content.strip() else iter(())
+        return (row for row in rows if row)
+
+    rows = read_rows()
+    fieldnames = next(rows, [])
+    types = _infer_types(rows, len(fieldnames))
+
+    rows = read_rows()
+    next(rows, None)
+
+    template = _nesting_template(fieldnames) if nest else None
+    if template is None:
+        template = {name: column for column, name in enumerate(fieldnames)}
+
+    opening, delimiter, closing = ("", "\n", "\n") if json_lines else ("[", ",", "]")
+    text.write(opening)
+    separator = ""
+    for row in rows:
+        values = [
+            _parse_value(row[i] if i < len(row) else "", column_type)
+            for i, column_type in enumerate(types)
+        ]
+        text.write(separator)
+        text.write(
+            json.dumps(
+                _build_record(template, values),
+                separators=(",", ":"),
+                ensure_ascii=False,
+            )
+        )
+        separator = delimiter
+    if separator or not json_lines:
+        text.write(closing)
+    text.detach()  # Flushes the text layer without closing the output
+
+    output.seek(0)
+    return output
+
+
+def _csv_to_json(csv_content: str, nest: bool = True) -> str:
     """Converts CSV data to JSON format."""
-    if not csv_content.strip():
-        return json.dumps([])
+    with _csv_to_json_stream(csv_content, nest) as output:
+        return output.getvalue().decode("utf-8")
 
-    reader = csv.DictReader(StringIO(csv_content))
-    records = list(reader)
 
-    if not records:
-        return json.dumps([])
+FORMAT_NAMES = {
+    "json": "JSON",
+    "ndjson": "JSON Lines",
+    "csv": "CSV",
+    "parquet": "Parquet",
+    "arrow": "Arrow IPC",
+}
+
+OUTPUT_MIMETYPES = {
+    "json": "application/json",
+    "ndjson": JSON_LINES_MIMETYPE,
+    "csv": "text/csv",
+    **COLUMNAR_MIMETYPES,
+}
+
+
+def _load_records(content: str | bytes, source_format: str) -> List[Dict]:
+    if source_format in COLUMNAR_MIMETYPES:
+        return decode_columnar(content, source_format)
+    if source_format == "csv":
+        return json.loads(_csv_to_json(content))
+    if source_format == "ndjson":
+        return list(iter_json_lines(content))
+    return _parse_records(content)
+
 
-    return json.dumps(records, indent=2)
+def _dump_records(records: List[Dict]) -> bytes:
+    return json.dumps(
+        records, separators=(",", ":"), ensure_ascii=False, default=json_default
+    ).encode("utf-8")
+
+
+_FIRST_CHARACTER = re.compile(r"\S")
+
+
+def _sniff_source_format(
+    source_format: str, mimetype: str | None, content: str | bytes
+) -> str:
+    """
+    Recognizes JSON Lines content whose mimetype doesn't say so, which would otherwise be converted as JSON or CSV,
+    depending on the output format. Content labeled text/csv stays CSV, and the first line must be an object, since a
+    CSV header can also be valid JSON, like a single quoted column name.
+    """
+    if source_format not in ("json", "csv") or not isinstance(content, str):
+        return source_format
+    if (mimetype or "").startswith("text/csv"):
+        return source_format
+    first = _FIRST_CHARACTER.search(content)
+    if first and content[first.start()] == "{" and is_json_lines(content):
+        return "ndjson"
+    return source_format
+
+
+async def _convert(
+    content: str | bytes,
+    source_format: str,
+    output_format: str,
+    compression: str | None,
+) -> bytes:
+    # The outputs are taken with getvalue(), which hands over their buffer rather than copying it
+    if source_format in ("json", "ndjson") and output_format == "csv":
+        with await json_to_csv(content) as output:
+            return output.getvalue()
+    if source_format == "csv" and output_format in ("json", "ndjson"):
+        with await asyncio.to_thread(
+            _csv_to_json_stream, content, json_lines=output_format == "ndjson"
+        ) as output:
+            return output.getvalue()
+
+    records = await asyncio.to_thread(_load_records, content, source_format)
+    if output_format == "csv":
+        with await json_to_csv(records) as output:
+            return output.getvalue()
+    if output_format == "json":
+        return await asyncio.to_thread(_dump_records, records)
+    if output_format == "ndjson":
+        return await asyncio.to_thread(dump_json_lines, records)
+    return await asyncio.to_thread(encode_columnar, records, output_format, compression)
 
 
 async def convert_json_csv(
     artifact_id: ValidatedArtifactID,
-    output_format: str,
+    output_format: Literal["csv", "json", "ndjson", "parquet", "arrow"],
+    compression: Optional[str] = None,
 ):
     """
-    Convert between JSON and CSV formats.
+    Convert data between JSON, JSON Lines (NDJSON), CSV, and the columnar Parquet and Arrow IPC formats. JSON Lines
+    can be processed one record at a time. Parquet and Arrow store lists of records compactly with typed columns,
+    which makes them a good fit for large tables of records.
 
     :param artifact_id: The source artifact containing data to convert
-    :param output_format: The desired output format: 'csv' to convert JSON to CSV, or 'json' to convert CSV to JSON
+    :param output_format: The desired output format: 'csv' to convert JSON or JSON Lines to CSV, 'json' to convert CSV, JSON Lines, Parquet or Arrow to JSON, 'ndjson' to convert JSON, CSV, Parquet or Arrow to JSON Lines, or 'parquet' or 'arrow' to convert JSON, JSON Lines or CSV to a columnar format
+    :param compression: Compression for Parquet output (zstd, snappy, gzip, brotli, lz4 or none) or Arrow output (zstd, lz4 or none). Defaults to zstd.
     """
     context = current_context.get()
     artifacts = current_artifacts.get()
 
     source_artifact = artifacts.get(artifact_id)
+    output_format = output_format.lower()
 
-    async with context.begin_process("Converting data format") as process:
+    # Columnar and JSON Lines artifacts are recognized by their mimetype. Otherwise, JSON is converted to CSV and CSV
+    # to JSON, as before the other formats existed, unless the content turns out to be JSON Lines
+    source_format = columnar_format(source_artifact.mimetype)
+    if source_format is None and is_json_lines_mimetype(source_artifact.mimetype):
+        source_format = "ndjson"
+    if source_format is None:
+        is_csv = output_format == "json" or (
+            output_format != "csv"
+            and (source_artifact.mimetype or "").startswith("text/csv")
+        )
+        source_format = "csv" if is_csv else "json"
+
+    async with (
+        context.begin_process("Converting data format") as process,
+        log_process_usage(process),
+    ):
         process: IChatBioAgentProcess
 
-        artifact_content = await retrieve_text_artifact(source_artifact, process)
+        # Conversions hold the parsed records, so they need about as much memory as parsing JSON
+        if source_format in COLUMNAR_MIMETYPES:
+            artifact_content = await retrieve_bytes_artifact(
+                source_artifact, process, PARSED_JSON_MEMORY_FACTOR
+            )
+        else:
+            artifact_content = await retrieve_text_artifact(
+                source_artifact, process, PARSED_JSON_MEMORY_FACTOR
+            )
         if artifact_content is None:
             await process.log("Failed to retrieve data for processing")
             return
+        source_format = _sniff_source_format(
+            source_format, source_artifact.mimetype, artifact_content
+        )
 
+        source_name = FORMAT_NAMES[source_format]
+        output_name = FORMAT_NAMES.get(output_format, output_format)
         try:
             await process.log(
-                f"Converting artifact {source_artifact.local_id} to {output_format.upper()}"
+                f"Converting artifact {source_artifact.local_id} from {source_name} to {output_name}"
+            )
+            if output_format not in FORMAT_NAMES:
+                raise ValueError(f"Unsupported output format: {output_format}")
+            if output_format == source_format:
+                raise ValueError(f"The artifact is already {source_name}")
+            if output_format in COLUMNAR_MIMETYPES:
+                compression = resolve_compression(output_format, compression)
+
+            async with CPU_POOL.slot():
+                with timed("conversion"):
+                    result = await _convert(
+                        artifact_content, source_format, output_format, compression
+                    )
+            await process.log(f"Successfully converted {source_name} to {output_name}")
+
+            metadata = {
+                "conversion_type": f"{source_format}_to_{output_format}",
+                "source_artifact": source_artifact.local_id,
+                "format": output_format,
+            }
+            if output_format in COLUMNAR_MIMETYPES:
+                metadata["compression"] = compression
+
+            await create_artifact(
+                process,
+                mimetype=OUTPUT_MIMETYPES[output_format],
+                description=f"Converted {output_name} from {source_name}",
+                content=result,
+                metadata=metadata,
             )
 
-            if output_format.lower() == "csv":
-                result = _json_to_csv(artifact_content)
-                await process.log(f"Successfully converted JSON to CSV")
-
-                await process.create_artifact(
-                    mimetype="text/csv",
-                    description="Converted CSV from JSON",
-                    content=result.encode("utf-8"),
-                    metadata={
-                        "conversion_type": "json_to_csv",
-                        "source_artifact": source_artifact.local_id,
-                        "format": "csv",
-                    },
-                )
-
-                await context.reply(
-                    text=f"Successfully converted artifact {source_artifact.local_id} from JSON to CSV."
-                )
-            else:  # output_format == "json"
-                result = _csv_to_json(artifact_content)
-                await process.log(f"Successfully converted CSV to JSON")
-
-                await process.create_artifact(
-                    mimetype="application/json",
-                    description="Converted JSON from CSV",
-                    content=result.encode("utf-8"),
-                    metadata={
-                        "conversion_type": "csv_to_json",
-                        "source_artifact": source_artifact.local_id,
-                        "format": "json",
-                    },
-                )
-
-                await context.reply(
-                    text=f"Successfully converted artifact {source_artifact.local_id} from CSV to JSON."
-                )
+            await context.reply(
+                text=f"Successfully converted artifact {source_artifact.local_id} from {source_name} to {output_name}."
+            )
         except ValueError as e:
             await process.log(f"Conversion failed: {e}")
             await context.reply(f"Conversion failed: {e}")
@@ -0,0 +1,123 @@
+"""
+Generation of queries by the LLM, shared by the tools that turn a user's request into a query over an artifact. Each
+tool supplies a response model whose validator runs the generated query, so that queries that fail are sent back to
+the LLM to be fixed, and this module handles the LLM calls, model routing and escalation.
+"""
+
+import logging
+from typing import Any, Awaitable, Callable
+
+import instructor
+import openai
+from ichatbio.agent_response import IChatBioAgentProcess
+from instructor import AsyncInstructor
+from instructor.core import InstructorRetryException
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from metrics import Counter, openai_usage, record_llm_usage
+from resilience import LLM_UNAVAILABLE_MESSAGE, is_llm_available, llm_http_client
+from routing import RoutingDecision, escalate, record_outcome, route
+from tracing import add_event, annotate, span
+from util import get_llm_client_kwargs
+
+MAX_RETRIES = {"small": 2, "large": 5}
+
+QUERY_VALIDATION_FAILURES = Counter(
+    "query_validation_failures_total",
+    "Generated queries that failed validation and were sent back to the LLM",
+    ("stage",),
+)
+
+
+class GiveUp(BaseModel):
+    reason: str
+
+
+def _record_validation_failure(stage: str, e: Exception):
+    QUERY_VALIDATION_FAILURES.inc(stage=stage)
+    add_event("validation_failed", error=str(e))
+
+
+async def request_response(
+    stage: str,
+    routing: RoutingDecision,
+    messages: list[dict],
+    response_model: type[BaseModel],
+) -> BaseModel:
+    """Asks the routed model for an instance of response_model, and returns its "response" field."""
+    with span("generation", stage=stage, model=routing.model, tier=routing.tier):
+        try:
+            client: AsyncInstructor = instructor.from_openai(
+                AsyncOpenAI(**get_llm_client_kwargs(), http_client=llm_http_client())
+            )
+            client.on("parse:error", lambda e: _record_validation_failure(stage, e))
+            result, completion = await client.chat.completions.create_with_completion(
+                model=routing.model,
+                temperature=0,
+                response_model=response_model,
+                messages=messages,
+                max_retries=MAX_RETRIES[routing.tier],
+            )
+        except InstructorRetryException as e:
+            logging.warning(f"Failed to generate a response ({stage})", exc_info=e)
+            raise
+
+        prompt_tokens, cached_tokens = openai_usage(completion)
+        annotate(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+    record_llm_usage(stage, prompt_tokens, cached_tokens)
+
+    return result.response
+
+
+def _is_llm_unavailable(e: openai.APIError) -> bool:
+    """Whether the error means that the LLM endpoint is down, after the OpenAI client's own retries."""
+    return not is_llm_available(get_llm_client_kwargs()["base_url"]) or isinstance(
+        e, (openai.APIConnectionError, openai.InternalServerError)
+    )
+
+
+async def generate_with_escalation(
+    process: IChatBioAgentProcess,
+    request: str,
+    stage: str,
+    query_name: str,
+    attempt: Callable[[RoutingDecision], Awaitable[tuple[BaseModel, Any]]],
+) -> tuple[BaseModel, Any] | None:
+    """
+    Routes the generation of a query to a model and makes an attempt with it, escalating to the large model when a
+    small model's queries keep failing validation or it gives up. Returns what the successful attempt returned, which
+    may be a GiveUp, or None if no query could be generated, after logging why.
+    """
+    decision = route(stage, request)
+    while True:
+        await process.log(
+            f"Generating {query_name}",
+            data={"model": decision.model, "routing_reason": decision.reason},
+        )
+        try:
+            generation, result = await attempt(decision)
+        except (openai.APIError, InstructorRetryException) as e:
+            # Instructor wraps the LLM endpoint's errors too, which the large model wouldn't get past either
+            api_error = e if isinstance(e, openai.APIError) else e.__cause__
+            if isinstance(api_error, openai.APIError):
+                if _is_llm_unavailable(api_error):
+                    await process.log(LLM_UNAVAILABLE_MESSAGE)
+                    return None
+                raise
+            if escalated := escalate(decision, "generated queries failed validation"):
+                decision = escalated
+                continue
+            record_outcome(decision, "failed")
+            await process.log(f"Failed to generate {query_name}")
+            return None
+
+        # Small models give up more readily, so let the large model have a go before refusing
+        if isinstance(generation, GiveUp):
+            if escalated := escalate(decision, "small model gave up"):
+                decision = escalated
+                continue
+            record_outcome(decision, "gave_up")
+        else:
+            record_outcome(decision, "succeeded")
+        return generation, result
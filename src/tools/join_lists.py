@@ -1,20 +1,215 @@
+import asyncio
 import json
+import logging
+from contextlib import ExitStack
+from tempfile import SpooledTemporaryFile
+from typing import Iterable, Literal, Optional
 
 from ichatbio.agent_response import IChatBioAgentProcess
+from pydantic import BaseModel
 
 from context import ValidatedArtifactID, current_context, current_artifacts
-from tools.util import context_tool, ProcessError, retrieve_json_list_artifact
+from memory import admit_parsing
+from metrics import timed
+from scheduling import CPU_POOL
+from tools.spill import SpillDatabase, record_key, should_spill
+from tools.util import (
+    JSON,
+    ProcessError,
+    context_tool,
+    create_artifact,
+    iter_json_records,
+    log_process_usage,
+    retrieve_text_artifact,
+)
+
+logger = logging.getLogger(__name__)
+
+JoinType = Literal["inner", "left", "outer"]
+
+JOIN_SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+"""Out-of-core joins write their result to a temporary file once it grows larger than this many bytes."""
+
+
+class JoinStats(BaseModel):
+    how: JoinType
+    on: list[str]
+    other_on: list[str]
+    index_side: Literal["one", "two"]
+    out_of_core: bool = False
+    records_one: int
+    records_two: int
+    matched_one: int
+    matched_two: int
+    missing_keys_one: int
+    missing_keys_two: int
+    duplicate_keys: int
+    """Keys shared by more than one record of the indexed list, each of which produces one joined record per match"""
+    joined_records: int
+
+
+def _other_key_fields(on: list[str], other_on: list[str] | None) -> list[str]:
+    other_on = other_on or on
+    if len(other_on) != len(on):
+        raise ValueError(
+            f"Both lists need the same number of key fields, got {len(on)} and {len(other_on)}"
+        )
+    return other_on
+
+
+def hash_join(
+    list_one: list,
+    list_two: list,
+    on: list[str],
+    other_on: list[str] | None = None,
+    how: JoinType = "inner",
+) -> tuple[list, JoinStats]:
+    """
+    Joins the records of two lists that have equal keys. The key of each record of the first list is made of the
+    fields named by `on`, and of each record of the second list, by `other_on` (which defaults to `on`).
+
+    The smaller list is indexed by key and the larger one is looked up in the index, so the join takes time in
+    proportion to the size of both lists and memory in proportion to the smaller one, plus the result. Records with
+    duplicate keys are joined with every matching record. Joined records keep the order of the first list, followed,
+    in an outer join, by the unmatched records of the second list. Fields of the second list's records take
+    precedence over fields of the first list's records with the same name.
+    """
+    other_on = _other_key_fields(on, other_on)
+
+    keys_one = [record_key(record, on) for record in list_one]
+    keys_two = [record_key(record, other_on) for record in list_two]
+
+    # For each record of the first list, the indices of the second list's records it joins with
+    matches: list[list[int]] = [[] for _ in list_one]
+    index: dict[tuple, list[int]] = {}
+    if len(list_one) < len(list_two):
+        index_side = "one"
+        for i, key in enumerate(keys_one):
+            if key is not None:
+                index.setdefault(key, []).append(i)
+        for j, key in enumerate(keys_two):
+            for i in index.get(key, ()) if key is not None else ():
+                matches[i].append(j)
+    else:
+        index_side = "two"
+        for j, key in enumerate(keys_two):
+            if key is not None:
+                index.setdefault(key, []).append(j)
+        for i, key in enumerate(keys_one):
+            if key is not None:
+                matches[i] = index.get(key, [])
+
+    joined = []
+    matched_two = bytearray(len(list_two))
+    for record_one, record_matches in zip(list_one, matches):
+        for j in record_matches:
+            joined.append(record_one | list_two[j])
+            matched_two[j] = 1
+        if not record_matches and how in ("left", "outer"):
+            joined.append(record_one)
+    if how == "outer":
+        joined.extend(
+            record for record, matched in zip(list_two, matched_two) if not matched
+        )
+
+    stats = JoinStats(
+        how=how,
+        on=on,
+        other_on=other_on,
+        index_side=index_side,
+        records_one=len(list_one),
+        records_two=len(list_two),
+        matched_one=sum(1 for record_matches in matches if record_matches),
+        matched_two=sum(matched_two),
+        missing_keys_one=keys_one.count(None),
+        missing_keys_two=keys_two.count(None),
+        duplicate_keys=sum(1 for indices in index.values() if len(indices) > 1),
+        joined_records=len(joined),
+    )
+    return joined, stats
+
+
+def spill_join(
+    records_one: Iterable[JSON],
+    records_two: Iterable[JSON],
+    on: list[str],
+    other_on: list[str] | None = None,
+    how: JoinType = "inner",
+) -> tuple[SpooledTemporaryFile, JoinStats]:
+    """
+    Joins records like hash_join, but out of core: the records are loaded into a SpillDatabase as they are parsed,
+    the join runs there, and the joined list is written as JSON to a temporary file, so the records are never all in
+    memory at once.
+    """
+    other_on = _other_key_fields(on, other_on)
+    with ExitStack() as stack:
+        output = stack.enter_context(
+            SpooledTemporaryFile(max_size=JOIN_SPOOL_MAX_MEMORY, mode="w+b")
+        )
+        with SpillDatabase() as db:
+            records = [
+                db.load("one", records_one, on),
+                db.load("two", records_two, other_on),
+            ]
+            index_side = "one" if records[0] < records[1] else "two"
+
+            joined = 0
+            output.write(b"[")
+            for record_one, record_two in db.join("one", "two", how):
+                if record_one is None:
+                    record = record_two
+                elif record_two is None:
+                    record = record_one
+                else:
+                    record = json.dumps(json.loads(record_one) | json.loads(record_two))
+                output.write(f"{', ' if joined else ''}{record}".encode("utf-8"))
+                joined += 1
+            output.write(b"]")
+
+            stats = JoinStats(
+                how=how,
+                on=on,
+                other_on=other_on,
+                index_side=index_side,
+                out_of_core=True,
+                records_one=records[0],
+                records_two=records[1],
+                matched_one=db.count_matched("one", "two"),
+                matched_two=db.count_matched("two", "one"),
+                missing_keys_one=db.count_missing_keys("one"),
+                missing_keys_two=db.count_missing_keys("two"),
+                duplicate_keys=db.count_duplicate_keys(index_side),
+                joined_records=joined,
+            )
+        # The output is closed if the join fails, and otherwise by the caller
+        stack.pop_all()
+    output.seek(0)
+    return output, stats
+
+
+def _parse_lists(sources: list[Iterable[JSON]]) -> list[list]:
+    return [list(source) for source in sources]
 
 
 @context_tool
 async def join_lists(
-    artifact_one_id: ValidatedArtifactID, artifact_two_id: ValidatedArtifactID
+    artifact_one_id: ValidatedArtifactID,
+    artifact_two_id: ValidatedArtifactID,
+    on: Optional[list[str]] = None,
+    other_on: Optional[list[str]] = None,
+    how: JoinType = "inner",
 ):
     """
-    Joins two lists of equal length, joining items by index to produce a new list of the same length.
+    Joins two lists of records. With `on`, joins records that have the same values in the named fields, like a
+    database join. Without `on`, joins two lists of equal length by index, producing a new list of the same length.
 
     :param artifact_one_id: A list artifact
-    :param artifact_two_id: Another list artifact of the same length
+    :param artifact_two_id: Another list artifact
+    :param on: Fields of the first list's records to join on, like ["uuid"]. Use more than one field for a composite
+        key, and dots for nested fields, like ["indexTerms.scientificname"]
+    :param other_on: Fields of the second list's records to join on, if they are named differently than `on`
+    :param how: Which records to keep when joining on fields. "inner" keeps only records that match, "left" also keeps
+        the first list's records that match nothing, and "outer" also keeps both lists' records that match nothing
     :return: A new artifact
     """
 
@@ -23,25 +218,90 @@ async def join_lists(
 
     artifact_one, artifact_two = artifacts.get(artifact_one_id, artifact_two_id)
 
-    async with context.begin_process("Processing data") as process:
+    async with (
+        context.begin_process("Processing data") as process,
+        log_process_usage(process),
+    ):
         process: IChatBioAgentProcess
 
+        sources = []
+        size = 0
+        for artifact in (artifact_one, artifact_two):
+            try:
+                text = await retrieve_text_artifact(artifact, process)
+                sources.append(iter_json_records(text, artifact.mimetype))
+            except ProcessError:
+                return
+            except ValueError:
+                await process.log(f"Artifact {artifact.local_id} content is not a list")
+                return
+            size += len(text)
+
+        metadata = {"source_artifacts": [artifact_one.local_id, artifact_two.local_id]}
+
+        # Large lists are joined on disk, as are lists there isn't enough memory left to parse, but joins by index can
+        # only be done in memory
+        in_memory = not (on and should_spill(size)) and admit_parsing(size)
+        if not on and not in_memory:
+            await process.log(
+                "The lists are too large to join by index with the memory available. Join them on a field instead,"
+                " which can be done on disk"
+            )
+            return
+
         try:
-            list_one = await retrieve_json_list_artifact(artifact_one, process)
-            list_two = await retrieve_json_list_artifact(artifact_two, process)
-        except ProcessError:
+            async with CPU_POOL.slot():
+                if not in_memory:
+                    await process.log(
+                        "The lists are too large to join in memory, so joining them on disk"
+                    )
+                    # Records are parsed, joined and serialized in a single pass
+                    with timed("join"):
+                        output, stats = await asyncio.to_thread(
+                            spill_join, *sources, on, other_on, how
+                        )
+                        with output:
+                            content = output.read()
+                else:
+                    with timed("parse"):
+                        list_one, list_two = await asyncio.to_thread(
+                            _parse_lists, sources
+                        )
+                    with timed("join"):
+                        if on:
+                            new_list, stats = await asyncio.to_thread(
+                                hash_join, list_one, list_two, on, other_on, how
+                            )
+                        else:
+                            new_list = [
+                                record_one | record_two
+                                for record_one, record_two in zip(list_one, list_two)
+                            ]
+                    with timed("serialization"):
+                        content = json.dumps(new_list).encode("utf-8")
+        except ValueError as e:
+            await process.log(f"Failed to join the lists: {e}")
             return
 
-        new_list = [
-            record_one | record_two
-            for record_one, record_two in zip(list_one, list_two)
-        ]
+        if on:
+            logger.info(f"Joined lists: {stats}")
+            await process.log(
+                f"Joined on {', '.join(stats.on)} ({how} join): {stats.matched_one} of {stats.records_one} records"
+                f" of artifact {artifact_one.local_id} matched {stats.matched_two} of {stats.records_two} records of"
+                f" artifact {artifact_two.local_id}, producing {stats.joined_records} records",
+                data=stats.model_dump(),
+            )
+            metadata |= {
+                "join": {"on": stats.on, "other_on": stats.other_on, "how": how}
+            }
+            description = f"Records from artifacts {artifact_one.local_id} and {artifact_two.local_id} joined on {', '.join(stats.on)}"
+        else:
+            description = f"Joined list of records from artifacts {artifact_one.local_id} and {artifact_two.local_id}"
 
-        await process.create_artifact(
+        await create_artifact(
+            process,
             mimetype="application/json",
-            description=f"Joined list of records from artifacts {artifact_one.local_id} and {artifact_two.local_id}",
-            content=json.dumps(new_list).encode("utf-8"),
-            metadata={
-                "source_artifacts": [artifact_one.local_id, artifact_two.local_id]
-            },
+            description=description,
+            content=content,
+            metadata=metadata,
         )
@@ -1,15 +1,11 @@
+import functools
+import itertools
 import json
-import logging
-import os
 from typing import Union
 
-import instructor
 import jq
 from ichatbio.agent_response import IChatBioAgentProcess
 from ichatbio.types import Artifact
-from instructor import AsyncInstructor
-from instructor.core import InstructorRetryException
-from openai import AsyncOpenAI
 from pydantic import BaseModel, Field, field_validator
 
 from context import (
@@ -18,21 +14,54 @@ from context import (
     current_context,
     current_request,
 )
+from metrics import timed
+from routing import RoutingDecision
+from tools.generation import GiveUp, generate_with_escalation, request_response
 from tools.util import (
     JSON,
     contains_non_null_content,
     context_tool,
     extract_json_schema,
-    retrieve_json_artifact,
+    render_schema,
+    retrieve_json_source,
     ProcessError,
+    JSON_LINES_MIMETYPE,
+    JsonLines,
+    dump_json_lines,
+    create_artifact,
+    log_process_usage,
 )
-from util import get_llm_client_kwargs
 
 MAX_CHARACTERS_TO_SHOW_AI = 1024 * 10
 MAX_SOURCE_PREVIEW_SIZE = 500
+SCHEMA_TOKEN_BUDGET = 2000
+JSON_LINES_SCHEMA_SAMPLE = 1000
+"""The schema of JSON Lines data is inferred from this many of its first records."""
+
+JSON_LINES_NOTE = """\
+The data is in JSON Lines format, with one JSON record per line. The query is run on each record separately, like jq \
+does for a stream of inputs, and all of its outputs are collected."""
 
 NONE = object()
 
+COMMON_JQ_QUERIES = [
+    ".",
+    ".[]",
+    "length",
+    "keys",
+    ".items",
+    ".items[]",
+    ".[] | keys",
+    "map(keys) | add | unique",
+]
+"""Queries that are compiled ahead of the first request, during warm-up."""
+
+
+@functools.lru_cache(maxsize=256)
+def compile_jq(query: str) -> jq._Program:
+    """Compiles a jq query, reusing the program if the same query was compiled before, e.g. in an earlier attempt."""
+    return jq.compile(query)
+
 
 class JQQuery(BaseModel):
     plan: str = Field(
@@ -50,11 +79,9 @@ class JQQuery(BaseModel):
     )
 
 
-class GiveUp(BaseModel):
-    reason: str
-
-
-def _make_validating_response_model(source_content: JSON, results_box: list):
+def _make_validating_response_model(
+    source_content: JSON | JsonLines, results_box: list
+):
     class ValidatedJQQuery(JQQuery):
         @field_validator("jq_query_string", mode="after")
         @classmethod
@@ -64,21 +91,26 @@ def _make_validating_response_model(source_content: JSON, results_box: list):
                 return query
 
             try:
-                compiled = jq.compile(query)
+                compiled = compile_jq(query)
             except ValueError as e:
                 raise ValueError(f"Failed to compile JQ query string {query}", e)
 
-            try:
-                result = compiled.input_value(source_content).all()
+            with timed("jq_validation"):
+                try:
+                    if isinstance(source_content, JsonLines):
+                        # jq runs the query on each record and collects the outputs, without parsing them all up front
+                        result = compiled.input_text(source_content.text).all()
+                    else:
+                        result = compiled.input_value(source_content).all()
 
-                # Don't wrap a list in another list
-                if type(result) is list and len(result) == 1:
-                    result = result[0]
+                        # Don't wrap a list in another list
+                        if type(result) is list and len(result) == 1:
+                            result = result[0]
 
-            except ValueError as e:
-                raise ValueError(
-                    f"Failed to execute JQ query {query} on provided content", e
-                )
+                except ValueError as e:
+                    raise ValueError(
+                        f"Failed to execute JQ query {query} on provided content", e
+                    )
 
             if not contains_non_null_content(result):
                 raise ValueError(
@@ -112,53 +144,71 @@ field values are going to be consistent, prefer to use regex matching ("test" fi
 ("select" filters). If needed, you may consider testing for different variations of names that can be represented in
 various ways. For example, a person's first name may be initialized or spelled out, country names may be acronyms or 
 spelled out, etc. 
+
+# Input
+
+The user will provide, in order:
+1. The data's metadata
+2. The structure of the JSON data. Each line is a JQ path segment relative to the line it is indented under, followed
+   by the type of its value. Assume that fields with no specified type are strings.
+3. The first few characters of the data
+4. The request to fulfill
 """
 
 
-async def _generate_and_run_jq_query(
-    request: str, schema: dict, source_content: JSON, source_artifact: Artifact
-) -> (JQQuery | GiveUp, JSON):
-    source_meta = source_artifact.model_dump_json()
-    preview = json.dumps(source_content)[:MAX_SOURCE_PREVIEW_SIZE]
+def _infer_schema(source_content: JSON | JsonLines) -> dict:
+    if isinstance(source_content, JsonLines):
+        sample = list(
+            itertools.islice(source_content.records(), JSON_LINES_SCHEMA_SAMPLE)
+        )
+        return extract_json_schema(sample).get("items", {})
+    return extract_json_schema(source_content)
 
-    messages = [
+
+def _make_messages(
+    request: str,
+    schema: str,
+    source_content: JSON | JsonLines,
+    source_artifact: Artifact,
+) -> list[dict]:
+    source_meta = source_artifact.model_dump_json()
+    if isinstance(source_content, JsonLines):
+        preview = source_content.text[:MAX_SOURCE_PREVIEW_SIZE]
+        structure = f"{JSON_LINES_NOTE}\n\nStructure of each record:\n{schema}"
+    else:
+        preview = json.dumps(source_content)[:MAX_SOURCE_PREVIEW_SIZE]
+        structure = f"Structure:\n{schema}"
+
+    # Providers cache prompts by prefix, so the static system prompt comes first and the content that changes most
+    # often comes last
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Metadata: {source_meta}"},
+        {"role": "user", "content": structure},
         {
             "role": "user",
-            "content": f'The data have the following metadata: "{source_meta}"',
+            "content": f"First {len(preview)} characters: {preview}",
         },
-        {
-            "role": "user",
-            "content": "The JSON data to be processed have the JSON Schema definition that follows. Assume that fields "
-            'with no specified "type" are strings.\n\n'
-            + json.dumps(schema).replace(': {"type": "string"}', ""),
-        },  # Save some tokens
-        {
-            "role": "user",
-            "content": f"For reference, here's the first {len(preview)} characters of the source data: {preview}",
-        },
-        {"role": "user", "content": request},
+        {"role": "user", "content": f"Request: {request}"},
     ]
 
+
+async def _generate_and_run_jq_query(
+    request: str,
+    schema: str,
+    source_content: JSON | JsonLines,
+    source_artifact: Artifact,
+    routing: RoutingDecision,
+) -> (JQQuery | GiveUp, JSON):
+    with timed("prompt_build"):
+        messages = _make_messages(request, schema, source_content, source_artifact)
+
     results_box = [None]
     response_model = _make_validating_response_model(source_content, results_box)
 
-    try:
-        client: AsyncInstructor = instructor.from_openai(
-            AsyncOpenAI(**get_llm_client_kwargs())
-        )
-        result = await client.chat.completions.create(
-            model=os.getenv("LLM"),
-            temperature=0,
-            response_model=response_model,
-            messages=messages,
-            max_retries=5,
-        )
-    except InstructorRetryException as e:
-        logging.warning("Failed to generate JQ query string", e)
-        raise
-
-    response: JQQuery | GiveUp = result.response
+    response: JQQuery | GiveUp = await request_response(
+        "jq_generation", routing, messages, response_model
+    )
 
     return response, results_box[0]
 
@@ -177,26 +227,47 @@ async def process_data(artifact_id: ValidatedArtifactID):
 
     source_artifact = artifacts.get(artifact_id)
 
-    async with context.begin_process("Processing data") as process:
+    async with (
+        context.begin_process("Processing data") as process,
+        log_process_usage(process),
+    ):
         process: IChatBioAgentProcess
 
         await process.log("Retrieving artifact data")
         try:
-            source_content = await retrieve_json_artifact(source_artifact, process)
+            source_content = await retrieve_json_source(source_artifact, process)
         except ProcessError:
             return
 
         await process.log("Inferring the JSON data's schema")
-        schema = extract_json_schema(source_content)
-
-        await process.log("Generating JQ query string")
         try:
-            generation, query_result = await _generate_and_run_jq_query(
-                request, schema, source_content, source_artifact
-            )
-        except InstructorRetryException:
-            await process.log("Failed to generate JQ query string")
+            with timed("schema_inference"):
+                json_schema = _infer_schema(source_content)
+                schema = render_schema(json_schema, request, SCHEMA_TOKEN_BUDGET)
+        except ValueError as e:
+            await process.log(f"Error decoding JSON Lines: {e}")
+            return
+        await process.log(
+            f"Described the schema in ~{schema.rendered_tokens} tokens, saving ~{schema.saved_tokens} tokens",
+            data={
+                "original_tokens": schema.original_tokens,
+                "rendered_tokens": schema.rendered_tokens,
+                "omitted_fields": len(schema.omitted_paths),
+            },
+        )
+
+        generated = await generate_with_escalation(
+            process,
+            request,
+            "jq_generation",
+            "JQ query string",
+            lambda decision: _generate_and_run_jq_query(
+                request, schema.text, source_content, source_artifact, decision
+            ),
+        )
+        if generated is None:
             return
+        generation, query_result = generated
 
         match generation:
             case GiveUp(reason=reason):
@@ -211,15 +282,22 @@ async def process_data(artifact_id: ValidatedArtifactID):
                 await process.log(
                     "Generated JQ query", data={"query_string": jq_query_string}
                 )
-                output_as_bytes = json.dumps(query_result).encode("utf-8")
+                with timed("serialization"):
+                    if isinstance(source_content, JsonLines):
+                        mimetype = JSON_LINES_MIMETYPE
+                        output_as_bytes = dump_json_lines(query_result)
+                    else:
+                        mimetype = "application/json"
+                        output_as_bytes = json.dumps(query_result).encode("utf-8")
                 output_size_in_bytes = len(output_as_bytes)
 
                 await process.log(
                     f"Executed JQ query generated {output_size_in_bytes} bytes of data"
                 )
 
-                await process.create_artifact(
-                    mimetype="application/json",
+                await create_artifact(
+                    process,
+                    mimetype=mimetype,
                     description=artifact_description,
                     content=output_as_bytes,
                     metadata={
@@ -0,0 +1,43 @@
+"""
+The pool of processes that the tools share for CPU-bound work on large artifacts, like converting them to CSV or
+tallying their values, so that it runs in parallel instead of holding up the worker process's event loop.
+
+The pool has CONVERSION_WORKERS processes, and is started when it is first needed.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from scheduling import worker_count
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def conversion_workers() -> int:
+    # By default, leave a core for each worker process's event loop, and share the rest between them
+    cpus = os.cpu_count() or 1
+    default = min(4, (cpus - worker_count()) // worker_count())
+    return int(os.getenv("CONVERSION_WORKERS", str(default)))
+
+
+def conversion_pool() -> ProcessPoolExecutor | None:
+    """Returns the shared pool of conversion processes, starting it if necessary, or None if it's disabled."""
+    global _process_pool
+    workers = conversion_workers()
+    if workers < 1:
+        return None
+    if _process_pool is None:
+        # Forking a process that runs threads (like the event loop's executors) is unsafe, so start fresh interpreters
+        _process_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def discard_conversion_pool():
+    """Shuts down the pool after one of its processes died, so that the next conversion starts a new one."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -0,0 +1,529 @@
+"""
+Answers requests about lists of records with SQL, which suits grouping, counting and other aggregations better than
+jq. The records are loaded into a table in an embedded SQLite database, with nested objects flattened into columns
+named with dots, like "indexTerms.scientificname", and the LLM writes a query against that table.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from typing import Iterable, Union
+
+from ichatbio.agent_response import IChatBioAgentProcess
+from ichatbio.types import Artifact
+from pydantic import BaseModel, Field, field_validator
+
+from context import (
+    ValidatedArtifactID,
+    current_artifacts,
+    current_context,
+    current_request,
+)
+from memory import admit_parsing
+from metrics import timed
+from routing import RoutingDecision
+from scheduling import CPU_POOL
+from tools.generation import GiveUp, generate_with_escalation, request_response
+from tools.spill import (
+    close_temporary_database,
+    open_temporary_database,
+    should_spill,
+)
+from tools.util import (
+    CHARACTERS_PER_TOKEN,
+    JSON,
+    JSON_LINES_MIMETYPE,
+    OMITTED_FIELDS_NOTE,
+    ProcessError,
+    _words,
+    context_tool,
+    contains_non_null_content,
+    create_artifact,
+    dump_json_lines,
+    is_json_lines,
+    iter_json_records,
+    log_process_usage,
+    retrieve_text_artifact,
+)
+
+TABLE = "records"
+SEQUENCE_COLUMN = "#seq"
+"""The column that numbers the rows. Record fields are never given this name, see RecordTable._column()."""
+MAX_SOURCE_PREVIEW_SIZE = 500
+SCHEMA_TOKEN_BUDGET = 2000
+LOAD_BATCH_SIZE = 1000
+SQL_QUERY_TIMEOUT_SECONDS = 30
+"""Queries that run longer than this are interrupted."""
+SQL_VALIDATION_TIMEOUT_SECONDS = 0.5
+"""
+Generated queries are tried while the LLM's response is validated, which happens on the event loop, for at most this
+long. Queries that take longer are run to completion in a thread once the response is accepted.
+"""
+
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _flatten(record: dict, prefix: tuple = (), row: dict | None = None) -> dict:
+    """
+    Flattens nested objects into a row keyed by the path of each field, as a tuple of keys. Lists are kept whole, to be
+    stored as JSON.
+    """
+    row = {} if row is None else row
+    for key, value in record.items():
+        path = prefix + (key,)
+        if type(value) is dict and value:
+            _flatten(value, path, row)
+        else:
+            row[path] = value
+    return row
+
+
+def _path_name(path: tuple[str, ...]) -> str:
+    """Names a field by its path, with dots, quoting keys that contain dots themselves."""
+    return ".".join(json.dumps(key) if "." in key else key for key in path)
+
+
+_TYPES = {
+    bool: "boolean",
+    int: "integer",
+    float: "number",
+    str: "string",
+    list: "list",
+    dict: "object",
+}
+
+
+class QueryTimeout(ValueError):
+    pass
+
+
+class RecordTable:
+    """
+    A table of flattened records. Columns are added as records with new fields are loaded, and each column remembers
+    the types of its values, so that the LLM can be told about them and query results can be turned back into JSON.
+
+    Columns are named after the paths of their fields, with dots, like "taxon.genus". SQLite compares column names
+    without regard to case, so a field whose name clashes with another's, like "ID" and "id", or a literal "a.b" key
+    and a nested "a" -> "b", gets a numbered column name instead, like "ID_2".
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.columns: dict[str, set[str]] = {}
+        self.count = 0
+        self.paths: dict[str, tuple[str, ...]] = {}
+        """The path of the field in each column."""
+        self._column_names: dict[tuple[str, ...], str] = {}
+        self._folded_names = {SEQUENCE_COLUMN.casefold()}
+        self._inserts: dict[tuple[tuple[str, ...], ...], str] = {}
+        db.execute(
+            f"CREATE TABLE {TABLE} ({_quote(SEQUENCE_COLUMN)} INTEGER PRIMARY KEY)"
+        )
+
+    def _column(self, path: tuple[str, ...]) -> str:
+        """The name of the column for the field at the path, adding the column if there isn't one yet."""
+        if path not in self._column_names:
+            name = preferred = _path_name(path)
+            suffix = 1
+            while name.casefold() in self._folded_names:
+                suffix += 1
+                name = f"{preferred}_{suffix}"
+            self.db.execute(f"ALTER TABLE {TABLE} ADD COLUMN {_quote(name)}")
+            self._folded_names.add(name.casefold())
+            self._column_names[path] = name
+            self.paths[name] = path
+        return self._column_names[path]
+
+    def _insert(self, paths: tuple[tuple[str, ...], ...]) -> str:
+        if paths not in self._inserts:
+            names = [self._column(path) for path in paths]
+            self._inserts[paths] = (
+                f"INSERT INTO {TABLE} ({', '.join(map(_quote, names))})"
+                f" VALUES ({', '.join('?' * len(names))})"
+            )
+        return self._inserts[paths]
+
+    def load(self, records: Iterable[JSON]):
+        """Adds records to the table. Values that aren't objects are stored in a "value" column."""
+        # Records with the same fields are inserted together
+        batches: dict[tuple[str, ...], list[tuple]] = {}
+        self.db.execute("BEGIN")
+        try:
+            for record in records:
+                row = _flatten(
+                    record if isinstance(record, dict) else {"value": record}
+                )
+                paths = tuple(row)
+                batch = batches.setdefault(paths, [])
+                batch.append(tuple(row.values()))
+                if len(batch) == LOAD_BATCH_SIZE:
+                    self._insert_batch(paths, batches.pop(paths))
+            for paths, batch in batches.items():
+                self._insert_batch(paths, batch)
+        finally:
+            self.db.execute("COMMIT")
+
+    def _insert_batch(self, paths: tuple[tuple[str, ...], ...], rows: list[tuple]):
+        insert = self._insert(paths)
+        # Working a column at a time keeps most of the per-value work out of Python
+        columns = list(zip(*rows))
+        for i, (path, values) in enumerate(zip(paths, columns)):
+            name = self._column_names[path]
+            kinds = set(map(type, values))
+            types = self.columns.setdefault(name, set())
+            types.update(_TYPES[kind] for kind in kinds if kind in _TYPES)
+            if list in kinds or dict in kinds:
+                columns[i] = [
+                    json.dumps(value) if isinstance(value, (list, dict)) else value
+                    for value in values
+                ]
+        self.db.executemany(insert, zip(*columns))
+        self.count += len(rows)
+
+    def describe(self, request: str = "", token_budget: int | None = None) -> str:
+        """
+        Lists the table's columns and their types. If the listing exceeds token_budget, the columns whose names are
+        least relevant to the request are left out.
+        """
+        lines = []
+        for name, types in self.columns.items():
+            column = _quote(name)
+            path = _path_name(self.paths[name])
+            if path != name:
+                column += f" (the field {path})"
+            if types == {"list"} or types == {"object"}:
+                kind = f"{'|'.join(types)} (stored as JSON text)"
+            elif types == {"boolean"}:
+                kind = "boolean (0 or 1)"
+            elif types == {"string"}:
+                lines.append(
+                    column
+                )  # Strings are the default, don't spend tokens on them
+                continue
+            else:
+                kind = "|".join(sorted(types)) or "null"
+            lines.append(f"{column}: {kind}")
+
+        if token_budget is None:
+            return "\n".join(lines)
+        limit = token_budget * CHARACTERS_PER_TOKEN - len(OMITTED_FIELDS_NOTE) - 8
+        request_words = _words(request)
+        relevance = [len(request_words & _words(line)) for line in lines]
+        kept, size = set(), 0
+        for i in sorted(range(len(lines)), key=lambda i: -relevance[i]):
+            if size + len(lines[i]) + 1 > limit:
+                continue
+            kept.add(i)
+            size += len(lines[i]) + 1
+        text = "\n".join(line for i, line in enumerate(lines) if i in kept)
+        if len(kept) < len(lines):
+            text += "\n" + OMITTED_FIELDS_NOTE.format(len(lines) - len(kept))
+        return text
+
+    def _json_value(self, name: str, value):
+        """Turns a value of a result column back into JSON, if the column is one of the table's columns."""
+        types = self.columns.get(name)
+        if value is None or not types:
+            return value
+        if types == {"boolean"} and value in (0, 1):
+            return bool(value)
+        if types <= {"list", "object"} and isinstance(value, str):
+            try:
+                return json.loads(value)
+            except json.JSONDecodeError:
+                return value
+        return value
+
+    def query(self, sql: str, timeout: float | None = None) -> list[dict]:
+        """
+        Runs a read-only query and returns its rows as objects. Queries are interrupted after timeout seconds, or
+        SQL_QUERY_TIMEOUT_SECONDS.
+        """
+        timeout = SQL_QUERY_TIMEOUT_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        def authorize(action, *_):
+            return (
+                sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+            )
+
+        self.db.set_authorizer(authorize)
+        self.db.set_progress_handler(lambda: time.monotonic() > deadline, 10_000)
+        try:
+            cursor = self.db.execute(sql)
+            names = [column[0] for column in cursor.description or ()]
+            return [
+                {
+                    name: self._json_value(name, value)
+                    for name, value in zip(names, row)
+                    if name != SEQUENCE_COLUMN
+                }
+                for row in cursor
+            ]
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                raise QueryTimeout(
+                    f"The query took longer than {timeout:g} seconds"
+                ) from e
+            raise ValueError(str(e)) from e
+        except sqlite3.Error as e:
+            raise ValueError(str(e)) from e
+        finally:
+            self.db.set_authorizer(None)
+            self.db.set_progress_handler(None, 0)
+
+
+class SQLQuery(BaseModel):
+    plan: str = Field(
+        description="A brief explanation of how you plan to query the data (what columns to use, any filters, groupings, etc.)"
+    )
+    sql_query: str = Field(
+        description=f"A SQLite SELECT statement that queries the {TABLE} table.",
+    )
+    output_description: str = Field(
+        description="A concise characterization of the data that the query will retrieve",
+        examples=[
+            "Number of Rattus rattus records in iDigBio per country",
+            "GBIF occurrence records modified in 2025",
+        ],
+    )
+
+
+def _make_validating_response_model(table: RecordTable, results_box: list):
+    class ValidatedSQLQuery(SQLQuery):
+        @field_validator("sql_query", mode="after")
+        @classmethod
+        def validate_sql_query(cls, query):
+            # If the LLM doesn't know how to construct an appropriate query, it shouldn't generate one
+            if not query:
+                return query
+
+            try:
+                with timed("sql_validation"):
+                    result = table.query(query, SQL_VALIDATION_TIMEOUT_SECONDS)
+            except QueryTimeout:
+                # The query is valid as far as SQLite can tell, but it's left to finish off the event loop, where its
+                # result is checked for emptiness instead
+                results_box[0] = None
+                return query
+            except ValueError as e:
+                raise ValueError(f"Failed to execute SQL query {query}", e)
+
+            if not contains_non_null_content(result):
+                raise ValueError(
+                    "Executing the SQL query on the input data returned an empty result. Does the query match the columns of the table?"
+                )
+
+            results_box[0] = result
+
+            return query
+
+    class ResponseModel(BaseModel):
+        response: Union[ValidatedSQLQuery | GiveUp] = Field(
+            description="The action you are going to take. If the request can be fulfilled by running a SQL query on a table with the given columns, then you should generate a SQL query. Otherwise, if the request does not make sense with the provided data (e.g. if there are no relevant columns), you should give up and explain why."
+        )
+
+    return ResponseModel
+
+
+SYSTEM_PROMPT = f"""\
+You generate SQLite queries to process tabular data. Only respond with a single SELECT statement with valid SQLite
+syntax. The user will also provide a description of the data.
+
+# Guidelines
+
+The data is in a table named {TABLE}, with a row for each record. Nested fields of the records are flattened into
+columns named with dots, so column names must be quoted, e.g. "indexTerms.scientificname". Lists and objects are stored
+as JSON text, which you can query with SQLite's JSON functions, like json_each() and json_array_length().
+
+Do not add filters that are redundant with the user's description of the data being processed. For example:
+- If the data are all records of the same species, do not filter them by that species
+
+The provided data are likely to be non-normalized. For example, the names of species, countries, collections,
+institutions, etc. are unlikely to be written exactly the same way in different records. Unless you are certain that
+column values are going to be consistent, prefer case-insensitive LIKE patterns over exact comparisons. If needed, you
+may consider testing for different variations of names that can be represented in various ways.
+
+Give result columns short, descriptive names with AS, unless you select whole columns of the table.
+
+# Input
+
+The user will provide, in order:
+1. The data's metadata
+2. The columns of the table, with the types of their values. Assume that columns with no specified type hold strings.
+3. The first few characters of the data
+4. The request to fulfill
+"""
+
+
+def _make_messages(
+    request: str, columns: str, preview: str, source_artifact: Artifact
+) -> list[dict]:
+    source_meta = source_artifact.model_dump_json()
+
+    # Providers cache prompts by prefix, so the static system prompt comes first and the content that changes most
+    # often comes last
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Metadata: {source_meta}"},
+        {"role": "user", "content": f"Columns of the {TABLE} table:\n{columns}"},
+        {
+            "role": "user",
+            "content": f"First {len(preview)} characters: {preview}",
+        },
+        {"role": "user", "content": f"Request: {request}"},
+    ]
+
+
+async def _generate_and_run_sql_query(
+    request: str,
+    columns: str,
+    preview: str,
+    table: RecordTable,
+    source_artifact: Artifact,
+    routing: RoutingDecision,
+) -> (SQLQuery | GiveUp, list[dict]):
+    with timed("prompt_build"):
+        messages = _make_messages(request, columns, preview, source_artifact)
+
+    results_box = [None]
+    response_model = _make_validating_response_model(table, results_box)
+
+    response: SQLQuery | GiveUp = await request_response(
+        "sql_generation", routing, messages, response_model
+    )
+
+    return response, results_box[0]
+
+
+@context_tool
+async def query_data(artifact_id: ValidatedArtifactID):
+    """
+    Query a list of records with SQL to generate a new artifact. Prefer this over process_data for grouping,
+    counting, summing and other aggregations, and for sorting and joining records.
+
+    :param artifact_id: The source artifact, which must be a list of records
+    """
+
+    context = current_context.get()
+    request = current_request.get()
+    artifacts = current_artifacts.get()
+
+    source_artifact = artifacts.get(artifact_id)
+
+    async with (
+        context.begin_process("Processing data") as process,
+        log_process_usage(process),
+    ):
+        process: IChatBioAgentProcess
+
+        await process.log("Retrieving artifact data")
+        try:
+            text = await retrieve_text_artifact(source_artifact, process)
+            records = iter_json_records(text, source_artifact.mimetype)
+        except ProcessError:
+            return
+        except ValueError:
+            await process.log(
+                f"Artifact {source_artifact.local_id} content is not a list"
+            )
+            return
+        json_lines = is_json_lines(text, source_artifact.mimetype)
+
+        # Tables of large artifacts go to disk instead of memory, as do those there isn't enough memory left for
+        in_memory = not should_spill(len(text)) and admit_parsing(len(text))
+        db, path = open_temporary_database(in_memory=in_memory)
+        try:
+            table = RecordTable(db)
+            try:
+                async with CPU_POOL.slot():
+                    with timed("table_load"):
+                        await asyncio.to_thread(table.load, records)
+            except (ValueError, sqlite3.Error) as e:
+                await process.log(f"Failed to load the records into a table: {e}")
+                return
+            with timed("schema_inference"):
+                columns = table.describe(request, SCHEMA_TOKEN_BUDGET)
+            await process.log(
+                f"Loaded {table.count} records into a table with {len(table.columns)} columns"
+            )
+
+            generated = await generate_with_escalation(
+                process,
+                request,
+                "sql_generation",
+                "SQL query",
+                lambda decision: _generate_and_run_sql_query(
+                    request,
+                    columns,
+                    text[:MAX_SOURCE_PREVIEW_SIZE],
+                    table,
+                    source_artifact,
+                    decision,
+                ),
+            )
+            if generated is None:
+                return
+            generation, query_result = generated
+
+            if isinstance(generation, SQLQuery) and query_result is None:
+                try:
+                    async with CPU_POOL.slot():
+                        with timed("sql_query"):
+                            query_result = await asyncio.to_thread(
+                                table.query, generation.sql_query
+                            )
+                except ValueError as e:
+                    await process.log(f"Failed to run the SQL query: {e}")
+                    return
+                if not contains_non_null_content(query_result):
+                    await process.log(
+                        "Executing the SQL query on the input data returned an empty result"
+                    )
+                    return
+        finally:
+            close_temporary_database(db, path)
+
+        match generation:
+            case GiveUp(reason=reason):
+                await process.log(f"Refused to generate a SQL query: {reason}")
+            case SQLQuery(
+                plan=plan,
+                sql_query=sql_query,
+                output_description=artifact_description,
+            ):
+                await process.log(f"*Plan: {plan}*")
+
+                await process.log("Generated SQL query", data={"sql_query": sql_query})
+                with timed("serialization"):
+                    if json_lines:
+                        mimetype = JSON_LINES_MIMETYPE
+                        output_as_bytes = dump_json_lines(query_result)
+                    else:
+                        mimetype = "application/json"
+                        output_as_bytes = json.dumps(query_result).encode("utf-8")
+
+                await process.log(
+                    f"Executed SQL query returned {len(query_result)} rows ({len(output_as_bytes)} bytes)"
+                )
+
+                await create_artifact(
+                    process,
+                    mimetype=mimetype,
+                    description=artifact_description,
+                    content=output_as_bytes,
+                    metadata={
+                        "source_artifact": source_artifact.local_id,
+                        "source_sql_query": sql_query,
+                    },
+                )
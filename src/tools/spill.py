@@ -0,0 +1,191 @@
+"""
+Out-of-core execution of operations on lists of records that are too large to hold in memory as Python objects.
+Records are loaded a batch at a time into a temporary on-disk SQLite database, with their keys in indexed columns,
+and the operations run there, streaming their results back out as JSON text.
+
+Operations switch to this backend when the data they work on is larger than SPILL_THRESHOLD_BYTES.
+"""
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from typing import Any, Iterable, Iterator, Literal
+
+from tools.util import JSON, lookup_field
+
+logger = logging.getLogger(__name__)
+
+SPILL_BATCH_SIZE = 10_000
+"""Records are inserted this many at a time."""
+
+SPILL_CACHE_KIB = 64 * 1024
+"""Memory SQLite may use to cache pages of the database."""
+
+
+def spill_threshold() -> int:
+    """The size of data, in characters of JSON text, above which operations spill to disk. Defaults to 64 MiB."""
+    return int(os.getenv("SPILL_THRESHOLD_BYTES", str(64 * 1024 * 1024)))
+
+
+def should_spill(size: int) -> bool:
+    return size > spill_threshold()
+
+
+def key_value(value: JSON) -> Any:
+    """
+    Converts a key field to a SQLite value. Numbers and strings are stored as themselves, and other values as their
+    JSON encoding in a blob, so that e.g. true doesn't equal 1, and no string equals an object.
+    """
+    if isinstance(value, (bool, dict, list)):
+        return json.dumps(value, sort_keys=True).encode("utf-8")
+    return value
+
+
+def record_key(record: JSON, paths: list[str]) -> tuple | None:
+    """Returns the record's key, or None if any of its key fields are missing or null, in which case it matches nothing."""
+    key = tuple(key_value(lookup_field(record, path)) for path in paths)
+    return None if None in key else key
+
+
+def open_temporary_database(
+    in_memory: bool = False,
+) -> tuple[sqlite3.Connection, str | None]:
+    """
+    Opens a SQLite database for throwaway data, in memory or in a file in SPILL_DIR (or the system's temporary
+    directory). Returns the connection and the file's path, and should be closed with close_temporary_database().
+    The connection may be used from any thread, one at a time.
+    """
+    path = None
+    if not in_memory:
+        handle, path = tempfile.mkstemp(
+            prefix="spill-", suffix=".sqlite3", dir=os.getenv("SPILL_DIR")
+        )
+        os.close(handle)
+    db = sqlite3.connect(
+        path or ":memory:", isolation_level=None, check_same_thread=False
+    )
+    # The database is thrown away if anything goes wrong, so it doesn't need to survive crashes
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA locking_mode = EXCLUSIVE")
+    db.execute(f"PRAGMA cache_size = -{SPILL_CACHE_KIB}")
+    return db, path
+
+
+def close_temporary_database(db: sqlite3.Connection, path: str | None):
+    db.close()
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class SpillDatabase:
+    """
+    A temporary SQLite database of record lists, in a file that is deleted when the database is closed. Each list is
+    a table of records, stored as JSON text, in their original order, with an indexed column for each of the fields
+    they're keyed on.
+    """
+
+    def __init__(self):
+        self._db, self.path = open_temporary_database()
+        self._key_sizes: dict[str, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        close_temporary_database(self._db, self.path)
+
+    def _key_columns(self, table: str, prefix: str = "") -> list[str]:
+        return [f"{prefix}k{i}" for i in range(self._key_sizes[table])]
+
+    def load(self, table: str, records: Iterable[JSON], key_paths: list[str]) -> int:
+        """Stores a list of records keyed on the fields at key_paths, and returns the number of records."""
+        keys = [f"k{i}" for i in range(len(key_paths))]
+        self._key_sizes[table] = len(key_paths)
+        self._db.execute(
+            f"CREATE TABLE {table} (seq INTEGER PRIMARY KEY, {''.join(f'{k}, ' for k in keys)}record TEXT NOT NULL)"
+        )
+        insert = f"INSERT INTO {table} VALUES (?, {'?, ' * len(keys)}?)"
+
+        count = 0
+        rows = (
+            (
+                seq,
+                *(record_key(record, key_paths) or (None,) * len(keys)),
+                json.dumps(record),
+            )
+            for seq, record in enumerate(records)
+        )
+        self._db.execute("BEGIN")
+        while batch := list(itertools.islice(rows, SPILL_BATCH_SIZE)):
+            self._db.executemany(insert, batch)
+            count += len(batch)
+        # Indexing after loading is faster than maintaining the index along the way
+        if keys:
+            self._db.execute(
+                f"CREATE INDEX {table}_key ON {table} ({', '.join(keys)}, seq)"
+            )
+        self._db.execute("COMMIT")
+        self._db.execute(f"ANALYZE {table}")
+        logger.info(f"Spilled {count} records to {table} in {self.path}")
+        return count
+
+    def _has_key(self, table: str) -> str:
+        return " AND ".join(f"{k} IS NOT NULL" for k in self._key_columns(table))
+
+    def _keys_match(self, table: str, other: str) -> str:
+        return " AND ".join(
+            f"{table}.{k} = {other}.{k}" for k in self._key_columns(table)
+        )
+
+    def count(self, table: str) -> int:
+        return self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def count_missing_keys(self, table: str) -> int:
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE NOT ({self._has_key(table)})"
+        ).fetchone()[0]
+
+    def count_duplicate_keys(self, table: str) -> int:
+        """Counts the keys that are shared by more than one record."""
+        keys = ", ".join(self._key_columns(table))
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {self._has_key(table)}"
+            f" GROUP BY {keys} HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+
+    def count_matched(self, table: str, other: str) -> int:
+        """Counts the records of the table whose keys match a record of the other table."""
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE EXISTS"
+            f" (SELECT 1 FROM {other} WHERE {self._keys_match(table, other)})"
+        ).fetchone()[0]
+
+    def join(
+        self, table: str, other: str, how: Literal["inner", "left", "outer"]
+    ) -> Iterator[tuple[str | None, str | None]]:
+        """
+        Yields pairs of records of the two tables whose keys match, in the order of the first table and then the
+        second. Left and outer joins also yield unmatched records of the first table with None, and outer joins then
+        yield unmatched records of the second table after None.
+        """
+        join = "JOIN" if how == "inner" else "LEFT JOIN"
+        yield from self._db.execute(
+            f"SELECT {table}.record, {other}.record FROM {table} {join} {other}"
+            f" ON {self._keys_match(table, other)} ORDER BY {table}.seq, {other}.seq"
+        )
+        if how == "outer":
+            yield from self._db.execute(
+                f"SELECT NULL, record FROM {other} WHERE NOT EXISTS"
+                f" (SELECT 1 FROM {table} WHERE {self._keys_match(table, other)})"
+                f" ORDER BY seq"
+            )
@@ -1,8 +1,13 @@
 import functools
+import io
 import json
+import re
+import time
 import traceback
 import types
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator
 
 import httpx
 import langchain.tools
@@ -11,11 +16,25 @@ from genson.schema.strategies import Object
 from ichatbio.agent_response import (
     ArtifactResponse,
     IChatBioAgentProcess,
+    ResponseChannel,
     ResponseContext,
 )
 from ichatbio.types import Artifact
+from pydantic import BaseModel, Field
 
+from cache import ARTIFACT_CACHE, CACHE_REQUESTS
 from context import current_context
+from memory import (
+    PARSED_JSON_MEMORY_FACTOR,
+    TEXT_MEMORY_FACTOR,
+    account_memory,
+    admit,
+    available_memory,
+    format_bytes,
+)
+from metrics import Counter, collect_timings, timed
+from tracing import annotate
+from util import shared_client
 
 JSON = dict | list | str | int | float | None
 """JSON-serializable primitive types that work with functions like json.dumps(). Note that dicts and lists may contain
@@ -58,45 +77,65 @@ def context_tool(func):
     return wrapper
 
 
-@contextmanager
-def capture_messages(context: ResponseContext):
-    """
-    Modifies a ResponseContext so that any messages sent back to iChatBio are also collected into a list.
+_message_buffers: ContextVar[tuple[list, ...]] = ContextVar(
+    "message_buffers", default=()
+)
 
-    Usage:
-        context: ResponseContext
-        with capture_messages(context) as messages:
-            await context.reply("Alert!")
-            # Now messages[0] is a DirectResponse object
+
+def _install_message_capture(channel: ResponseChannel):
     """
-    messages = []
+    Wraps the channel's submit method, once, so that messages are also appended to the buffers of whichever
+    capture_messages blocks are active in the submitting task. Buffers live in a ContextVar, which asyncio copies into
+    each new task, so concurrently running tools only see their own messages.
+    """
+    if getattr(channel, "_captures_messages", False):
+        return
 
-    channel = context._channel
-    old_submit = channel.submit
+    submit = channel.submit
 
     async def submit_and_buffer(self, message):
-        await old_submit(message)
+        await submit(message)
+        buffers = _message_buffers.get()
+        if not buffers:
+            return
         match message:
             case ArtifactResponse() as artifact:
                 # Remove "content" from artifact messages, the AI doesn't need to see it:
                 # - The artifact description and metadata provide enough context for decision-making
                 # - If the AI sees content, it may process it directly instead of running reliable processes
                 # - It can be expensive to include content in LLM context, and it might not even fit
-                messages.append(
-                    ArtifactResponse(
-                        description=artifact.description,
-                        mimetype=artifact.mimetype,
-                        metadata=artifact.metadata,
-                    )
+                message = ArtifactResponse(
+                    description=artifact.description,
+                    mimetype=artifact.mimetype,
+                    metadata=artifact.metadata,
                 )
-            case _:
-                messages.append(message)
+        for buffer in buffers:
+            buffer.append(message)
 
     channel.submit = types.MethodType(submit_and_buffer, channel)
+    channel._captures_messages = True
 
-    yield messages
 
-    channel.submit = old_submit
+@contextmanager
+def capture_messages(context: ResponseContext):
+    """
+    Collects any messages sent back to iChatBio through the ResponseContext by the current task into a list. Captures
+    can be nested, and can safely overlap with captures in other tasks that share the same context.
+
+    Usage:
+        context: ResponseContext
+        with capture_messages(context) as messages:
+            await context.reply("Alert!")
+            # Now messages[0] is a DirectResponse object
+    """
+    _install_message_capture(context._channel)
+
+    messages = []
+    token = _message_buffers.set(_message_buffers.get() + (messages,))
+    try:
+        yield messages
+    finally:
+        _message_buffers.reset(token)
 
 
 # JSON schema extraction
@@ -127,6 +166,209 @@ def extract_json_schema(content: str) -> dict:
     return schema
 
 
+# JSON schema rendering
+
+CHARACTERS_PER_TOKEN = 4
+"""A rough estimate that is good enough for budgeting prompt sizes without running a tokenizer."""
+
+OMITTED_FIELDS_NOTE = "({} less relevant fields omitted)"
+
+_SIMPLE_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+class RenderedSchema(BaseModel):
+    text: str
+    original_tokens: int = Field(
+        description="Estimated size of the schema's plain JSON serialization"
+    )
+    rendered_tokens: int
+    omitted_paths: list[str] = Field(
+        description="Paths that were dropped to fit the token budget"
+    )
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.rendered_tokens
+
+
+class _SchemaLine:
+    __slots__ = ("path", "text", "parent", "depth", "score", "children")
+
+    def __init__(self, path: str, text: str, parent: "_SchemaLine | None"):
+        self.path = path
+        self.text = text
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.score = 0
+        self.children = 0
+
+
+def _key_segment(key: str) -> str:
+    return f".{key}" if _SIMPLE_KEY.match(key) else f".{json.dumps(key)}"
+
+
+def _schema_branches(schema: dict) -> list[dict]:
+    return schema.get("anyOf", [schema])
+
+
+def _schema_types(schema: dict) -> list[str]:
+    types = []
+    for branch in _schema_branches(schema):
+        match branch.get("type"):
+            case list() as ts:
+                types.extend(ts)
+            case str() as t:
+                types.append(t)
+    return list(dict.fromkeys(types))
+
+
+def _has_children(schema: dict) -> bool:
+    return any(
+        branch.get("properties")
+        or ("items" in branch and _has_children(branch["items"]))
+        for branch in _schema_branches(schema)
+    )
+
+
+def _render_schema_lines(schema: dict) -> list[_SchemaLine]:
+    lines: list[_SchemaLine] = []
+    seen: dict[str, str] = (
+        {}
+    )  # Canonical sub-schema -> path where it was first rendered
+
+    def visit(path: str, segment: str, node: dict, parent: _SchemaLine | None):
+        types = _schema_types(node)
+
+        # Collapse homogeneous arrays into their items, e.g. ".items[]" instead of ".items" followed by "[]"
+        while types == ["array"] and "items" in node:
+            node = node["items"]
+            path += "[]"
+            segment += "[]"
+            types = _schema_types(node)
+
+        has_children = _has_children(node)
+        text = (
+            "  " * (parent.depth + 1 - (lines[0].text == ".") if parent else 0)
+            + segment
+        )
+        if types != ["string"] and not (has_children and types == ["object"]):
+            text += f": {'|'.join(types) or 'any'}"  # Strings are the default, don't spend tokens on them
+
+        line = _SchemaLine(path, text, parent)
+        lines.append(line)
+        if parent:
+            parent.children += 1
+
+        if not has_children:
+            return
+
+        # Deduplicate repeated sub-schemas by pointing back to their first occurrence
+        canonical = json.dumps(node, sort_keys=True)
+        if canonical in seen:
+            line.text += f" (same as {seen[canonical]})"
+            return
+        seen[canonical] = path
+
+        for branch in _schema_branches(node):
+            for key, child in branch.get("properties", {}).items():
+                visit(path + _key_segment(key), _key_segment(key), child, line)
+            if "items" in branch and _has_children(branch["items"]):
+                visit(path + "[]", "[]", branch["items"], line)
+
+    visit("", ".", schema, None)
+    return lines
+
+
+def _words(text: str) -> set[str]:
+    return {w.lower() for w in _WORD.findall(text) if len(w) >= 3}
+
+
+def _score_lines(lines: list[_SchemaLine], request: str):
+    """Scores each line by how many of the request's words its path mentions, favoring exact matches over prefixes.
+    Parents inherit the best score of their children so that they are never dropped before them.
+    """
+    request_words = _words(request)
+    if not request_words:
+        return
+    for line in reversed(lines):  # Children come after their parents
+        path_words = _words(line.path)
+        line.score = max(
+            line.score,
+            sum(
+                2 if rw in path_words else 1
+                for rw in request_words
+                if any(rw.startswith(pw) or pw.startswith(rw) for pw in path_words)
+            ),
+        )
+        if line.parent:
+            line.parent.score = max(line.parent.score, line.score)
+
+
+def render_schema(
+    schema: dict, request: str = "", token_budget: int | None = None
+) -> RenderedSchema:
+    """
+    Renders a JSON schema as a compact, indented listing of jq path segments and their types, e.g.
+
+        .itemCount: integer
+        .items[]
+          .uuid
+          .data
+            ."dwc:country"
+
+    Fields without a type are strings. Repeated sub-schemas are rendered once and referenced afterward, and arrays are
+    collapsed into their items.
+
+    If the listing exceeds ``token_budget``, fields whose paths are least relevant to ``request`` are dropped, deepest
+    first, until it fits.
+    """
+    lines = _render_schema_lines(schema)
+    original_tokens = estimate_tokens(json.dumps(schema))
+
+    kept = [True] * len(lines)
+    omitted_paths = []
+    size = sum(len(line.text) + 1 for line in lines)
+
+    if token_budget is not None and size > token_budget * CHARACTERS_PER_TOKEN:
+        # Leave room for the note about omitted fields
+        limit = token_budget * CHARACTERS_PER_TOKEN - len(OMITTED_FIELDS_NOTE) - 8
+        _score_lines(lines, request)
+        order = sorted(
+            range(1, len(lines)),  # Never drop the root line
+            key=lambda i: (lines[i].score, -lines[i].depth, -i),
+        )
+        for i in order:
+            if size <= limit:
+                break
+            line = lines[i]
+            if line.children:
+                continue
+            kept[i] = False
+            omitted_paths.append(line.path)
+            size -= len(line.text) + 1
+            line.parent.children -= 1
+
+    text = "\n".join(
+        line.text
+        for line, keep in zip(lines, kept)
+        if keep and line.text != "."  # A plain object root goes without saying
+    )
+    if omitted_paths:
+        text += "\n" + OMITTED_FIELDS_NOTE.format(len(omitted_paths))
+
+    return RenderedSchema(
+        text=text,
+        original_tokens=original_tokens,
+        rendered_tokens=estimate_tokens(text),
+        omitted_paths=omitted_paths,
+    )
+
+
 def format_exception(e) -> str:
     return "; ".join(traceback.format_exception(e, limit=0))
 
@@ -135,44 +377,408 @@ class ProcessError(Exception):
     """Something went wrong during an agent process."""
 
 
-async def retrieve_text_artifact(
-    artifact: Artifact, process: IChatBioAgentProcess
-) -> str:
-    """Retrieves artifact content as raw text (for CSV and text formats)."""
-    try:
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30) as internet:
-            for url in artifact.get_urls():
-                await process.log(
-                    f"Retrieving artifact {artifact.local_id} content from {url}"
+ARTIFACT_BYTES = Counter(
+    "artifact_bytes_total",
+    "Bytes of artifact content fetched by the tools and produced by them",
+    ("direction",),
+)
+
+
+async def create_artifact(
+    process: IChatBioAgentProcess,
+    mimetype: str,
+    description: str,
+    content: bytes,
+    metadata: dict,
+):
+    """Uploads a new artifact made by the process."""
+    ARTIFACT_BYTES.inc(len(content), direction="produced")
+    with timed("artifact_upload"):
+        annotate(mimetype=mimetype, bytes=len(content))
+        await process.create_artifact(
+            mimetype=mimetype,
+            description=description,
+            content=content,
+            metadata=metadata,
+        )
+
+
+@asynccontextmanager
+async def log_process_usage(process: IChatBioAgentProcess):
+    """
+    Collects the time spent in each stage of the process within the block and the memory it used, and logs them to the
+    process when the block finishes, including by returning early. Memory reserved for the process is released then.
+    """
+    start = time.perf_counter()
+    with account_memory() as memory, collect_timings() as timings:
+        yield
+    total = time.perf_counter() - start
+    await process.log(
+        f"Finished in {total:.2f} seconds",
+        data={
+            "total_seconds": round(total, 4),
+            "stage_seconds": {
+                stage: round(seconds, 4) for stage, seconds in timings.items()
+            },
+            "memory": memory.as_data(),
+        },
+    )
+
+
+async def admit_artifact(
+    artifact: Artifact, size: int, memory_factor: float, process: IChatBioAgentProcess
+) -> bool:
+    """
+    Checks that there is memory left to process an artifact of the given size, in bytes, which takes memory_factor
+    times its size, and reserves the memory for the rest of the process if so. Otherwise, logs why not.
+    """
+    need = int(size * memory_factor)
+    if admit(need):
+        return True
+    available = available_memory()
+    await process.log(
+        f"Artifact {artifact.local_id} is {format_bytes(size)}, which would take about {format_bytes(need)} of memory"
+        f" to process, but only {format_bytes(max(available or 0, 0))} is available. Try again once other requests"
+        f" have finished, or with a smaller artifact",
+        data={
+            "artifact_bytes": size,
+            "estimated_memory_bytes": need,
+            "available_memory_bytes": available,
+        },
+    )
+    return False
+
+
+def _content_length(response: httpx.Response) -> int | None:
+    """The size of the response's content, if the headers say what it will be once decoded."""
+    length = response.headers.get("content-length", "")
+    if (
+        not length.isdigit()
+        or response.headers.get("content-encoding", "identity") != "identity"
+    ):
+        return None
+    return int(length)
+
+
+_VALIDATORS = {"etag": "If-None-Match", "last-modified": "If-Modified-Since"}
+"""Response headers that identify a version of an artifact's content, and the request headers that send them back."""
+
+_CACHED_HEADERS = ("content-type", *_VALIDATORS)
+
+
+def _revalidation_headers(cached: dict | None) -> dict[str, str]:
+    if cached is None:
+        return {}
+    headers = cached["headers"]
+    return {
+        request_header: headers[header]
+        for header, request_header in _VALIDATORS.items()
+        if header in headers
+    }
+
+
+def _is_cacheable(response: httpx.Response) -> bool:
+    cache_control = response.headers.get("cache-control", "").lower()
+    return any(header in response.headers for header in _VALIDATORS) and not any(
+        directive in cache_control for directive in ("no-store", "private")
+    )
+
+
+async def _fetch_artifact(
+    internet: httpx.AsyncClient,
+    url: str,
+    artifact: Artifact,
+    process: IChatBioAgentProcess,
+    memory_factor: float,
+    revalidate: bool = True,
+    admitted: bool = False,
+) -> httpx.Response:
+    """
+    Downloads the content at the URL, or if the shared artifact cache has a copy that the server says is still
+    current, reads it from the cache instead. The memory for the content is admitted once, unless it already was.
+    """
+    cached = None
+    if revalidate and ARTIFACT_CACHE.enabled:
+        cached = await ARTIFACT_CACHE.metadata(url)
+    async with internet.stream(
+        "GET", url, headers=_revalidation_headers(cached)
+    ) as response:
+        if response.status_code == 304 and cached is not None:
+            admitted = admitted or await admit_artifact(
+                artifact, cached["size"], memory_factor, process
+            )
+            if not admitted:
+                raise ProcessError()
+            content = await ARTIFACT_CACHE.get(url)
+            if content is not None:
+                CACHE_REQUESTS.inc(cache=ARTIFACT_CACHE.name, outcome="hit")
+                annotate(cache="hit")
+                return httpx.Response(
+                    200,
+                    headers=cached["headers"],
+                    content=content,
+                    request=response.request,
                 )
-                response = await internet.get(url)
-                if response.is_success:
-                    return response.text
-                else:
-                    await process.log(
-                        f"Error downloading artifact content: {response.reason_phrase} ({response.status_code})"
-                    )
-                    raise ProcessError()
-
-            else:
-                await process.log("Failed to find resolvable URL among artifact's URIs")
+        elif not response.is_success:
+            await process.log(
+                f"Error downloading artifact content: {response.reason_phrase} ({response.status_code})"
+            )
+            raise ProcessError()
+        else:
+            size = _content_length(response)
+            if size is None:
+                await response.aread()
+                size = len(response.content)
+            if not admitted and not await admit_artifact(
+                artifact, size, memory_factor, process
+            ):
                 raise ProcessError()
+            await response.aread()
+
+    if response.status_code == 304:
+        # The cached copy was evicted after it was revalidated. The server said it's current, so it's as large as
+        # the memory already admitted for it
+        return await _fetch_artifact(
+            internet,
+            url,
+            artifact,
+            process,
+            memory_factor,
+            revalidate=False,
+            admitted=True,
+        )
+
+    if ARTIFACT_CACHE.enabled:
+        CACHE_REQUESTS.inc(cache=ARTIFACT_CACHE.name, outcome="miss")
+        if _is_cacheable(response):
+            headers = {
+                header: response.headers[header]
+                for header in _CACHED_HEADERS
+                if header in response.headers
+            }
+            await ARTIFACT_CACHE.set(url, response.content, {"headers": headers})
+    ARTIFACT_BYTES.inc(len(response.content), direction="fetched")
+    return response
+
+
+def artifact_http_client() -> httpx.AsyncClient:
+    """The HTTP client for artifact content, whose connections are shared by every retrieval on the event loop."""
+    return shared_client(
+        "artifacts", lambda: httpx.AsyncClient(follow_redirects=True, timeout=30)
+    )
+
+
+async def _retrieve_artifact(
+    artifact: Artifact, process: IChatBioAgentProcess, memory_factor: float
+) -> httpx.Response:
+    """
+    Downloads the artifact's content, unless it would take more memory than is available. The memory it needs is
+    estimated from its Content-Length before the body is downloaded, or from the body's size if there is no
+    Content-Length, in either case before anything is parsed. Content that has HTTP validators is kept in the shared
+    artifact cache, and only downloaded again once it changes.
+    """
+    internet = artifact_http_client()
+    try:
+        for url in artifact.get_urls():
+            await process.log(
+                f"Retrieving artifact {artifact.local_id} content from {url}"
+            )
+            with timed("artifact_fetch"):
+                annotate(artifact=artifact.local_id, url=url)
+                response = await _fetch_artifact(
+                    internet, url, artifact, process, memory_factor
+                )
+                annotate(bytes=len(response.content))
+                return response
+
+        else:
+            await process.log("Failed to find resolvable URL among artifact's URIs")
+            raise ProcessError()
     except httpx.HTTPError as e:
         await process.log(f"Error retrieving artifact content: {format_exception(e)}")
         raise ProcessError() from e
 
 
-async def retrieve_json_artifact(
-    artifact: Artifact, process: IChatBioAgentProcess
-) -> JSON:
+async def retrieve_text_artifact(
+    artifact: Artifact,
+    process: IChatBioAgentProcess,
+    memory_factor: float = TEXT_MEMORY_FACTOR,
+) -> str:
+    """
+    Retrieves artifact content as raw text (for CSV and text formats). memory_factor is how many times the size of the
+    content processing it takes in memory, if it's more than the text itself.
+    """
+    return (await _retrieve_artifact(artifact, process, memory_factor)).text
+
+
+async def retrieve_bytes_artifact(
+    artifact: Artifact,
+    process: IChatBioAgentProcess,
+    memory_factor: float = 1,
+) -> bytes:
+    """Retrieves artifact content as raw bytes (for binary formats like Parquet)."""
+    return (await _retrieve_artifact(artifact, process, memory_factor)).content
+
+
+# JSON Lines
+
+JSON_LINES_MIMETYPE = "application/x-ndjson"
+
+_NON_SPACE = re.compile(r"\S")
+
+_JSON_LINES_MIMETYPES = {
+    JSON_LINES_MIMETYPE,
+    "application/ndjson",
+    "application/jsonl",
+    "application/jsonlines",
+    "application/x-jsonlines",
+}
+
+
+class JsonLines(BaseModel):
+    """JSON Lines content, one JSON value per line. It's kept as text so that it can be processed a record at a time."""
+
+    text: str
+
+    def records(self) -> Iterator[JSON]:
+        return iter_json_lines(self.text)
+
+
+def is_json_lines_mimetype(mimetype: str | None) -> bool:
+    return (mimetype or "").split(";")[0].strip().lower() in _JSON_LINES_MIMETYPES
+
+
+def is_json_lines(text: str, mimetype: str | None = None) -> bool:
+    """
+    Returns True if the mimetype says the content is JSON Lines, or if the content looks like it: a JSON document
+    can't have a complete value on its first line followed by more content.
+    """
+    if is_json_lines_mimetype(mimetype):
+        return True
+    # Avoid copying what may be a very large document
+    start = _NON_SPACE.search(text)
+    end = text.find("\n", start.start()) if start else -1
+    if end == -1 or not _NON_SPACE.search(text, end):
+        return False
     try:
-        text = await retrieve_text_artifact(artifact, process)
-        return json.loads(text)
+        json.loads(text[start.start() : end])
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def iter_json_lines(text: str) -> Iterator[JSON]:
+    """Parses JSON Lines one line at a time, skipping blank lines."""
+    for number, line in enumerate(io.StringIO(text), start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {number}: {e}") from e
+
+
+_JSON_DECODER = json.JSONDecoder()
+_SPACE = re.compile(r"\s*")
+_ARRAY_SEPARATOR = re.compile(r"\s*([,\]])\s*")
+
+
+JSON_ARRAY_STREAMING_MIN_SIZE = 16 * 1024 * 1024
+"""Arrays with fewer characters than this are parsed in one go, which is several times faster than item by item."""
+
+
+def iter_json_array(text: str) -> Iterator[JSON]:
+    """
+    Parses the items of a JSON array. Large arrays are parsed one item at a time, without building the list. Raises
+    ValueError right away if the content isn't an array, and when the bad item is reached if an item is invalid.
+    """
+    start = _NON_SPACE.search(text)
+    if not start or text[start.start()] != "[":
+        raise ValueError("The content is not a JSON array")
+    if len(text) < JSON_ARRAY_STREAMING_MIN_SIZE:
+        return iter(json.loads(text))
+    return _iter_json_array_items(text, start.end())
+
+
+def _iter_json_array_items(text: str, position: int) -> Iterator[JSON]:
+    position = _SPACE.match(text, position).end()
+    if text.startswith("]", position):
+        separator = _ARRAY_SEPARATOR.match(text, position)
+    else:
+        while True:
+            item, position = _JSON_DECODER.raw_decode(text, position)
+            yield item
+            separator = _ARRAY_SEPARATOR.match(text, position)
+            if not separator:
+                raise ValueError(f"Invalid JSON array at character {position}")
+            position = _SPACE.match(text, separator.end()).end()
+            if separator.group(1) == "]":
+                break
+    if _NON_SPACE.search(text, separator.end()):
+        raise ValueError(
+            f"Extra data after the JSON array at character {separator.end()}"
+        )
+
+
+def iter_json_records(text: str, mimetype: str | None = None) -> Iterator[JSON]:
+    """Parses the records of a JSON array or of JSON Lines one at a time. Raises ValueError if it's neither."""
+    if is_json_lines(text, mimetype):
+        return iter_json_lines(text)
+    return iter_json_array(text)
+
+
+def lookup_field(record: JSON, path: str) -> JSON:
+    """
+    Returns a field of a record, or None if there is no such field. Paths may name nested fields with dots, like
+    "indexTerms.scientificname", unless the record has a field with the literal name.
+    """
+    if not isinstance(record, dict):
+        return None
+    if path in record:
+        return record[path]
+    value = record
+    for segment in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(segment)
+    return value
+
+
+def dump_json_lines(records: Iterable[JSON]) -> bytes:
+    return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+
+async def retrieve_json_source(
+    artifact: Artifact,
+    process: IChatBioAgentProcess,
+    memory_factor: float = PARSED_JSON_MEMORY_FACTOR,
+) -> JSON | JsonLines:
+    """Retrieves JSON Lines artifacts as JsonLines, and parses anything else as a JSON document."""
+    text = await retrieve_text_artifact(artifact, process, memory_factor)
+    if is_json_lines(text, artifact.mimetype):
+        await process.log(f"Artifact {artifact.local_id} is JSON Lines")
+        return JsonLines(text=text)
+    try:
+        with timed("parse"):
+            return json.loads(text)
     except json.JSONDecodeError as e:
         await process.log("Error decoding JSON")
         raise ProcessError() from e
 
 
+async def retrieve_json_artifact(
+    artifact: Artifact, process: IChatBioAgentProcess
+) -> JSON:
+    """Retrieves JSON content. JSON Lines artifacts are read as a list of their records."""
+    source = await retrieve_json_source(artifact, process)
+    if isinstance(source, JsonLines):
+        try:
+            return list(source.records())
+        except ValueError as e:
+            await process.log(f"Error decoding JSON Lines: {e}")
+            raise ProcessError() from e
+    return source
+
+
 async def retrieve_json_list_artifact(
     artifact: Artifact, process: IChatBioAgentProcess
 ) -> list:
@@ -0,0 +1,288 @@
+"""
+Traces of how the agent handled each request, for finding out where the time of slow requests went. A trace is a tree
+of spans that follows OpenTelemetry's data model: a root span for the request from iChatBio, with spans for each stage
+timed with metrics.timed() (queue waits, LLM requests, artifact fetches and uploads, ...), each iteration of the agent
+loop, each tool call and each generation of a query, which has events for its attempts that failed validation. The
+span that is current is kept in context.current_span, so spans started in the tasks and threads of a request, which
+inherit its context, join its trace. If iChatBio sends a W3C `traceparent` in the request's metadata, the trace
+continues iChatBio's.
+
+Tracing is off unless TRACE_FILE or OTEL_EXPORTER_OTLP_TRACES_ENDPOINT is set. Each trace is queued for export once its
+request is done, and a background thread exports the queued traces in batches, in the OTLP JSON format, appending each
+trace to TRACE_FILE as a line of its own, or sending each batch to the collector at OTEL_EXPORTER_OTLP_TRACES_ENDPOINT,
+e.g. http://localhost:4318/v1/traces. Requests never wait for exports; traces that arrive while TRACE_QUEUE_SIZE traces
+are already waiting are dropped. When tracing is off, no spans are made, and starting one costs no more than looking up
+the current span.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+import httpx
+
+from context import current_span
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ichatbio-data-handler-agent"
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+TRACE_QUEUE_SIZE = 1000
+"""How many finished traces may wait for export before new ones are dropped."""
+TRACE_BATCH_SIZE = 100
+"""The most traces exported together."""
+
+
+def tracing_enabled() -> bool:
+    return bool(
+        os.getenv("TRACE_FILE") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+    )
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    parent_span_id: str | None
+    finished: list["Span"]
+    """The finished spans of the trace, which are exported together."""
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    attributes: dict[str, Any] = field(default_factory=dict)
+    events: list[tuple[int, str, dict[str, Any]]] = field(default_factory=list)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int | None = None
+    error: str | None = None
+    kind: int = 1
+    """1 for internal spans, and 2 for the server's span of a request, in OTLP's numbering."""
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(
+            (key, value) for key, value in attributes.items() if value is not None
+        )
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def record_exception(self, e: BaseException):
+        self.error = f"{type(e).__name__}: {e}"
+        self.add_event("exception", type=type(e).__name__, message=str(e))
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.finished.append(self)
+
+    def as_otlp(self) -> dict:
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {
+                    "timeUnixNano": str(time_ns),
+                    "name": name,
+                    "attributes": _otlp_attributes(attributes),
+                }
+                for time_ns, name, attributes in self.events
+            ],
+            "status": (
+                {"code": 2, "message": self.error} if self.error else {"code": 1}
+            ),
+        }
+        if self.parent_span_id:
+            otlp["parentSpanId"] = self.parent_span_id
+        return otlp
+
+
+def _otlp_value(value: Any) -> dict:
+    match value:
+        case bool():
+            return {"boolValue": value}
+        case int():
+            return {"intValue": str(value)}
+        case float():
+            return {"doubleValue": value}
+        case _:
+            return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict]:
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span | None]:
+    """
+    Times the block as a span of the current trace, with the given attributes, and makes it the current span within the
+    block. Outside a trace, does nothing and yields None.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, parent.trace_id, parent.span_id, parent.finished)
+    child.set_attributes(**attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_exception(e)
+        raise
+    finally:
+        current_span.reset(token)
+        child.end()
+
+
+def annotate(**attributes):
+    """Sets attributes of the current span, if any. Attributes that are None are left out."""
+    current = current_span.get()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+
+def add_event(name: str, **attributes):
+    """Records that something happened during the current span, if any."""
+    current = current_span.get()
+    if current is not None:
+        current.add_event(name, **attributes)
+
+
+def parse_traceparent(traceparent: str | None) -> tuple[str, str] | None:
+    """The trace ID and parent span ID of a W3C traceparent header, or None if it isn't one."""
+    match = TRACEPARENT.match(traceparent or "")
+    return (match[1], match[2]) if match else None
+
+
+@asynccontextmanager
+async def trace_request(name: str, traceparent: str | None = None, **attributes):
+    """
+    Starts a trace for handling a request within the block, if tracing is on, continuing the trace of `traceparent` if
+    there is one. The trace is exported when the block finishes.
+    """
+    if not tracing_enabled():
+        yield None
+        return
+
+    trace_id, parent_span_id = parse_traceparent(traceparent) or (
+        os.urandom(16).hex(),
+        None,
+    )
+    root = Span(name, trace_id, parent_span_id, [], kind=2)
+    root.set_attributes(**attributes)
+    token = current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.record_exception(e)
+        raise
+    finally:
+        current_span.reset(token)
+        root.end()
+        _exporter.submit(list(root.finished))
+
+
+def otlp_payload(spans: list[Span]) -> dict:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes({"service.name": SERVICE_NAME})
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [span.as_otlp() for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def export_traces(traces: list[list[Span]]):
+    """
+    Writes the spans of each trace to TRACE_FILE, a line per trace, and sends them all to the OTLP collector in one
+    request, whichever is set.
+    """
+    try:
+        if path := os.getenv("TRACE_FILE"):
+            lines = "".join(
+                json.dumps(otlp_payload(spans), separators=(",", ":")) + "\n"
+                for spans in traces
+            )
+            with open(path, "a") as file:
+                file.write(lines)
+        if endpoint := os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"):
+            payload = otlp_payload([span for spans in traces for span in spans])
+            httpx.post(endpoint, json=payload, timeout=10).raise_for_status()
+    except (OSError, httpx.HTTPError):
+        logger.warning(f"Failed to export {len(traces)} traces", exc_info=True)
+
+
+class _Exporter:
+    """Exports the traces submitted to it from a thread of its own, which starts with the first trace."""
+
+    def __init__(self):
+        self._queue: queue.Queue[list[Span]] = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.dropped = 0
+
+    def submit(self, spans: list[Span]):
+        """Queues the spans of a trace for export, without waiting for it."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="trace-exporter", daemon=True
+                )
+                self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(
+                f"Dropped a trace because {TRACE_QUEUE_SIZE} traces are waiting for export"
+            )
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                export_traces(batch)
+            except Exception:
+                logger.exception("Failed to export traces")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Waits until every trace submitted so far is exported."""
+        if self._thread is not None:
+            self._queue.join()
+
+
+_exporter = _Exporter()
+
+flush_traces = _exporter.flush
+atexit.register(flush_traces)
@@ -1,7 +1,14 @@
+import asyncio
+import hashlib
 import os
+import weakref
 from contextvars import ContextVar
-from typing import Any
+from typing import Any, Callable, TypeVar
 
+import httpx
+
+
+T = TypeVar("T", bound=httpx.AsyncClient)
 
 temporary_llm_key: ContextVar[str | None] = ContextVar(
     "temporary_llm_key",
@@ -17,6 +24,17 @@ def update_llm_credentials(metadata: dict[str, Any] | None):
             temporary_llm_key.set(None)
 
 
+def tenant_key() -> str:
+    """
+    Identifies who the current request is for, by a digest of the temporary LLM key iChatBio sent with it, so that the
+    key itself isn't kept around. Requests without a key all belong to the "shared" tenant.
+    """
+    llm_key = temporary_llm_key.get()
+    if llm_key is None:
+        return "shared"
+    return hashlib.sha256(llm_key.encode()).hexdigest()[:16]
+
+
 def get_llm_client_kwargs() -> dict[str, str]:
     metadata_llm_key = temporary_llm_key.get()
     use_proxy = os.getenv("USE_LLM_PROXY") == "true" or metadata_llm_key is not None
@@ -32,3 +50,23 @@ def get_llm_client_kwargs() -> dict[str, str]:
     assert openai_api_key is not None, "OPENAI_API_KEY environment variable must be set"
     assert openai_base_url is not None, "OPENAI_BASE_URL environment variable must be set"
     return {"api_key": openai_api_key, "base_url": openai_base_url}
+
+
+_shared_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+"""The HTTP clients of each event loop, by name."""
+
+
+def shared_client(name: str, factory: Callable[[], T]) -> T:
+    """
+    Returns the running event loop's HTTP client called `name`, making it with `factory` the first time, so that every
+    request made on the loop reuses the client's pool of connections. Clients can't be shared between event loops.
+    """
+    clients = _shared_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = factory()
+    return clients[name]
+
+
+async def close_shared_clients():
+    for client in _shared_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
@@ -1,4 +1,10 @@
+import asyncio
 import json
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
 
 import ichatbio.agent_response
 import pytest
@@ -8,6 +14,7 @@ from ichatbio.agent_response import (
 )
 from ichatbio.agent_response import DirectResponse
 from ichatbio.types import Artifact
+from starlette.testclient import TestClient
 
 import agent
 from conftest import resource
@@ -64,7 +71,11 @@ def test_system_message():
     system_message = agent.make_system_message([OCCURRENCE_RECORDS, OCCURRENCE_RECORDS])
 
     expected = """\
-You manipulate structured data using tools. You can access the following artifacts:
+You manipulate structured data using tools. If you are unable to fulfill the user's request using your available tools,
+abort and explain why. When the request calls for several operations that don't depend on each other, call all of their
+tools at once so that they run concurrently.
+
+You can access the following artifacts:
 
 - local_id: #0000
   description: A list of occurrence records
@@ -74,9 +85,7 @@ You manipulate structured data using tools. You can access the following artifac
 - local_id: #0000
   description: A list of occurrence records
   uris: ['https://artifact.test']
-  metadata: {'source': 'iDigBio'}
-
-If you are unable to fulfill the user's request using your available tools, abort and explain why.\
+  metadata: {'source': 'iDigBio'}\
 """
 
     assert system_message == expected
@@ -86,11 +95,125 @@ def test_system_message_with_no_artifacts():
     system_message = agent.make_system_message({})
 
     expected = """\
-You manipulate structured data using tools. You can access the following artifacts:
+You manipulate structured data using tools. If you are unable to fulfill the user's request using your available tools,
+abort and explain why. When the request calls for several operations that don't depend on each other, call all of their
+tools at once so that they run concurrently.
 
-NO AVAILABLE ARTIFACTS
+You can access the following artifacts:
 
-If you are unable to fulfill the user's request using your available tools, abort and explain why.\
+NO AVAILABLE ARTIFACTS\
 """
 
     assert system_message == expected
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setenv("LLM", "test-model")
+    client = TestClient(agent.create_app())
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE agent_requests_in_flight gauge" in response.text
+    assert "agent_requests_in_flight 0" in response.text
+    assert "# TYPE tool_duration_seconds histogram" in response.text
+
+
+def test_import_leaves_heavy_modules_for_later():
+    lazy = ["langchain.agents", "langchain_openai", "openai", "tools.process_data"]
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, agent; print([m for m in {lazy!r} if m in sys.modules])",
+        ],
+        cwd=Path(agent.__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert completed.stdout.strip() == "[]"
+
+
+def test_reports_ready_once_warmed_up(monkeypatch):
+    monkeypatch.setenv("LLM", "test-model")
+    warm_up_done = threading.Event()
+
+    async def warm_up():
+        await asyncio.to_thread(warm_up_done.wait, 5)
+
+    monkeypatch.setattr(agent, "warm_up", warm_up)
+
+    with TestClient(agent.create_app()) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json() == {"ready": False}
+
+        warm_up_done.set()
+        for _ in range(50):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.json() == {"ready": True}
+
+
+def test_reports_ready_after_failing_to_warm_up(monkeypatch):
+    monkeypatch.setenv("LLM", "test-model")
+    monkeypatch.setattr(agent, "WARM_UP_RETRY_DELAY_SECONDS", 0)
+    attempts = []
+
+    async def warm_up():
+        attempts.append(1)
+        raise ImportError("No module named 'langchain_openai'")
+
+    monkeypatch.setattr(agent, "warm_up", warm_up)
+
+    with TestClient(agent.create_app()) as client:
+        for _ in range(50):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.json() == {
+            "ready": True,
+            "warm_up_error": "ImportError: No module named 'langchain_openai'",
+        }
+    assert len(attempts) == agent.WARM_UP_ATTEMPTS
+
+
+def test_retries_warming_up(monkeypatch):
+    monkeypatch.setenv("LLM", "test-model")
+    monkeypatch.setattr(agent, "WARM_UP_RETRY_DELAY_SECONDS", 0)
+    attempts = []
+
+    async def warm_up():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("Temporary failure")
+
+    monkeypatch.setattr(agent, "warm_up", warm_up)
+
+    with TestClient(agent.create_app()) as client:
+        for _ in range(50):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.json() == {"ready": True}
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up(monkeypatch):
+    from tools.process_data import COMMON_JQ_QUERIES, compile_jq
+
+    monkeypatch.setenv("LLM", "test-model")
+    for variable in ("OPENAI_BASE_URL", "PROXY_OPENAI_BASE_URL", "WARM_UP_URLS"):
+        monkeypatch.delenv(variable, raising=False)
+    compile_jq.cache_clear()
+
+    await agent.warm_up()
+
+    assert compile_jq.cache_info().currsize == len(COMMON_JQ_QUERIES)
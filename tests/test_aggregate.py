@@ -0,0 +1,126 @@
+import json
+
+import pytest
+from ichatbio.agent_response import ArtifactResponse, ProcessLogResponse
+from ichatbio.types import Artifact
+
+from artifact_registry import ArtifactRegistry
+from conftest import resource
+from context import current_artifacts, current_context
+from tools import aggregate, process_pool
+from tools.aggregate import Tally, summarize, tally_records
+from tools.util import dump_json_lines
+
+RECORDS = [
+    {"country": "us", "tags": ["a", "b"]},
+    {"country": "mx", "tags": ["a"]},
+    {"country": "us"},
+    {"country": None, "tags": []},
+    {"other": 1},
+    {"country": 1},
+    {"country": True},
+]
+
+
+@pytest.fixture
+def tally():
+    return Tally().add_records(RECORDS, "country")
+
+
+class TestSummarize:
+    def test_count(self, tally):
+        assert summarize(tally, "country", "count") == [
+            {"country": None, "count": 2},
+            {"country": "us", "count": 2},
+            {"country": True, "count": 1},
+            {"country": 1, "count": 1},
+            {"country": "mx", "count": 1},
+        ]
+
+    def test_top(self, tally):
+        assert summarize(tally, "country", "top", 1) == [{"country": None, "count": 2}]
+        many = Tally().add_records([{"n": i} for i in range(20)], "n")
+        assert len(summarize(many, "n", "top")) == 10
+
+    def test_distinct(self, tally):
+        assert summarize(tally, "country", "distinct") == [True, 1, "mx", "us"]
+
+    def test_list_items_are_tallied(self):
+        tally = Tally().add_records(RECORDS, "tags")
+        assert summarize(tally, "tags", "top", 2) == [
+            {"tags": None, "count": 4},
+            {"tags": "a", "count": 2},
+        ]
+
+    def test_merged_tallies_match_a_single_pass(self, tally):
+        merged = Tally().add_records(RECORDS[:3], "country")
+        merged.merge(Tally().add_records(RECORDS[3:], "country"))
+        assert summarize(merged, "country", "count") == summarize(
+            tally, "country", "count"
+        )
+        assert merged.records == len(RECORDS)
+
+
+class TestTallyRecords:
+    @pytest.mark.asyncio
+    async def test_json_array(self):
+        tally = await tally_records(json.dumps(RECORDS), "country")
+        assert tally.counts["us"] == 2
+
+    @pytest.mark.asyncio
+    async def test_json_lines_in_parallel_chunks(self, monkeypatch):
+        monkeypatch.setenv("CONVERSION_WORKERS", "2")
+        monkeypatch.setattr(aggregate, "AGGREGATION_CHUNK_SIZE", 100)
+        text = dump_json_lines(RECORDS * 10).decode("utf-8")
+        assert len(aggregate._json_lines_chunks(text)) > 2
+        try:
+            tally = await tally_records(text, "country")
+        finally:
+            process_pool.discard_conversion_pool()
+        assert tally.records == 70
+        assert summarize(tally, "country", "count")[0] == {"country": None, "count": 20}
+
+    @pytest.mark.asyncio
+    async def test_rejects_non_lists(self):
+        with pytest.raises(ValueError):
+            await tally_records('{"country": "us"}', "country")
+
+
+@pytest.mark.httpx_mock(
+    should_mock=lambda request: request.url == "https://artifact.test/records"
+)
+@pytest.mark.asyncio
+async def test_aggregate_tool(context, messages, httpx_mock):
+    records = json.loads(resource("list_of_idigbio_records.json"))
+    httpx_mock.add_response(url="https://artifact.test/records", json=records)
+    current_context.set(context)
+    current_artifacts.set(
+        ArtifactRegistry(
+            [
+                Artifact(
+                    local_id="#1111",
+                    mimetype="application/json",
+                    description="A list of occurrence records",
+                    uris=["https://artifact.test/records"],
+                    metadata={},
+                )
+            ]
+        )
+    )
+
+    await aggregate.aggregate.ainvoke(
+        {"artifact_id": "#1111", "field": "indexTerms.country", "aggregate": "top"}
+    )
+
+    artifact_message = next(m for m in messages if isinstance(m, ArtifactResponse))
+    assert json.loads(artifact_message.content) == [
+        {"indexTerms.country": "united states", "count": 3}
+    ]
+    assert artifact_message.metadata["aggregate"]["field"] == "indexTerms.country"
+
+    timings = messages[-1]
+    assert isinstance(timings, ProcessLogResponse)
+    assert {"artifact_fetch", "aggregation", "artifact_upload"} <= set(
+        timings.data["stage_seconds"]
+    )
+    assert "rss_growth_bytes" in timings.data["memory"]
@@ -0,0 +1,152 @@
+import multiprocessing
+
+import pytest
+from ichatbio.types import Artifact
+
+from cache import ARTIFACT_CACHE, CACHE_REQUESTS, DiskCache
+from tools import util
+from tools.util import retrieve_text_artifact
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def cache(cache_dir, monkeypatch):
+    monkeypatch.setenv("TEST_CACHE_MAX_BYTES", "100")
+    return DiskCache("test", "TEST_CACHE_MAX_BYTES", 100)
+
+
+def _write_entry(key: str, value: bytes):
+    DiskCache("test", "TEST_CACHE_MAX_BYTES", 100)._set(key, value, {"from": "child"})
+
+
+class TestDiskCache:
+    def test_is_off_without_a_directory(self, monkeypatch):
+        monkeypatch.delenv("CACHE_DIR", raising=False)
+        assert not DiskCache("test", "TEST_CACHE_MAX_BYTES", 100).enabled
+
+    @pytest.mark.asyncio
+    async def test_round_trips_values_and_metadata(self, cache):
+        assert cache.enabled
+        assert await cache.get("a") is None
+        assert await cache.metadata("a") is None
+
+        await cache.set("a", b"value", {"etag": '"1"'})
+        assert await cache.get("a") == b"value"
+        assert await cache.metadata("a") == {"etag": '"1"', "size": 5}
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used_entries(self, cache):
+        await cache.set("a", b"x" * 20, {})
+        await cache.set("b", b"x" * 20, {})
+        await cache.get("a")  # Now "b" is the least recently used
+        for key in "cdef":
+            await cache.set(key, b"x" * 20, {})
+
+        assert await cache.get("a") is not None
+        assert await cache.get("b") is None
+
+    @pytest.mark.asyncio
+    async def test_skips_values_too_large_to_share_the_cache(self, cache):
+        await cache.set("a", b"x" * 26, {})
+        assert await cache.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_is_shared_between_processes(self, cache):
+        child = multiprocessing.get_context("spawn").Process(
+            target=_write_entry, args=("a", b"from another process")
+        )
+        child.start()
+        child.join()
+        assert await cache.get("a") == b"from another process"
+
+
+class TestArtifactCache:
+    artifact = Artifact(
+        local_id="#1111",
+        mimetype="application/json",
+        description="A list of occurrence records",
+        uris=["https://artifact.test/list"],
+        metadata={},
+    )
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url == "https://artifact.test/list"
+    )
+    @pytest.mark.asyncio
+    async def test_revalidates_cached_artifacts(self, context, httpx_mock, cache_dir):
+        httpx_mock.add_response(
+            url="https://artifact.test/list", text="[1, 2, 3]", headers={"ETag": '"v1"'}
+        )
+        httpx_mock.add_response(
+            url="https://artifact.test/list",
+            match_headers={"If-None-Match": '"v1"'},
+            status_code=304,
+        )
+        hits = CACHE_REQUESTS.value(cache=ARTIFACT_CACHE.name, outcome="hit")
+
+        async with context.begin_process("Testing") as process:
+            assert await retrieve_text_artifact(self.artifact, process) == "[1, 2, 3]"
+            assert await retrieve_text_artifact(self.artifact, process) == "[1, 2, 3]"
+
+        assert (
+            CACHE_REQUESTS.value(cache=ARTIFACT_CACHE.name, outcome="hit") == hits + 1
+        )
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url == "https://artifact.test/list"
+    )
+    @pytest.mark.asyncio
+    async def test_admits_evicted_artifacts_once(
+        self, context, httpx_mock, cache_dir, monkeypatch
+    ):
+        httpx_mock.add_response(
+            url="https://artifact.test/list", text="[1, 2, 3]", headers={"ETag": '"v1"'}
+        )
+        httpx_mock.add_response(
+            url="https://artifact.test/list",
+            match_headers={"If-None-Match": '"v1"'},
+            status_code=304,
+        )
+        httpx_mock.add_response(url="https://artifact.test/list", text="[1, 2, 3]")
+
+        async with context.begin_process("Testing") as process:
+            assert await retrieve_text_artifact(self.artifact, process) == "[1, 2, 3]"
+
+            admissions = []
+            admit_artifact = util.admit_artifact
+
+            async def count_admissions(*args):
+                admissions.append(args)
+                return await admit_artifact(*args)
+
+            async def evicted(key):
+                return None
+
+            monkeypatch.setattr(util, "admit_artifact", count_admissions)
+            monkeypatch.setattr(ARTIFACT_CACHE, "get", evicted)
+            assert await retrieve_text_artifact(self.artifact, process) == "[1, 2, 3]"
+
+        assert len(admissions) == 1
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url == "https://artifact.test/list"
+    )
+    @pytest.mark.asyncio
+    async def test_does_not_cache_artifacts_without_validators(
+        self, context, httpx_mock, cache_dir
+    ):
+        httpx_mock.add_response(url="https://artifact.test/list", text="[1]")
+        httpx_mock.add_response(url="https://artifact.test/list", text="[2]")
+
+        async with context.begin_process("Testing") as process:
+            assert await retrieve_text_artifact(self.artifact, process) == "[1]"
+            assert await retrieve_text_artifact(self.artifact, process) == "[2]"
+
+        assert await ARTIFACT_CACHE.metadata("https://artifact.test/list") is None
+        for request in httpx_mock.get_requests():
+            assert "if-none-match" not in request.headers
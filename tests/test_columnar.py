@@ -0,0 +1,97 @@
+import json
+import sys
+
+import pytest
+
+from conftest import resource
+from tools.columnar import (
+    columnar_format,
+    decode_columnar,
+    encode_columnar,
+    records_schema,
+    resolve_compression,
+)
+
+
+class TestColumnarFormat:
+    def test_recognizes_mimetypes(self):
+        assert columnar_format("application/vnd.apache.parquet") == "parquet"
+        assert columnar_format("application/vnd.apache.arrow.file") == "arrow"
+        assert columnar_format("application/vnd.apache.arrow.stream") == "arrow"
+        assert columnar_format("application/json") is None
+        assert columnar_format(None) is None
+
+
+class TestResolveCompression:
+    def test_defaults_to_zstd(self, monkeypatch):
+        monkeypatch.delenv("COLUMNAR_COMPRESSION", raising=False)
+        assert resolve_compression("parquet", None) == "zstd"
+
+    def test_default_is_configurable(self, monkeypatch):
+        monkeypatch.setenv("COLUMNAR_COMPRESSION", "snappy")
+        assert resolve_compression("parquet", None) == "snappy"
+
+    def test_rejects_unsupported_compression(self):
+        with pytest.raises(ValueError, match="arrow output supports"):
+            resolve_compression("arrow", "snappy")
+
+
+class TestRecordsSchema:
+    def test_types_come_from_the_inferred_schema(self):
+        pa = pytest.importorskip("pyarrow")
+        schema = records_schema(
+            [
+                {"n": 1, "x": 1.5, "b": True, "s": "a", "o": {"k": 1}, "l": [1]},
+                {"n": 2, "x": 2, "mixed": "a"},
+                {"mixed": 1, "empty": None},
+            ]
+        )
+        assert schema.field("n").type == pa.int64()
+        assert schema.field("x").type == pa.float64()
+        assert schema.field("b").type == pa.bool_()
+        assert schema.field("s").type == pa.string()
+        assert schema.field("o").type == pa.struct([pa.field("k", pa.int64())])
+        assert schema.field("l").type == pa.list_(pa.int64())
+        assert schema.field("mixed").type == pa.string()
+        assert schema.field("mixed").metadata == {b"encoding": b"json"}
+        assert schema.field("empty").type == pa.null()
+
+    def test_rejects_non_objects(self):
+        pytest.importorskip("pyarrow")
+        with pytest.raises(ValueError):
+            records_schema([1, 2])
+        with pytest.raises(ValueError):
+            records_schema([])
+
+
+@pytest.mark.parametrize(
+    "format,compression",
+    [("parquet", "zstd"), ("parquet", "none"), ("arrow", "lz4"), ("arrow", "none")],
+)
+class TestRoundTrip:
+    def test_idigbio_records(self, format, compression):
+        pytest.importorskip("pyarrow")
+        records = json.loads(resource("list_of_idigbio_records.json"))
+        content = encode_columnar(records, format, compression)
+        assert decode_columnar(content, format) == records
+
+    def test_irregular_records(self, format, compression):
+        pytest.importorskip("pyarrow")
+        records = [
+            {"a": 1, "b": {"c": [1, 2]}, "m": "x"},
+            {"a": 2.5, "m": 3, "e": {}, "l": [1, "x", {"y": None}]},
+        ]
+        content = encode_columnar(records, format, compression)
+        assert decode_columnar(content, format) == records
+
+
+def test_invalid_content():
+    pytest.importorskip("pyarrow")
+    with pytest.raises(ValueError, match="Invalid parquet content"):
+        decode_columnar(b"not parquet", "parquet")
+
+
+def test_missing_pyarrow(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ValueError, match="requires pyarrow"):
+        encode_columnar([{"a": 1}], "parquet")
@@ -3,6 +3,7 @@ import json
 import pytest
 from ichatbio.agent_response import (
     ArtifactResponse,
+    ProcessLogResponse,
 )
 from ichatbio.types import Artifact
 
@@ -86,3 +87,56 @@ class TestWithArtifactAccess:
             (m for m in messages if isinstance(m, ArtifactResponse)), None
         )
         assert artifact_message is None
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url
+        in ("https://artifact.test/list_one", "https://artifact.test/list_two")
+    )
+    @pytest.mark.asyncio
+    async def test_concat_json_lines(self, messages, httpx_mock):
+        source_list = json.loads(resource("list_of_idigbio_records.json"))
+
+        json_lines = "".join(json.dumps(record) + "\n" for record in source_list[:2])
+        httpx_mock.add_response(
+            url="https://artifact.test/list_one", text=json_lines.rstrip("\n")
+        )
+        httpx_mock.add_response(
+            url="https://artifact.test/list_two", json=source_list[2:]
+        )
+
+        await self.run_tool("#1111", "#2222")
+
+        artifact_message = next(
+            (m for m in messages if isinstance(m, ArtifactResponse)), None
+        )
+        assert artifact_message.mimetype == "application/x-ndjson"
+
+        content = artifact_message.content.decode("utf-8")
+        assert content.startswith(json_lines)  # Copied as is
+        assert [json.loads(line) for line in content.splitlines()] == source_list
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url in ("https://artifact.test/list_one",)
+    )
+    @pytest.mark.asyncio
+    async def test_rejects_lists_too_large_for_the_memory_available(
+        self, messages, httpx_mock, monkeypatch
+    ):
+        monkeypatch.setenv("MEMORY_BUDGET_BYTES", "1")
+        httpx_mock.add_response(
+            url="https://artifact.test/list_one",
+            json=json.loads(resource("list_of_idigbio_records.json")),
+        )
+
+        await self.run_tool("#1111", "#2222")
+
+        assert not any(isinstance(m, ArtifactResponse) for m in messages)
+        rejection = next(
+            m
+            for m in messages
+            if isinstance(m, ProcessLogResponse) and "of memory" in m.text
+        )
+        assert rejection.text.startswith("Artifact #1111 is ")
+        assert (
+            rejection.data["estimated_memory_bytes"] > rejection.data["artifact_bytes"]
+        )
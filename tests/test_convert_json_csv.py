@@ -4,7 +4,19 @@ from io import StringIO
 
 import pytest
 
-from tools.convert_json_csv import _flatten_dict, _json_to_csv, _csv_to_json
+from conftest import resource
+from tools import convert_json_csv, process_pool
+from tools.convert_json_csv import (
+    FlattenPlan,
+    RecordFlattener,
+    _flatten_dict,
+    _flattened_keys,
+    _json_to_csv,
+    _json_to_csv_stream,
+    _csv_to_json,
+    _csv_to_json_stream,
+    json_to_csv,
+)
 
 
 class TestFlattenDict:
@@ -29,6 +41,102 @@ class TestFlattenDict:
         assert result == {"people[0].name": "John", "people[1].name": "Jane"}
 
 
+class TestFlattenedKeys:
+    def test_matches_flatten_dict(self):
+        data = {
+            "person": {"name": "John", "tags": ["a", "b"]},
+            "people": [{"name": "Jane"}],
+            "empty": {},
+        }
+        assert list(_flattened_keys(data)) == list(_flatten_dict(data).keys())
+
+    def test_matches_flatten_dict_for_idigbio_records(self):
+        records = json.loads(resource("list_of_idigbio_records.json"))
+        for record in records:
+            assert list(_flattened_keys(record)) == list(_flatten_dict(record).keys())
+
+
+def _dynamic_rows(records):
+    flattened = [_flatten_dict(record) for record in records]
+    fieldnames = sorted({k for r in flattened for k in r})
+    return fieldnames, [[r.get(k, "") for k in fieldnames] for r in flattened]
+
+
+class TestRecordFlattener:
+    def test_matches_flatten_dict_for_idigbio_records(self):
+        records = json.loads(resource("list_of_idigbio_records.json")) * 3
+        flattener = RecordFlattener()
+        fieldnames = flattener.fieldnames(records)
+        rows = [flattener.row(record) for record in records]
+
+        assert (fieldnames, rows) == _dynamic_rows(records)
+        assert flattener.fallbacks == 0
+
+    @pytest.mark.parametrize(
+        "other",
+        [
+            {"id": 2, "tags": ["a"], "data": {"name": "y"}, "extra": 1},
+            {"id": 2, "tags": ["a", "b", "c"], "data": {"name": "y"}},
+            {"id": 2, "tags": ["a", "b"], "data": {"name": {"first": "y"}}},
+            {"id": {"value": 2}, "tags": ["a", "b"], "data": {"name": "y"}},
+            {"id": 2, "tags": ["a", "b"], "data": {"title": "y"}},
+            {"tags": [], "data": {}},
+        ],
+    )
+    def test_plans_records_of_other_shapes(self, other):
+        records = [{"id": 1, "tags": ["a", "b"], "data": {"name": "x"}}, other]
+        flattener = RecordFlattener()
+        fieldnames = flattener.fieldnames(records)
+        rows = [flattener.row(record) for record in records]
+
+        assert (fieldnames, rows) == _dynamic_rows(records)
+        assert (flattener.planned, flattener.fallbacks) == (2, 0)
+
+    def test_conflicting_containers_match_flatten_dict(self):
+        records = [
+            {"id": 1, "data": {"name": "x"}},
+            {"id": 2, "data": ["y"]},
+            {"id": 3, "data": {"title": "z"}},
+        ]
+        flattener = RecordFlattener()
+        fieldnames = flattener.fieldnames(records)
+        rows = [flattener.row(record) for record in records]
+
+        assert (fieldnames, rows) == _dynamic_rows(records)
+        assert (flattener.planned, flattener.fallbacks) == (2, 1)
+
+    def test_plans_varied_records(self):
+        records = [{"a": i} if i % 2 else {"b": i, "c": [i]} for i in range(10)]
+        flattener = RecordFlattener()
+        fieldnames = flattener.fieldnames(records)
+        rows = [flattener.row(record) for record in records]
+
+        assert (fieldnames, rows) == _dynamic_rows(records)
+        assert (flattener.planned, flattener.fallbacks) == (10, 0)
+
+    def test_bind_to_wider_layout(self):
+        records = [{"b": 1, "c": {"d": 2}}, {"b": 3}]
+        flattener = RecordFlattener()
+        flattener.bind(["a", "b", "c.d", "e"])
+
+        assert [flattener.row(record) for record in records] == [
+            ["", 1, 2, ""],
+            ["", 3, "", ""],
+        ]
+        assert flattener.planned == 2
+
+    def test_colliding_keys_share_a_column(self):
+        record = {"a.b": 1, "a": {"b": 2}}
+        plan = FlattenPlan()
+        assert plan.add(record)
+        assert plan.keys == ["a.b"]
+
+        flattener = RecordFlattener()
+        assert flattener.fieldnames([record]) == ["a.b"]
+        assert flattener.row(record) == [2]
+        assert flattener.fallbacks == 0
+
+
 class TestJsonToCsv:
     def test_single_object(self):
         data = {"name": "John", "age": 30}
@@ -86,6 +194,102 @@ class TestJsonToCsv:
         result = _json_to_csv(data)
         assert result == ""
 
+    def test_irregular_records(self):
+        data = [{"name": "John"}, {"age": 25, "tags": ["x"]}]
+        result = _json_to_csv(data)
+        assert result.splitlines() == ["age,name,tags[0]", ",John,", "25,,x"]
+
+
+class TestJsonLines:
+    def test_json_lines_to_csv(self):
+        assert _json_to_csv('{"a": 1}\n{"b": 2}\n') == _json_to_csv(
+            [{"a": 1}, {"b": 2}]
+        )
+
+    def test_csv_to_json_lines(self):
+        with _csv_to_json_stream("a.b,c\n1,x\n2,y", json_lines=True) as output:
+            text = output.read().decode("utf-8")
+        assert text == '{"a":{"b":1},"c":"x"}\n{"a":{"b":2},"c":"y"}\n'
+
+    def test_empty_csv_to_json_lines(self):
+        with _csv_to_json_stream("", json_lines=True) as output:
+            assert output.read() == b""
+
+    @pytest.mark.parametrize(
+        "source_format, mimetype, content, expected",
+        [
+            ("csv", None, '{"a": 1}\n{"a": 2}\n', "ndjson"),
+            ("json", "application/json", '\n{"a": 1}\n{"a": 2}', "ndjson"),
+            ("csv", "text/csv", '{"a": 1}\n{"a": 2}\n', "csv"),
+            ("csv", None, '"name"\n"John"\n', "csv"),
+            ("csv", None, "name,age\nJohn,30", "csv"),
+            ("json", None, '[{"a": 1},\n{"a": 2}]', "json"),
+        ],
+    )
+    def test_sniffs_json_lines(self, source_format, mimetype, content, expected):
+        assert (
+            convert_json_csv._sniff_source_format(source_format, mimetype, content)
+            == expected
+        )
+
+
+class TestJsonToCsvStream:
+    def test_matches_in_memory_conversion(self):
+        records = json.loads(resource("list_of_idigbio_records.json"))
+        with _json_to_csv_stream(records) as output:
+            streamed = output.read().decode("utf-8")
+
+        flattened = [_flatten_dict(record) for record in records]
+        expected = StringIO()
+        writer = csv.DictWriter(
+            expected, fieldnames=sorted({k for r in flattened for k in r})
+        )
+        writer.writeheader()
+        writer.writerows(flattened)
+
+        assert streamed == expected.getvalue()
+
+
+@pytest.fixture
+def conversion_pool(monkeypatch):
+    monkeypatch.setenv("CONVERSION_WORKERS", "2")
+    monkeypatch.setenv("CONVERSION_CHUNK_SIZE", "4")
+    monkeypatch.setenv("CONVERSION_INLINE_MAX_RECORDS", "0")
+    yield
+    if process_pool._process_pool is not None:
+        process_pool._process_pool.shutdown()
+        process_pool._process_pool = None
+
+
+class TestJsonToCsvAsync:
+    @pytest.mark.asyncio
+    async def test_small_input_is_converted_inline(self, monkeypatch):
+        monkeypatch.setenv("CONVERSION_WORKERS", "2")
+        data = resource("list_of_idigbio_records.json")
+
+        with await json_to_csv(data) as output:
+            assert output.read().decode("utf-8") == _json_to_csv(data)
+        assert process_pool._process_pool is None
+
+    @pytest.mark.asyncio
+    async def test_chunks_match_inline_conversion(self, conversion_pool):
+        records = json.loads(resource("list_of_idigbio_records.json")) * 3 + [
+            {"late": "column"}
+        ]
+
+        with await json_to_csv(json.dumps(records)) as output:
+            assert output.read().decode("utf-8") == _json_to_csv(records)
+
+    @pytest.mark.asyncio
+    async def test_without_workers_converts_in_a_thread(self, monkeypatch):
+        monkeypatch.setenv("CONVERSION_WORKERS", "0")
+        monkeypatch.setenv("CONVERSION_INLINE_MAX_RECORDS", "0")
+        records = [{"id": i} for i in range(10)]
+
+        with await json_to_csv(records) as output:
+            assert output.read().decode("utf-8") == _json_to_csv(records)
+        assert process_pool._process_pool is None
+
 
 class TestCsvToJson:
     def test_simple_csv(self):
@@ -94,9 +298,9 @@ class TestCsvToJson:
         records = json.loads(result)
         assert len(records) == 2
         assert records[0]["name"] == "John"
-        assert records[0]["age"] == "30"
+        assert records[0]["age"] == 30
         assert records[1]["name"] == "Jane"
-        assert records[1]["age"] == "25"
+        assert records[1]["age"] == 25
 
     def test_empty_csv(self):
         csv_data = ""
@@ -110,6 +314,51 @@ class TestCsvToJson:
         records = json.loads(result)
         assert records == []
 
+    def test_output_is_compact(self):
+        assert _csv_to_json("name,age\nJohn,30") == '[{"name":"John","age":30}]'
+
+    def test_infers_types(self):
+        csv_data = "\n".join(
+            [
+                "count,ratio,flag,zip,note,missing",
+                "1,0.5,true,02139,a,",
+                "-2,3,False,10001,7,",
+                ",1e-3,,,,",
+            ]
+        )
+        records = json.loads(_csv_to_json(csv_data))
+        assert records == [
+            {"count": 1, "ratio": 0.5, "flag": True, "zip": "02139", "note": "a"},
+            {"count": -2, "ratio": 3, "flag": False, "zip": "10001", "note": "7"},
+            {"ratio": 0.001},
+        ]
+
+    def test_columns_with_any_other_value_stay_strings(self):
+        rows = ["id", *(str(i) for i in range(2000)), "A2"]
+        records = json.loads(_csv_to_json("\n".join(rows)))
+        assert records[0] == {"id": "0"}
+        assert records[-1] == {"id": "A2"}
+
+    def test_numbers_too_large_for_a_float_stay_strings(self):
+        json_data = _csv_to_json("a,b\n1e400,2\n1,-1e400")
+        assert json_data == '[{"a":"1e400","b":"2"},{"a":"1","b":"-1e400"}]'
+
+    def test_rebuilds_nested_records(self):
+        csv_data = "a.b,a.c[0],a.c[1],d[0].e,f\n1,x,y,2,z\n3,w,,,"
+        records = json.loads(_csv_to_json(csv_data))
+        assert records == [
+            {"a": {"b": 1, "c": ["x", "y"]}, "d": [{"e": 2}], "f": "z"},
+            {"a": {"b": 3, "c": ["w"]}},
+        ]
+
+    def test_conflicting_headers_stay_flat(self):
+        records = json.loads(_csv_to_json("a,a.b\n1,2"))
+        assert records == [{"a": 1, "a.b": 2}]
+
+    def test_nesting_can_be_disabled(self):
+        records = json.loads(_csv_to_json("a.b\n1", nest=False))
+        assert records == [{"a.b": 1}]
+
 
 class TestRoundTrip:
     def test_json_to_csv_to_json(self):
@@ -123,5 +372,44 @@ class TestRoundTrip:
 
         assert len(records) == 2
         assert records[0]["name"] == "John"
-        assert records[0]["age"] == "30"  # Note: converted to string in CSV
+        assert records[0]["age"] == 30
         assert records[1]["name"] == "Jane"
+
+    def test_nested_records_are_lossless(self):
+        original = [
+            {
+                "uuid": "a1",
+                "data": {"dwc:year": 1990, "dwc:country": "Peru", "verified": True},
+                "indexTerms": {"geopoint": {"lat": -12.5, "lon": -77.0}},
+                "media": [{"id": "m1"}, {"id": "m2"}],
+            },
+            {
+                "uuid": "b2",
+                "data": {"dwc:year": 2001, "dwc:country": "Chile", "verified": False},
+                "indexTerms": {"geopoint": {"lat": -33.4, "lon": -70.6}},
+                "media": [{"id": "m3"}],
+            },
+        ]
+        assert json.loads(_csv_to_json(_json_to_csv(original))) == original
+
+    def test_absent_fields_stay_absent(self):
+        original = [{"a": 1, "b": "x"}, {"a": 2}, {"b": "y"}]
+        assert json.loads(_csv_to_json(_json_to_csv(original))) == original
+
+    def test_idigbio_records(self):
+        original = json.loads(resource("idigbio_records_search_result.json"))["items"]
+        records = json.loads(_csv_to_json(_json_to_csv(original)))
+
+        assert len(records) == len(original)
+        for record, original_record in zip(records, original):
+            flattened = _flatten_dict(record)
+            original_flattened = _flatten_dict(original_record)
+            assert flattened.keys() == original_flattened.keys()
+            # Only strings that look like numbers in every record, like "dwc:year", change type
+            for key, value in flattened.items():
+                original_value = original_flattened[key]
+                assert value == original_value or (
+                    isinstance(original_value, str)
+                    and isinstance(value, (int, float))
+                    and value == float(original_value)
+                )
@@ -3,6 +3,7 @@ import json
 import pytest
 from ichatbio.agent_response import (
     ArtifactResponse,
+    ProcessLogResponse,
 )
 from ichatbio.types import Artifact
 
@@ -10,6 +11,7 @@ from artifact_registry import ArtifactRegistry
 from conftest import resource
 from context import current_context, current_artifacts, ValidatedArtifactID
 from tools import join_lists
+from tools.join_lists import hash_join, spill_join
 
 
 class TestWithArtifactAccess:
@@ -87,3 +89,157 @@ class TestWithArtifactAccess:
             (m for m in messages if isinstance(m, ArtifactResponse)), None
         )
         assert artifact_message is None
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url
+        in ("https://artifact.test/list_one", "https://artifact.test/list_two")
+    )
+    @pytest.mark.parametrize("spill", [None, "threshold", "memory"])
+    @pytest.mark.asyncio
+    async def test_join_lists_on_key(self, messages, httpx_mock, monkeypatch, spill):
+        if spill == "threshold":
+            monkeypatch.setenv("SPILL_THRESHOLD_BYTES", "0")
+        if spill == "memory":
+            monkeypatch.setattr(join_lists, "admit_parsing", lambda size: False)
+        list_one = json.loads(resource("list_of_idigbio_records.json"))
+        httpx_mock.add_response(url="https://artifact.test/list_one", json=list_one)
+
+        list_two = [
+            {"occurrence": list_one[2]["uuid"], "new_field": "fee"},
+            {"occurrence": "not an occurrence", "new_field": "fi"},
+            {"occurrence": list_one[0]["uuid"], "new_field": "fo"},
+        ]
+        httpx_mock.add_response(url="https://artifact.test/list_two", json=list_two)
+
+        await join_lists.join_lists.ainvoke(
+            {
+                "artifact_one_id": "#1111",
+                "artifact_two_id": "#2222",
+                "on": ["uuid"],
+                "other_on": ["occurrence"],
+            }
+        )
+
+        artifact_message = next(
+            (m for m in messages if isinstance(m, ArtifactResponse)), None
+        )
+        assert artifact_message
+        assert json.loads(artifact_message.content.decode("utf-8")) == [
+            list_one[0] | list_two[2],
+            list_one[2] | list_two[0],
+        ]
+        assert artifact_message.metadata["join"] == {
+            "on": ["uuid"],
+            "other_on": ["occurrence"],
+            "how": "inner",
+        }
+
+        log = next(
+            m
+            for m in messages
+            if isinstance(m, ProcessLogResponse) and m.text.startswith("Joined on")
+        )
+        assert log.data["matched_one"] == 2
+        assert log.data["out_of_core"] == (spill is not None)
+        assert log.data["joined_records"] == 2
+
+    @pytest.mark.httpx_mock(
+        should_mock=lambda request: request.url
+        in ("https://artifact.test/list_one", "https://artifact.test/list_two")
+    )
+    @pytest.mark.asyncio
+    async def test_rejects_joins_by_index_without_enough_memory(
+        self, messages, httpx_mock, monkeypatch
+    ):
+        monkeypatch.setattr(join_lists, "admit_parsing", lambda size: False)
+        httpx_mock.add_response(url="https://artifact.test/list_one", json=[{"a": 1}])
+        httpx_mock.add_response(url="https://artifact.test/list_two", json=[{"b": 2}])
+
+        await self.run_tool("#1111", "#2222")
+
+        assert not any(isinstance(m, ArtifactResponse) for m in messages)
+        assert any(
+            isinstance(m, ProcessLogResponse) and "memory available" in m.text
+            for m in messages
+        )
+
+
+class TestHashJoin:
+    one = [
+        {"id": 1, "name": "a"},
+        {"id": 2, "name": "b"},
+        {"id": 3, "name": "c"},
+        {"name": "no id"},
+    ]
+    two = [
+        {"id": 2, "extra": "x"},
+        {"id": 1, "extra": "y"},
+        {"id": 2, "extra": "z"},
+        {"id": 4, "extra": "w"},
+    ]
+
+    @pytest.mark.parametrize("swap_sizes", [False, True])
+    def test_inner(self, swap_sizes):
+        # Indexing either list produces the same result, in the first list's order
+        one = self.one[:2] if swap_sizes else self.one
+        joined, stats = hash_join(one, self.two, ["id"])
+        assert joined == [
+            {"id": 1, "name": "a", "extra": "y"},
+            {"id": 2, "name": "b", "extra": "x"},
+            {"id": 2, "name": "b", "extra": "z"},
+        ]
+        assert stats.index_side == ("one" if swap_sizes else "two")
+        assert stats.matched_one == 2
+        assert stats.matched_two == 3
+
+    def test_left(self):
+        joined, stats = hash_join(self.one, self.two, ["id"], how="left")
+        assert joined[3:] == [{"id": 3, "name": "c"}, {"name": "no id"}]
+        assert stats.missing_keys_one == 1
+        assert stats.duplicate_keys == 1
+
+    def test_outer(self):
+        joined, stats = hash_join(self.one, self.two, ["id"], how="outer")
+        assert len(joined) == 6
+        assert joined[-1] == {"id": 4, "extra": "w"}
+        assert stats.joined_records == 6
+
+    def test_composite_and_nested_keys(self):
+        one = [
+            {"taxon": {"genus": "Ursus", "species": "arctos"}, "n": 1},
+            {"taxon": {"genus": "Ursus", "species": "maritimus"}, "n": 2},
+        ]
+        two = [
+            {"genus": "Ursus", "species": "maritimus", "common": "polar bear"},
+            {"genus": "Ursus", "species": None, "common": "bear"},
+        ]
+        joined, stats = hash_join(
+            one, two, ["taxon.genus", "taxon.species"], ["genus", "species"]
+        )
+        assert joined == [one[1] | two[0]]
+        assert stats.missing_keys_two == 1
+
+    def test_values_of_different_types_dont_match(self):
+        joined, _ = hash_join([{"k": 1}, {"k": "1"}], [{"k": True}, {"k": 1.0}], ["k"])
+        assert joined == [{"k": 1.0}]
+
+    def test_mismatched_key_lengths(self):
+        with pytest.raises(ValueError):
+            hash_join(self.one, self.two, ["id"], ["id", "extra"])
+
+
+@pytest.mark.parametrize("how", ["inner", "left", "outer"])
+def test_spill_join_matches_hash_join(how):
+    one = json.loads(resource("list_of_idigbio_records.json"))
+    one += [{"uuid": None}, {"uuid": one[0]["uuid"], "extra": 1}]
+    two = [{"uuid": record["uuid"], "new_field": i} for i, record in enumerate(one)]
+    two += [{"uuid": "unmatched"}]
+
+    joined, stats = hash_join(one, two, ["uuid"], how=how)
+    output, spill_stats = spill_join(iter(one), iter(two), ["uuid"], how=how)
+    with output:
+        assert output.read() == json.dumps(joined).encode("utf-8")
+    assert spill_stats.out_of_core
+    assert spill_stats.model_dump(exclude={"out_of_core"}) == stats.model_dump(
+        exclude={"out_of_core"}
+    )
@@ -0,0 +1,91 @@
+import tracemalloc
+
+import pytest
+
+import memory
+from memory import (
+    MEMORY_RESERVED,
+    account_memory,
+    admit,
+    available_memory,
+    format_bytes,
+    memory_budget,
+    rss_bytes,
+)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Sets the budget to 1 GB more than the memory in use."""
+    budget = rss_bytes() + 1_000_000_000
+    monkeypatch.setenv("MEMORY_BUDGET_BYTES", str(budget))
+    return budget
+
+
+class TestBudget:
+    def test_defaults_to_a_fraction_of_the_memory_limit(self, monkeypatch):
+        monkeypatch.delenv("MEMORY_BUDGET_BYTES", raising=False)
+        monkeypatch.setattr(memory, "_memory_limit", lambda: 1000)
+        assert memory_budget() == 800
+
+    def test_zero_disables_the_budget(self, monkeypatch):
+        monkeypatch.setenv("MEMORY_BUDGET_BYTES", "0")
+        assert memory_budget() is None
+        assert available_memory() is None
+        assert admit(10**18)
+
+
+class TestAdmit:
+    def test_admits_what_fits(self, budget):
+        assert admit(1_000)
+        assert not admit(2_000_000_000)
+
+    def test_reserves_until_the_account_closes(self, budget):
+        available = available_memory()
+        with account_memory() as account:
+            assert admit(600_000_000)
+            assert account.reserved_bytes == 600_000_000
+            assert MEMORY_RESERVED.value() == 600_000_000
+            # The reservation counts against the next request
+            assert not admit(600_000_000)
+        assert MEMORY_RESERVED.value() == 0
+        assert available_memory() == pytest.approx(available, abs=50_000_000)
+        assert admit(600_000_000)
+
+    def test_reservations_shrink_as_their_memory_is_used(self, budget):
+        with account_memory():
+            assert admit(400_000_000)
+            data = bytearray(200_000_000)
+            data[::4096] = b"x" * len(data[::4096])  # Touch every page so it's resident
+            # The 200 MB in use now count once, not as part of RSS and again as part of the reservation
+            assert admit(500_000_000)
+            del data
+
+    def test_does_not_reserve_outside_an_account(self, budget):
+        assert admit(600_000_000)
+        assert MEMORY_RESERVED.value() == 0
+
+
+class TestAccountMemory:
+    def test_measures_rss_growth(self):
+        with account_memory() as account:
+            data = bytearray(50_000_000)
+            data[::4096] = b"x" * len(data[::4096])  # Touch every page so it's resident
+        assert account.rss_growth_bytes >= 40_000_000
+        assert "traced_peak_bytes" not in account.as_data()
+
+    def test_traces_a_sample_of_calls(self, monkeypatch):
+        monkeypatch.setenv("MEMORY_TRACE_SAMPLE_RATE", "1")
+        with account_memory() as account:
+            data = bytearray(10_000_000)
+            del data
+        assert account.traced_peak_bytes >= 10_000_000
+        assert account.as_data()["traced_peak_bytes"] == account.traced_peak_bytes
+        assert not tracemalloc.is_tracing()
+
+
+def test_format_bytes():
+    assert format_bytes(512) == "512 bytes"
+    assert format_bytes(1_500) == "1.5 KB"
+    assert format_bytes(2_300_000_000) == "2.3 GB"
+    assert format_bytes(5_000_000_000_000) == "5000.0 GB"
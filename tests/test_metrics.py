@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion
+
+from metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    STAGE_SECONDS,
+    collect_timings,
+    langchain_usage,
+    openai_usage,
+    render_metrics,
+    timed,
+)
+
+
+class TestCounter:
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        REGISTRY.remove(self.counter)
+
+    def test_counts_per_label(self):
+        self.counter = Counter("test_total", "A test counter", ("stage",))
+        self.counter.inc(stage="a")
+        self.counter.inc(2, stage="a")
+        self.counter.inc(stage="b")
+        assert self.counter.value(stage="a") == 3
+        assert self.counter.value(stage="b") == 1
+        assert self.counter.value(stage="c") == 0
+
+    def test_rejects_unknown_labels(self):
+        self.counter = Counter("test_total", "A test counter", ("stage",))
+        with pytest.raises(ValueError):
+            self.counter.inc(tool="a")
+
+
+class TestHistogram:
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        self.histogram = Histogram(
+            "test_seconds", "A test histogram", ("stage",), buckets=(0.1, 1)
+        )
+        yield
+        REGISTRY.remove(self.histogram)
+
+    def test_counts_values_in_buckets(self):
+        for value in (0.05, 0.1, 0.5, 2):
+            self.histogram.observe(value, stage="a")
+        sample = self.histogram.samples()[("a",)]
+        assert sample.bucket_counts == [2, 1, 1]
+        assert sample.sum == pytest.approx(2.65)
+        assert sample.count == 4
+        assert self.histogram.count(stage="b") == 0
+
+
+class TestGauge:
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        self.gauge = Gauge("test_in_flight", "A test gauge")
+        yield
+        REGISTRY.remove(self.gauge)
+
+    def test_tracks_work_in_progress(self):
+        with self.gauge.track():
+            with self.gauge.track():
+                assert self.gauge.value() == 2
+        assert self.gauge.value() == 0
+
+    def test_stops_tracking_work_that_fails(self):
+        with pytest.raises(ValueError):
+            with self.gauge.track():
+                raise ValueError()
+        assert self.gauge.value() == 0
+
+
+class TestRenderMetrics:
+    def test_renders_counters_and_gauges(self):
+        counter = Counter("test_total", "A test counter", ("stage",))
+        gauge = Gauge("test_in_flight", "A test gauge")
+        counter.inc(stage="b")
+        counter.inc(2.5, stage='a "quoted"\nstage')
+        try:
+            assert render_metrics([counter, gauge]) == (
+                "# HELP test_total A test counter\n"
+                "# TYPE test_total counter\n"
+                'test_total{stage="a \\"quoted\\"\\nstage"} 2.5\n'
+                'test_total{stage="b"} 1\n'
+                "# HELP test_in_flight A test gauge\n"
+                "# TYPE test_in_flight gauge\n"
+                "test_in_flight 0\n"
+            )
+        finally:
+            REGISTRY.remove(counter)
+            REGISTRY.remove(gauge)
+
+    def test_renders_cumulative_histogram_buckets(self):
+        histogram = Histogram("test_seconds", "A test histogram", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 2):
+            histogram.observe(value)
+        try:
+            assert render_metrics([histogram]).splitlines()[2:] == [
+                'test_seconds_bucket{le="0.1"} 1',
+                'test_seconds_bucket{le="1"} 2',
+                'test_seconds_bucket{le="+Inf"} 3',
+                "test_seconds_sum 2.55",
+                "test_seconds_count 3",
+            ]
+        finally:
+            REGISTRY.remove(histogram)
+
+
+class TestTimed:
+    def test_collects_timings_of_stages(self):
+        fetches = STAGE_SECONDS.count(stage="artifact_fetch")
+        with collect_timings() as timings:
+            with timed("artifact_fetch"):
+                pass
+            with timed("llm_call"):
+                pass
+            with timed("llm_call"):
+                pass
+        assert set(timings) == {"artifact_fetch", "llm_call"}
+        assert STAGE_SECONDS.count(stage="artifact_fetch") == fetches + 1
+
+    def test_times_stages_that_fail(self):
+        with collect_timings() as timings:
+            with pytest.raises(ValueError):
+                with timed("parse"):
+                    raise ValueError()
+        assert "parse" in timings
+
+    @pytest.mark.asyncio
+    async def test_collects_timings_from_threads(self):
+        def parse():
+            with timed("parse"):
+                pass
+
+        with collect_timings() as timings:
+            await asyncio.to_thread(parse)
+        assert "parse" in timings
+
+    def test_times_without_collecting(self):
+        with timed("parse"):
+            pass
+
+
+def test_openai_usage():
+    completion = ChatCompletion(
+        id="1",
+        choices=[],
+        created=0,
+        model="test",
+        object="chat.completion",
+        usage=CompletionUsage(
+            prompt_tokens=2000,
+            completion_tokens=10,
+            total_tokens=2010,
+            prompt_tokens_details={"cached_tokens": 1536},
+        ),
+    )
+    assert openai_usage(completion) == (2000, 1536)
+
+
+def test_openai_usage_without_details():
+    completion = ChatCompletion(
+        id="1", choices=[], created=0, model="test", object="chat.completion"
+    )
+    assert openai_usage(completion) == (0, 0)
+
+
+def test_langchain_usage():
+    message = AIMessage(
+        content="",
+        usage_metadata={
+            "input_tokens": 1200,
+            "output_tokens": 10,
+            "total_tokens": 1210,
+            "input_token_details": {"cache_read": 1024},
+        },
+    )
+    assert langchain_usage(message) == (1200, 1024)
@@ -17,6 +17,7 @@ from context import (
     ValidatedArtifactID,
 )
 from tools import process_data
+from tools.util import JsonLines
 
 dotenv.load_dotenv()
 
@@ -101,3 +102,45 @@ class TestWithArtifactAccess:
         records = json.loads(artifact_message.content.decode("utf-8"))
 
         assert records == self.artifact_content["items"]
+
+
+def test_prompt_varies_only_after_stable_prefix():
+    other_records = OCCURRENCE_RECORDS.model_copy(update={"local_id": "#0001"})
+
+    one = process_data._make_messages(
+        "Get the first record", ".[]", [1], OCCURRENCE_RECORDS
+    )
+    two = process_data._make_messages("Count the records", ".[]", [1], other_records)
+
+    assert one[0] == two[0]
+    assert one[0]["role"] == "system"
+    assert one[-1]["content"].endswith("Get the first record")
+
+
+class TestJsonLines:
+    def test_query_runs_on_each_record(self):
+        results_box = [None]
+        response_model = process_data._make_validating_response_model(
+            JsonLines(text='{"a": 1}\n{"a": 2, "b": 3}\n'), results_box
+        )
+        response_model.model_validate(
+            {
+                "response": {
+                    "plan": "Get a",
+                    "jq_query_string": ".a",
+                    "output_description": "a values",
+                }
+            }
+        )
+        assert results_box[0] == [1, 2]
+
+    def test_schema_describes_records(self):
+        source = JsonLines(text='{"a": 1}\n{"b": "x"}\n')
+        schema = process_data._infer_schema(source)
+        assert set(schema["properties"]) == {"a", "b"}
+
+        messages = process_data._make_messages("Get a", "…", source, OCCURRENCE_RECORDS)
+        assert any(
+            m["content"].startswith(process_data.JSON_LINES_NOTE) for m in messages
+        )
+        assert messages[3]["content"].endswith(source.text)
@@ -0,0 +1,179 @@
+import json
+import sqlite3
+
+import pytest
+from ichatbio.types import Artifact
+
+from conftest import resource
+from tools import query_data
+from tools.query_data import SEQUENCE_COLUMN, RecordTable
+
+OCCURRENCE_RECORDS = Artifact(
+    local_id="#0000",
+    mimetype="application/json",
+    description="A list of occurrence records",
+    uris=["https://artifact.test"],
+    metadata={"source": "iDigBio"},
+)
+
+
+@pytest.fixture
+def table():
+    table = RecordTable(sqlite3.connect(":memory:"))
+    table.load(
+        [
+            {"id": 1, "taxon": {"genus": "Ursus"}, "tags": ["a", "b"], "ok": True},
+            {"id": 2, "taxon": {"genus": "Ursus", "rank": "species"}, "ok": False},
+            {"id": 3.5, "taxon": {}, "tags": []},
+            "not a record",
+        ]
+    )
+    return table
+
+
+class TestRecordTable:
+    def test_flattens_records_into_columns(self, table):
+        assert table.count == 4
+        assert table.columns == {
+            "id": {"integer", "number"},
+            "taxon.genus": {"string"},
+            "tags": {"list"},
+            "ok": {"boolean"},
+            "taxon.rank": {"string"},
+            "taxon": {"object"},
+            "value": {"string"},
+        }
+
+    def test_describe(self, table):
+        lines = table.describe().splitlines()
+        assert '"id": integer|number' in lines
+        assert '"taxon.genus"' in lines  # Strings go without saying
+        assert '"tags": list (stored as JSON text)' in lines
+        assert '"ok": boolean (0 or 1)' in lines
+
+    def test_describe_keeps_relevant_columns_within_budget(self):
+        table = RecordTable(sqlite3.connect(":memory:"))
+        table.load(json.loads(resource("list_of_idigbio_records.json")))
+        text = table.describe("count the records per country", token_budget=100)
+        assert len(text) <= 400
+        assert '"indexTerms.country"' in text
+        assert text.endswith("less relevant fields omitted)")
+
+    def test_query_results_are_json(self, table):
+        rows = table.query(
+            'SELECT id, "taxon.genus" AS genus, tags, ok FROM records WHERE id < 3'
+        )
+        assert rows == [
+            {"id": 1, "genus": "Ursus", "tags": ["a", "b"], "ok": True},
+            {"id": 2, "genus": "Ursus", "tags": None, "ok": False},
+        ]
+
+    def test_query_with_json_functions(self, table):
+        rows = table.query(
+            "SELECT tag.value AS tag FROM records, json_each(records.tags) AS tag"
+        )
+        assert rows == [{"tag": "a"}, {"tag": "b"}]
+
+    def test_hides_row_numbers(self, table):
+        assert SEQUENCE_COLUMN not in table.query("SELECT * FROM records LIMIT 1")[0]
+
+    def test_gives_clashing_fields_their_own_columns(self):
+        table = RecordTable(sqlite3.connect(":memory:"))
+        table.load(
+            [
+                {"id": 1, "ID": "a", SEQUENCE_COLUMN: "x", "a.b": 2, "a": {"b": 3}},
+                {"Id": 4},
+            ]
+        )
+
+        assert table.query("SELECT * FROM records") == [
+            {"id": 1, "ID_2": "a", "#seq_2": "x", '"a.b"': 2, "a.b": 3, "Id_3": None},
+            {
+                "id": None,
+                "ID_2": None,
+                "#seq_2": None,
+                '"a.b"': None,
+                "a.b": None,
+                "Id_3": 4,
+            },
+        ]
+        lines = table.describe().splitlines()
+        assert '"ID_2" (the field ID)' in lines
+        assert '"Id_3" (the field Id): integer' in lines
+        assert '"#seq_2" (the field #seq)' in lines
+        assert '"a.b": integer' in lines
+        assert '"""a.b""": integer' in lines
+
+    @pytest.mark.parametrize(
+        "sql",
+        [
+            "DELETE FROM records",
+            "DROP TABLE records",
+            "PRAGMA table_info(records)",
+            "ATTACH DATABASE 'other.db' AS other",
+        ],
+    )
+    def test_only_reads(self, table, sql):
+        with pytest.raises(ValueError):
+            table.query(sql)
+        assert table.query("SELECT COUNT(*) AS n FROM records") == [{"n": 4}]
+
+    def test_interrupts_slow_queries(self, table, monkeypatch):
+        monkeypatch.setattr(query_data, "SQL_QUERY_TIMEOUT_SECONDS", 0)
+        with pytest.raises(ValueError, match="took longer"):
+            table.query(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+            )
+
+
+class TestValidation:
+    def validate(self, table, sql):
+        results_box = [None]
+        response_model = query_data._make_validating_response_model(table, results_box)
+        response_model.model_validate(
+            {
+                "response": {
+                    "plan": "Count",
+                    "sql_query": sql,
+                    "output_description": "Counts",
+                }
+            }
+        )
+        return results_box[0]
+
+    def test_runs_the_query(self, table):
+        assert self.validate(
+            table,
+            'SELECT "taxon.genus" AS genus, COUNT(*) AS n FROM records GROUP BY 1',
+        ) == [{"genus": None, "n": 2}, {"genus": "Ursus", "n": 2}]
+
+    def test_rejects_failing_queries(self, table):
+        with pytest.raises(ValueError, match="no such column"):
+            self.validate(table, "SELECT missing_column FROM records")
+
+    def test_rejects_empty_results(self, table):
+        with pytest.raises(ValueError, match="empty result"):
+            self.validate(table, "SELECT id FROM records WHERE id > 10")
+
+    def test_leaves_slow_queries_to_run_later(self, table, monkeypatch):
+        monkeypatch.setattr(query_data, "SQL_VALIDATION_TIMEOUT_SECONDS", 0)
+        assert (
+            self.validate(
+                table,
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000) SELECT COUNT(*) AS n FROM n",
+            )
+            is None
+        )
+
+
+def test_prompt_varies_only_after_stable_prefix():
+    other_records = OCCURRENCE_RECORDS.model_copy(update={"local_id": "#0001"})
+
+    one = query_data._make_messages(
+        "Count the records", '"id": integer', "[]", OCCURRENCE_RECORDS
+    )
+    two = query_data._make_messages("Get the first record", '"id"', "[]", other_records)
+
+    assert one[0] == two[0]
+    assert one[0]["role"] == "system"
+    assert one[-1]["content"].endswith("Count the records")
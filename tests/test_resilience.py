@@ -0,0 +1,189 @@
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import (
+    LLM_HEDGED_REQUESTS,
+    LLM_REQUEST_FAILURES,
+    ResilientTransport,
+    circuit_breaker,
+    is_llm_available,
+    llm_http_client,
+)
+from util import close_shared_clients
+
+
+def make_client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=ResilientTransport(httpx.MockTransport(handler)))
+
+
+def completion_request(client: httpx.AsyncClient, host: str, model: str = "test"):
+    return client.post(f"https://{host}/v1/chat/completions", json={"model": model})
+
+
+class TestCircuitBreaker:
+    @pytest.mark.asyncio
+    async def test_opens_after_consecutive_failures(self, monkeypatch):
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "3")
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(500)
+
+        async with make_client(handler) as client:
+            for _ in range(3):
+                await completion_request(client, "failing.test")
+            assert not is_llm_available("https://failing.test/v1")
+
+            response = await completion_request(client, "failing.test")
+
+        assert len(calls) == 3  # The last request never reached the endpoint
+        assert response.status_code == 503
+        assert response.headers["x-should-retry"] == "false"
+
+    @pytest.mark.asyncio
+    async def test_probe_closes_circuit_after_cooldown(self, monkeypatch):
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "1")
+        monkeypatch.setenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "0")
+        responses = iter([httpx.Response(500), httpx.Response(200, json={})])
+
+        async with make_client(lambda request: next(responses)) as client:
+            await completion_request(client, "recovering.test")
+            assert circuit_breaker("https://recovering.test").opened_at is not None
+
+            response = await completion_request(client, "recovering.test")
+
+        assert response.status_code == 200
+        assert is_llm_available("https://recovering.test/v1")
+
+    @pytest.mark.asyncio
+    async def test_client_errors_do_not_count_as_failures(self, monkeypatch):
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "1")
+
+        async with make_client(lambda request: httpx.Response(400)) as client:
+            await completion_request(client, "bad-request.test")
+
+        assert is_llm_available("https://bad-request.test/v1")
+
+    @pytest.mark.asyncio
+    async def test_warm_up_requests_bypass_the_breaker(self, monkeypatch):
+        monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "1")
+
+        before = LLM_REQUEST_FAILURES.value(reason="server_error")
+        async with make_client(lambda request: httpx.Response(500)) as client:
+            response = await client.head(
+                "https://warming.test/v1", extensions={"warm_up": True}
+            )
+
+        assert response.status_code == 500
+        assert is_llm_available("https://warming.test/v1")
+        assert LLM_REQUEST_FAILURES.value(reason="server_error") == before
+
+
+class TestDeadline:
+    @pytest.mark.asyncio
+    async def test_slow_request_times_out(self, monkeypatch):
+        monkeypatch.setenv("LLM_TIMEOUT_SECONDS", "0.05")
+
+        async def handler(request):
+            await asyncio.sleep(1)
+            return httpx.Response(200)
+
+        async with make_client(handler) as client:
+            with pytest.raises(httpx.ReadTimeout):
+                await completion_request(client, "slow.test")
+
+    @pytest.mark.asyncio
+    async def test_deadline_stops_the_request(self, monkeypatch):
+        monkeypatch.setenv("LLM_TIMEOUT_SECONDS", "0.05")
+        stopped = 0
+
+        async def handler(request):
+            nonlocal stopped
+            try:
+                await asyncio.sleep(1)
+            finally:
+                stopped += 1
+
+        async with make_client(handler) as client:
+            with pytest.raises(httpx.ReadTimeout):
+                await completion_request(client, "stopped.test")
+            assert stopped == 1
+
+
+class TestHedging:
+    @pytest.mark.asyncio
+    async def test_slow_request_is_hedged(self, monkeypatch):
+        monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "5")
+        calls = 0
+
+        async def handler(request):
+            nonlocal calls
+            calls += 1
+            if calls == 6:  # The first request after warming up stalls
+                await asyncio.sleep(1)
+                return httpx.Response(200, json={"from": "original"})
+            return httpx.Response(200, json={"from": "hedge"})
+
+        before = LLM_HEDGED_REQUESTS.value(outcome="hedge")
+        async with make_client(handler) as client:
+            for _ in range(5):
+                await completion_request(client, "hedged.test")
+            response = await completion_request(client, "hedged.test")
+
+        assert response.json() == {"from": "hedge"}
+        assert calls == 7
+        assert LLM_HEDGED_REQUESTS.value(outcome="hedge") == before + 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_stops_every_attempt(self, monkeypatch):
+        monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "5")
+        calls = 0
+        stopped = 0
+
+        async def handler(request):
+            nonlocal calls, stopped
+            calls += 1
+            if calls <= 5:
+                return httpx.Response(200, json={})
+            try:
+                await asyncio.sleep(1)
+            finally:
+                stopped += 1
+
+        async with make_client(handler) as client:
+            for _ in range(5):
+                await completion_request(client, "stalled.test")
+            monkeypatch.setenv("LLM_TIMEOUT_SECONDS", "0.1")
+            with pytest.raises(httpx.ReadTimeout):
+                await completion_request(client, "stalled.test")
+            assert stopped == 2
+
+    @pytest.mark.asyncio
+    async def test_no_hedging_without_enough_samples(self, monkeypatch):
+        monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "5")
+        calls = 0
+
+        async def handler(request):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01 * calls)
+            return httpx.Response(200, json={})
+
+        async with make_client(handler) as client:
+            for _ in range(3):
+                await completion_request(client, "cold.test")
+
+        assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_llm_requests_share_a_client_per_event_loop():
+    client = llm_http_client()
+    assert llm_http_client() is client
+
+    await close_shared_clients()
+    assert client.is_closed
+    assert llm_http_client() is not client
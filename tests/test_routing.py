@@ -0,0 +1,158 @@
+import json
+
+import httpx
+import pytest
+from ichatbio.agent_response import ProcessLogResponse
+from pydantic import BaseModel
+
+from resilience import LLM_UNAVAILABLE_MESSAGE, ResilientTransport
+from routing import ROUTING_OUTCOMES, classify_request, escalate, route
+from tools.generation import GiveUp, generate_with_escalation, request_response
+from util import shared_client
+
+
+@pytest.fixture
+def two_tiers(monkeypatch):
+    monkeypatch.setenv("LLM", "large-model")
+    monkeypatch.setenv("SMALL_LLM", "small-model")
+
+
+class TestClassifyRequest:
+    def test_simple_request(self):
+        is_complex, _ = classify_request("Get the first record")
+        assert not is_complex
+
+    def test_aggregation_is_complex(self):
+        is_complex, reason = classify_request("Count records per country")
+        assert is_complex
+        assert "count" in reason.lower()
+
+    @pytest.mark.parametrize(
+        "request_text",
+        [
+            "Extract the country of each record",
+            "List the counties",
+            "Get the county field",
+            "show scientific names in order",
+            "get records where min elevation is set",
+        ],
+    )
+    def test_field_requests_are_simple(self, request_text):
+        is_complex, reason = classify_request(request_text)
+        assert not is_complex, reason
+
+    @pytest.mark.parametrize(
+        "request_text",
+        [
+            "How many records are counted per collector",
+            "Find the maximum elevation",
+            "List the records order by date",
+        ],
+    )
+    def test_aggregate_phrasings_are_complex(self, request_text):
+        is_complex, _ = classify_request(request_text)
+        assert is_complex
+
+    def test_multiple_artifacts_are_complex(self):
+        is_complex, _ = classify_request("Get the first record", artifact_count=2)
+        assert is_complex
+
+    def test_long_request_is_complex(self):
+        is_complex, _ = classify_request("extract the field " * 20)
+        assert is_complex
+
+
+class TestRoute:
+    def test_without_small_model(self, monkeypatch):
+        monkeypatch.setenv("LLM", "large-model")
+        monkeypatch.delenv("SMALL_LLM", raising=False)
+        decision = route("jq_generation", "Get the first record")
+        assert decision.model == "large-model"
+        assert decision.tier == "large"
+
+    def test_simple_request_goes_to_small_model(self, two_tiers):
+        decision = route("jq_generation", "Get the first record")
+        assert decision.model == "small-model"
+        assert decision.tier == "small"
+
+    @pytest.mark.parametrize(
+        "request_text", ["Extract the country of each record", "List the counties"]
+    )
+    def test_country_and_county_requests_go_to_small_model(
+        self, two_tiers, request_text
+    ):
+        assert route("jq_generation", request_text).tier == "small"
+
+    def test_complex_request_goes_to_large_model(self, two_tiers):
+        decision = route("jq_generation", "Sort the records by date")
+        assert decision.model == "large-model"
+
+    def test_escalate_small_to_large(self, two_tiers):
+        decision = route("jq_generation", "Get the first record")
+        before = ROUTING_OUTCOMES.value(
+            stage="jq_generation", tier="small", outcome="escalated"
+        )
+
+        escalated = escalate(decision, "validation failed")
+
+        assert escalated.model == "large-model"
+        assert escalated.reason == "validation failed"
+        assert (
+            ROUTING_OUTCOMES.value(
+                stage="jq_generation", tier="small", outcome="escalated"
+            )
+            == before + 1
+        )
+
+    def test_large_model_does_not_escalate(self, two_tiers):
+        decision = route("jq_generation", "Sort the records by date")
+        assert escalate(decision, "validation failed") is None
+
+
+class TestGenerateWithEscalation:
+    @pytest.mark.asyncio
+    async def test_unavailable_llm_is_not_escalated(
+        self, two_tiers, monkeypatch, context, messages
+    ):
+        monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("OPENAI_BASE_URL", "https://llm.test/v1")
+        models = []
+
+        def handler(request: httpx.Request):
+            models.append(json.loads(request.content)["model"])
+            return httpx.Response(503, json={"error": {"message": "Overloaded"}})
+
+        shared_client(
+            "llm",
+            lambda: httpx.AsyncClient(
+                transport=ResilientTransport(httpx.MockTransport(handler))
+            ),
+        )
+
+        class ResponseModel(BaseModel):
+            response: GiveUp
+
+        async def attempt(decision):
+            messages = [{"role": "user", "content": "Get the first record"}]
+            return (
+                await request_response(
+                    "jq_generation", decision, messages, ResponseModel
+                ),
+                None,
+            )
+
+        async with context.begin_process("Testing") as process:
+            result = await generate_with_escalation(
+                process, "Get the first record", "jq_generation", "a query", attempt
+            )
+
+        assert result is None
+        assert set(models) == {"small-model"}
+        assert any(
+            isinstance(m, ProcessLogResponse) and m.text == LLM_UNAVAILABLE_MESSAGE
+            for m in messages
+        )
+        assert not any(
+            isinstance(m, ProcessLogResponse) and m.text == "Failed to generate a query"
+            for m in messages
+        )
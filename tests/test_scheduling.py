@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from metrics import collect_timings
+from scheduling import SCHEDULER_QUEUED, FairLimiter
+from util import tenant_key, update_llm_credentials
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setenv("TEST_MAX_CONCURRENT", "1")
+    return FairLimiter("test", "TEST_MAX_CONCURRENT", 1)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestFairLimiter:
+    @pytest.mark.asyncio
+    async def test_limits_concurrency(self, limiter, monkeypatch):
+        monkeypatch.setenv("TEST_MAX_CONCURRENT", "2")
+        running, most = 0, 0
+
+        async def work():
+            nonlocal running, most
+            async with limiter.slot():
+                running += 1
+                most = max(most, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        assert most == 2
+        assert limiter.active == 0
+
+    @pytest.mark.asyncio
+    async def test_zero_means_no_limit(self, limiter, monkeypatch):
+        monkeypatch.setenv("TEST_MAX_CONCURRENT", "0")
+        for _ in range(10):
+            await limiter.acquire("a")
+        assert limiter.active == 10
+
+    @pytest.mark.asyncio
+    async def test_tenants_take_turns(self, limiter):
+        await limiter.acquire("holder")
+        served = []
+
+        async def work(tenant: str):
+            await limiter.acquire(tenant)
+            served.append(tenant)
+            limiter.release()
+
+        # One tenant queues a burst before another tenant's work arrives
+        tasks = [asyncio.create_task(work("a")) for _ in range(4)]
+        await settle()
+        tasks += [asyncio.create_task(work("b")) for _ in range(2)]
+        await settle()
+        assert SCHEDULER_QUEUED.value(pool="test") == 6
+
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert served == ["a", "b", "a", "b", "a", "a"]
+        assert SCHEDULER_QUEUED.value(pool="test") == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiters_give_up_their_turn(self, limiter):
+        await limiter.acquire("holder")
+        cancelled = asyncio.create_task(limiter.acquire("a"))
+        waiting = asyncio.create_task(limiter.acquire("b"))
+        await settle()
+
+        cancelled.cancel()
+        await settle()
+        limiter.release()
+        await waiting
+        assert limiter.active == 1
+
+    @pytest.mark.asyncio
+    async def test_times_the_wait(self, limiter):
+        await limiter.acquire("holder")
+
+        async def work():
+            with collect_timings() as timings:
+                async with limiter.slot():
+                    pass
+            return timings
+
+        task = asyncio.create_task(work())
+        await asyncio.sleep(0.05)
+        limiter.release()
+        timings = await task
+        assert timings["test_queue"] >= 0.04
+
+
+def test_tenants_are_told_apart_by_llm_key():
+    update_llm_credentials(None)
+    assert tenant_key() == "shared"
+
+    update_llm_credentials({"https://ichatbio.org/a2a/v1": {"temporary_llm_key": "k1"}})
+    first = tenant_key()
+    update_llm_credentials({"https://ichatbio.org/a2a/v1": {"temporary_llm_key": "k2"}})
+    assert tenant_key() != first
+    assert "k2" not in tenant_key()
+    update_llm_credentials(None)
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from tools.spill import SpillDatabase, key_value, record_key, should_spill
+
+
+@pytest.fixture
+def db():
+    with SpillDatabase() as db:
+        yield db
+
+
+def test_threshold(monkeypatch):
+    monkeypatch.setenv("SPILL_THRESHOLD_BYTES", "100")
+    assert not should_spill(100)
+    assert should_spill(101)
+
+
+def test_database_is_deleted_when_closed():
+    db = SpillDatabase()
+    assert os.path.exists(db.path)
+    db.close()
+    assert not os.path.exists(db.path)
+
+
+class TestRecordKey:
+    def test_values_of_different_types_are_distinct(self):
+        values = {key_value(v) for v in [1, "1", True, [1], {"a": 1}, "[1]"]}
+        assert len(values) == 6
+        assert key_value({"b": 1, "a": 2}) == key_value({"a": 2, "b": 1})
+
+    def test_missing_and_null_fields_have_no_key(self):
+        assert record_key({"a": 1, "b": {"c": 2}}, ["a", "b.c"]) == (1, 2)
+        assert record_key({"a": 1, "b": None}, ["a", "b"]) is None
+        assert record_key({"a": 1}, ["a", "b"]) is None
+        assert record_key("not a record", ["a"]) is None
+
+
+class TestSpillDatabase:
+    one = [{"id": 1}, {"id": 2, "n": "b"}, {"n": "no id"}, {"id": 2, "n": "c"}]
+    two = [{"id": 2, "x": 1}, {"id": 3, "x": 2}, {"id": True, "x": 3}]
+
+    def load(self, db):
+        assert db.load("one", self.one, ["id"]) == 4
+        assert db.load("two", self.two, ["id"]) == 3
+
+    def test_join(self, db):
+        self.load(db)
+        rows = list(db.join("one", "two", "inner"))
+        assert rows == [
+            ('{"id": 2, "n": "b"}', '{"id": 2, "x": 1}'),
+            ('{"id": 2, "n": "c"}', '{"id": 2, "x": 1}'),
+        ]
+
+    def test_left_and_outer_joins(self, db):
+        self.load(db)
+        left = list(db.join("one", "two", "left"))
+        match = '{"id": 2, "x": 1}'
+        assert [row[1] for row in left] == [None, match, None, match]
+        outer = list(db.join("one", "two", "outer"))
+        assert outer[len(left) :] == [
+            (None, '{"id": 3, "x": 2}'),
+            (None, '{"id": true, "x": 3}'),
+        ]
+
+    def test_counts(self, db):
+        self.load(db)
+        assert db.count("one") == 4
+        assert db.count_missing_keys("one") == 1
+        assert db.count_duplicate_keys("one") == 1
+        assert db.count_matched("one", "two") == 2
+        assert db.count_matched("two", "one") == 1
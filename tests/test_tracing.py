@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from context import current_span
+from metrics import timed
+import tracing
+from tracing import add_event, annotate, flush_traces, span, trace_request
+
+TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("TRACE_FILE", str(path))
+    monkeypatch.delenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", raising=False)
+    return path
+
+
+def read_traces(path) -> list[dict[str, dict]]:
+    """The spans of each exported trace, by name."""
+    flush_traces()
+    traces = []
+    for line in path.read_text().splitlines():
+        (resource_spans,) = json.loads(line)["resourceSpans"]
+        (scope_spans,) = resource_spans["scopeSpans"]
+        traces.append({span["name"]: span for span in scope_spans["spans"]})
+    return traces
+
+
+class TestTracing:
+    @pytest.mark.asyncio
+    async def test_is_off_by_default(self, monkeypatch):
+        monkeypatch.delenv("TRACE_FILE", raising=False)
+        monkeypatch.delenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", raising=False)
+
+        async with trace_request("request") as root:
+            with span("stage") as child:
+                annotate(ignored=True)
+        assert root is None
+        assert child is None
+        assert current_span.get() is None
+
+    @pytest.mark.asyncio
+    async def test_exports_the_tree_of_spans(self, trace_file):
+        async with trace_request("request", entrypoint="process_data"):
+            with timed("prompt_build"):
+                annotate(characters=100)
+            with span("tool_call", tool="aggregate"):
+                await asyncio.to_thread(add_event, "in_a_thread")
+                with timed("artifact_fetch"):
+                    pass
+
+        (spans,) = read_traces(trace_file)
+        assert set(spans) == {"request", "prompt_build", "tool_call", "artifact_fetch"}
+        root = spans["request"]
+        assert "parentSpanId" not in root
+        assert root["kind"] == 2
+        assert {span["traceId"] for span in spans.values()} == {root["traceId"]}
+        assert spans["prompt_build"]["parentSpanId"] == root["spanId"]
+        assert spans["tool_call"]["parentSpanId"] == root["spanId"]
+        assert spans["artifact_fetch"]["parentSpanId"] == spans["tool_call"]["spanId"]
+        assert {"key": "characters", "value": {"intValue": "100"}} in spans[
+            "prompt_build"
+        ]["attributes"]
+        assert spans["tool_call"]["events"][0]["name"] == "in_a_thread"
+        assert current_span.get() is None
+
+    @pytest.mark.asyncio
+    async def test_records_errors(self, trace_file):
+        with pytest.raises(ValueError):
+            async with trace_request("request"):
+                with span("stage"):
+                    raise ValueError("bad query")
+
+        (spans,) = read_traces(trace_file)
+        assert spans["stage"]["status"] == {
+            "code": 2,
+            "message": "ValueError: bad query",
+        }
+        assert spans["stage"]["events"][0]["name"] == "exception"
+        assert spans["request"]["status"]["code"] == 2
+
+    @pytest.mark.asyncio
+    async def test_continues_the_callers_trace(self, trace_file):
+        async with trace_request("request", traceparent=TRACEPARENT):
+            pass
+        async with trace_request("request", traceparent="not a traceparent"):
+            pass
+
+        continued, started = read_traces(trace_file)
+        assert continued["request"]["traceId"] == "0af7651916cd43dd8448eb211c80319c"
+        assert continued["request"]["parentSpanId"] == "b7ad6b7169203331"
+        assert started["request"]["traceId"] != continued["request"]["traceId"]
+
+    @pytest.mark.asyncio
+    async def test_exports_to_a_collector(self, httpx_mock, monkeypatch):
+        monkeypatch.delenv("TRACE_FILE", raising=False)
+        monkeypatch.setenv(
+            "OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://collector.test/v1/traces"
+        )
+        httpx_mock.add_response(url="http://collector.test/v1/traces")
+
+        async with trace_request("request"):
+            with span("stage"):
+                pass
+
+        flush_traces()
+        (request,) = httpx_mock.get_requests()
+        (resource_spans,) = json.loads(request.content)["resourceSpans"]
+        assert len(resource_spans["scopeSpans"][0]["spans"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_exports_in_the_background_in_batches(self, trace_file, monkeypatch):
+        exporting = threading.Event()
+        release = threading.Event()
+        batches = []
+        export_traces = tracing.export_traces
+
+        def export_slowly(traces):
+            exporting.set()
+            release.wait(timeout=10)
+            batches.append(len(traces))
+            export_traces(traces)
+
+        monkeypatch.setattr(tracing, "export_traces", export_slowly)
+
+        for _ in range(4):
+            async with trace_request("request"):
+                pass
+            # The first trace holds up the exporter, and the rest queue up behind it
+            assert await asyncio.to_thread(exporting.wait, 10)
+        release.set()
+
+        assert len(read_traces(trace_file)) == 4
+        assert batches == [1, 3]
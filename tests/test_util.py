@@ -1,7 +1,25 @@
+import asyncio
 import importlib.resources
 import json
 
-from tools.util import contains_non_null_content, extract_json_schema
+import pytest
+from ichatbio.agent_response import ArtifactResponse, DirectResponse
+
+import tools.util
+from tools.util import (
+    JsonLines,
+    capture_messages,
+    contains_non_null_content,
+    dump_json_lines,
+    estimate_tokens,
+    extract_json_schema,
+    is_json_lines,
+    iter_json_array,
+    iter_json_lines,
+    iter_json_records,
+    lookup_field,
+    render_schema,
+)
 
 
 class TestContainsNonNullContent:
@@ -30,6 +48,140 @@ class TestContainsNonNullContent:
         assert contains_non_null_content({"key": {"key": "value"}})
 
 
+class TestJsonLines:
+    @pytest.mark.parametrize(
+        "text", ['{"a": 1}\n{"a": 2}', '  {"a": 1}\n\n{"a": 2}\n', "[1]\n[2]"]
+    )
+    def test_sniffs_json_lines(self, text):
+        assert is_json_lines(text)
+
+    @pytest.mark.parametrize(
+        "text", ['{\n  "a": 1\n}', '[{"a": 1}]\n', '{"a": 1}', "", "not json\nat all"]
+    )
+    def test_json_documents_are_not_json_lines(self, text):
+        assert not is_json_lines(text)
+
+    def test_mimetype_decides(self):
+        assert is_json_lines('{"a": 1}', "application/x-ndjson; charset=utf-8")
+        assert is_json_lines('{"a": 1}', "application/jsonl")
+
+    def test_iterates_records(self):
+        text = '{"a": 1}\n\n{"a": 2}\n'
+        assert list(iter_json_lines(text)) == [{"a": 1}, {"a": 2}]
+        assert list(JsonLines(text=text).records()) == [{"a": 1}, {"a": 2}]
+
+    def test_reports_invalid_line(self):
+        with pytest.raises(ValueError, match="line 2"):
+            list(iter_json_lines('{"a": 1}\n{"a": '))
+
+    def test_dump_round_trips(self):
+        records = [{"a": 1}, [2], "three"]
+        text = dump_json_lines(records).decode("utf-8")
+        assert text.count("\n") == 3
+        assert list(iter_json_lines(text)) == records
+
+
+class TestIterJsonArray:
+    @pytest.fixture(autouse=True, params=["whole", "streamed"])
+    def parsing(self, request, monkeypatch):
+        if request.param == "streamed":
+            monkeypatch.setattr(tools.util, "JSON_ARRAY_STREAMING_MIN_SIZE", 0)
+
+    @pytest.mark.parametrize(
+        "text",
+        [
+            "[]",
+            " [ ]\n",
+            '[1, "two" ,{"three": [3]}]',
+            '\n[\n  {"a": 1},\n  {"a": 2}\n]\n',
+        ],
+    )
+    def test_matches_json_loads(self, text):
+        assert list(iter_json_array(text)) == json.loads(text)
+
+    def test_rejects_non_arrays_before_iterating(self):
+        with pytest.raises(ValueError, match="not a JSON array"):
+            iter_json_array('{"a": 1}')
+
+    @pytest.mark.parametrize("text", ["[1 2]", "[1,]", "[1] 2", "[1"])
+    def test_rejects_invalid_arrays(self, text):
+        with pytest.raises(ValueError):
+            list(iter_json_array(text))
+
+    def test_iter_json_records_reads_either_format(self):
+        assert list(iter_json_records('{"a": 1}\n{"a": 2}')) == [{"a": 1}, {"a": 2}]
+        assert list(iter_json_records('[{"a": 1}, {"a": 2}]')) == [{"a": 1}, {"a": 2}]
+
+
+class TestLookupField:
+    def test_paths(self):
+        record = {"a": {"b": {"c": 1}}, "a.b": 2, "d": None}
+        assert lookup_field(record, "a.b.c") == 1
+        assert lookup_field(record, "a.b") == 2  # Literal field names come first
+        assert lookup_field(record, "a.x") is None
+        assert lookup_field(record, "a.b.c.d") is None
+        assert lookup_field(record, "d") is None
+        assert lookup_field([1], "a") is None
+
+
+class TestCaptureMessages:
+    @pytest.mark.asyncio
+    async def test_captures_messages(self, context, messages):
+        with capture_messages(context) as captured:
+            await context.reply("Alert!")
+
+        assert captured == [DirectResponse("Alert!")]
+        assert messages == [DirectResponse("Alert!")]
+
+    @pytest.mark.asyncio
+    async def test_artifact_content_is_not_captured(self, context):
+        with capture_messages(context) as captured:
+            async with context.begin_process("Making data") as process:
+                await process.create_artifact("text/plain", "Data", content=b"data")
+
+        artifact = captured[-1]
+        assert isinstance(artifact, ArtifactResponse)
+        assert artifact.content is None
+
+    @pytest.mark.asyncio
+    async def test_stops_capturing_after_exit(self, context, messages):
+        with capture_messages(context) as captured:
+            pass
+        await context.reply("Alert!")
+
+        assert captured == []
+        assert messages == [DirectResponse("Alert!")]
+
+    @pytest.mark.asyncio
+    async def test_nested_captures(self, context):
+        with capture_messages(context) as outer:
+            await context.reply("One")
+            with capture_messages(context) as inner:
+                await context.reply("Two")
+
+        assert outer == [DirectResponse("One"), DirectResponse("Two")]
+        assert inner == [DirectResponse("Two")]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_captures_are_attributed_to_their_task(
+        self, context, messages
+    ):
+        async def reply_repeatedly(name: str):
+            with capture_messages(context) as captured:
+                for i in range(3):
+                    await context.reply(f"{name} {i}")
+                    await asyncio.sleep(0)  # Let the other task interleave
+            return captured
+
+        one, two = await asyncio.gather(
+            reply_repeatedly("one"), reply_repeatedly("two")
+        )
+
+        assert [m.text for m in one] == ["one 0", "one 1", "one 2"]
+        assert [m.text for m in two] == ["two 0", "two 1", "two 2"]
+        assert len(messages) == 6
+
+
 def test_extract_json_schema():
     data = json.loads(
         importlib.resources.files("resources")
@@ -39,3 +191,45 @@ def test_extract_json_schema():
     schema = extract_json_schema(data)
     top_level_fields = set(schema["properties"]["items"]["items"]["properties"].keys())
     assert top_level_fields == {"data", "etag", "indexTerms", "type", "uuid"}
+
+
+class TestRenderSchema:
+    @staticmethod
+    def idigbio_schema():
+        data = json.loads(
+            importlib.resources.files("resources")
+            .joinpath("idigbio_records_search_result.json")
+            .read_text()
+        )
+        return extract_json_schema(data)
+
+    def test_nested_paths_are_indented(self):
+        schema = extract_json_schema({"a": {"b": 1, "c": "x"}, "d:e": [True]})
+        rendered = render_schema(schema)
+        assert rendered.text == '.a\n  .b: integer\n  .c\n."d:e"[]: boolean'
+
+    def test_arrays_of_objects_are_collapsed(self):
+        schema = extract_json_schema([{"name": "John"}, {"name": "Jane"}])
+        rendered = render_schema(schema)
+        assert rendered.text == ".[]\n  .name"
+
+    def test_repeated_sub_schemas_are_deduplicated(self):
+        schema = extract_json_schema({"a": {"x": 1}, "b": {"x": 2}})
+        rendered = render_schema(schema)
+        assert rendered.text == ".a\n  .x: integer\n.b (same as .a)"
+
+    def test_smaller_than_json_schema(self):
+        rendered = render_schema(self.idigbio_schema())
+        assert rendered.rendered_tokens < rendered.original_tokens
+        assert rendered.saved_tokens > 0
+        assert not rendered.omitted_paths
+
+    def test_token_budget_keeps_relevant_fields(self):
+        rendered = render_schema(
+            self.idigbio_schema(), "Get the country of each record", token_budget=200
+        )
+        assert estimate_tokens(rendered.text) <= 200
+        assert rendered.omitted_paths
+        assert '."dwc:country"' in rendered.text
+        assert ".indexTerms.country" not in rendered.omitted_paths
+        assert "less relevant fields omitted" in rendered.text